@@ -0,0 +1,405 @@
+'''
+Long-running annotation daemon keeping database indexes resident.
+
+Opening breakpoint indexes (see breakpoint_index.py) and gene-pair indexes
+(see gene_pair_index.py) is cheap, but a pipeline that annotates one sample
+per process still pays for starting Python, importing every converter and
+faulting the index pages in, for each sample. The daemon opens the indexes
+once and answers annotate requests from any number of clients, which share
+its single memory-mapped copy of them. It runs on asyncio, so clients are
+served concurrently and a slow client does not hold up the others.
+
+The daemon listens on a Unix socket (--socket) or on a TCP port of the
+loopback interface (--port). Both carry the same line protocol. A request
+is a JSON line, e.g.
+
+    {"op": "annotate", "slop": 10}
+
+followed, for annotate, by BEDPE lines and an empty line. The reply is a
+JSON line, {"ok": true, "columns": [...]} or {"ok": false, "error": "..."},
+followed, for annotate, by the annotated rows and an empty line. Each row
+gets one column per breakpoint index (the matching record names, as
+index annotate writes them) and one per gene-pair index (the matching
+record numbers, as names annotate writes them, headed <label>_pair).
+Other requests are 'ping', 'stats', 'reload' (reopen the index files, e.g.
+after index build replaced them) and 'shutdown'. A connection can carry any
+number of requests.
+
+Can be run from the commandline with:
+    python fusebench.py daemon start (--socket <path> | --port <port>) [-x <index_file> ...] [-n <names_file> ...]
+    python fusebench.py daemon annotate (--socket <path> | --port <port>) [-slop <bp>] [-o <out_file>] <bedpe_file>
+    python fusebench.py daemon stop (--socket <path> | --port <port>)
+'''
+
+import asyncio,itertools,json,os,signal,socket,sys,threading,time
+
+import breakpoint_index
+import compressed_io
+import gene_pair_index
+import pair_overlap
+
+HOST = '127.0.0.1'
+
+# Longest request line; BEDPE rows with passthrough sequences can be long
+LINE_LIMIT = 1 << 22
+
+# Rows annotated between yields to other clients
+CHUNK_ROWS = 1024
+
+
+class DaemonError(Exception):
+    '''Raised by the client when the daemon rejects a request'''
+
+
+class Annotator(object):
+    '''
+    The indexes a daemon answers from
+
+    Args:
+        index_paths (list): Breakpoint index files
+        names_paths (list): Gene-pair index files
+    '''
+
+    def __init__(self, index_paths=(), names_paths=()):
+        self.index_paths = list(index_paths)
+        self.names_paths = list(names_paths)
+        self.indexes = []
+        self.names = []
+        self.requests = 0
+        self.rows = 0
+        self.started = time.time()
+        self.open()
+
+    def open(self):
+        indexes = [breakpoint_index.BreakpointIndex(path) for path in self.index_paths]
+        names = [gene_pair_index.GenePairIndex(path) for path in self.names_paths]
+        self.close()
+        self.indexes, self.names = indexes, names
+
+    def close(self):
+        for index in self.indexes + self.names:
+            index.close()
+        self.indexes, self.names = [], []
+
+    def columns(self):
+        return ([index.label for index in self.indexes] +
+                [index.label + '_pair' for index in self.names])
+
+    def annotate(self, rows, slop=0):
+        '''Add the index columns to a list of BEDPE rows'''
+        if self.indexes:
+            rows = breakpoint_index.annotate(rows, self.indexes, slop)
+        if self.names:
+            rows = gene_pair_index.annotate(rows, self.names)
+        return list(rows)
+
+    def stats(self):
+        return {'indexes': self.index_paths, 'names': self.names_paths,
+                'requests': self.requests, 'rows': self.rows,
+                'uptime': round(time.time() - self.started, 3)}
+
+
+class Daemon(object):
+    '''
+    asyncio server answering annotate requests
+
+    Args:
+        annotator (Annotator): Indexes to answer from
+    '''
+
+    def __init__(self, annotator):
+        self.annotator = annotator
+        self.stopped = None
+
+    async def reply(self, writer, **fields):
+        writer.write((json.dumps(fields) + '\n').encode('utf8'))
+        await writer.drain()
+
+    async def annotate(self, request, reader, writer):
+        try:
+            slop = int(request.get('slop', 0))
+        except (TypeError, ValueError):
+            await self.reply(writer, ok=False, error='Bad slop: {}'.format(request['slop']))
+            return False
+        await self.reply(writer, ok=True, columns=self.annotator.columns())
+        chunk = []
+        while True:
+            line = (await reader.readline()).decode('utf8')
+            if line.strip():
+                row = line.rstrip('\r\n').split('\t')
+                if len(row) >= 6:
+                    chunk.append(row)
+            if chunk and (len(chunk) >= CHUNK_ROWS or not line.strip()):
+                out_rows = self.annotator.annotate(chunk, slop)
+                self.annotator.rows += len(out_rows)
+                writer.write(''.join('\t'.join(row) + '\n' for row in out_rows).encode('utf8'))
+                chunk = []
+                await writer.drain()
+            if not line.strip():
+                break
+        writer.write(b'\n')
+        await writer.drain()
+        return True
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                try:
+                    request = json.loads(line.decode('utf8'))
+                    op = request['op']
+                except (ValueError, KeyError, TypeError):
+                    await self.reply(writer, ok=False, error='Bad request: {}'.format(
+                        line.decode('utf8', 'replace').strip()[:200]))
+                    break
+                self.annotator.requests += 1
+                if op == 'annotate':
+                    if not await self.annotate(request, reader, writer):
+                        break
+                elif op == 'ping':
+                    await self.reply(writer, ok=True)
+                elif op == 'stats':
+                    await self.reply(writer, ok=True, **self.annotator.stats())
+                elif op == 'reload':
+                    try:
+                        self.annotator.open()
+                    except (IOError, OSError, ValueError) as err:
+                        await self.reply(writer, ok=False, error=str(err))
+                    else:
+                        await self.reply(writer, ok=True, columns=self.annotator.columns())
+                elif op == 'shutdown':
+                    await self.reply(writer, ok=True)
+                    self.stopped.set()
+                    break
+                else:
+                    await self.reply(writer, ok=False, error='Unknown op: {}'.format(op))
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, path=None, port=None):
+        '''Serve on a Unix socket path or a loopback port until shut down'''
+        self.stopped = asyncio.Event()
+        if path is not None:
+            server = await asyncio.start_unix_server(self.handle, path, limit=LINE_LIMIT)
+        else:
+            server = await asyncio.start_server(self.handle, HOST, port, limit=LINE_LIMIT)
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(signum, self.stopped.set)
+            except (NotImplementedError, RuntimeError):
+                pass
+        async with server:
+            await self.stopped.wait()
+
+
+def remove_stale_socket(path):
+    '''Remove a socket file left by a daemon that is gone; fail if one is listening'''
+    if not os.path.exists(path):
+        return
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except (ConnectionRefusedError, FileNotFoundError):
+        os.remove(path)
+    else:
+        raise ValueError('A daemon is already listening on {}'.format(path))
+    finally:
+        probe.close()
+
+
+def connect(path=None, port=None):
+    '''Open a connection to a daemon'''
+    if path is not None:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(path)
+    else:
+        sock = socket.create_connection((HOST, port))
+    return sock
+
+
+class Client(object):
+    '''
+    Blocking client of a daemon, for use from pipeline workers
+
+    Args:
+        path (str): Unix socket of the daemon
+        port (int): Loopback port of the daemon, if no path is given
+    '''
+
+    def __init__(self, path=None, port=None):
+        self.sock = connect(path, port)
+        self.inf = self.sock.makefile('r', encoding='utf8', newline='\n')
+        self.lock = threading.Lock()
+
+    def close(self):
+        self.inf.close()
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def send(self, text):
+        self.sock.sendall(text.encode('utf8'))
+
+    def response(self):
+        line = self.inf.readline()
+        if not line:
+            raise DaemonError('The daemon closed the connection')
+        reply = json.loads(line)
+        if not reply.get('ok'):
+            raise DaemonError(reply.get('error', 'Request failed'))
+        return reply
+
+    def request(self, op, **fields):
+        '''Send a request without a body and return the reply'''
+        fields['op'] = op
+        with self.lock:
+            self.send(json.dumps(fields) + '\n')
+            return self.response()
+
+    def annotate(self, rows, slop=0):
+        '''
+        Annotate BEDPE rows
+
+        Rows are sent from a separate thread while replies are read, so
+        inputs of any size stream through without filling socket buffers.
+
+        Args:
+            rows (iterable): BEDPE rows (lists of strings)
+            slop (int): Largest gap between matching ends
+        Returns:
+            tuple: (added column names, generator of annotated rows)
+        '''
+        rows = iter(rows)
+        self.lock.acquire()
+        try:
+            self.send(json.dumps({'op': 'annotate', 'slop': slop}) + '\n')
+            columns = self.response()['columns']
+        except BaseException:
+            self.lock.release()
+            raise
+        errors = []
+
+        def send_rows():
+            try:
+                for batch in iter(lambda: list(itertools.islice(rows, CHUNK_ROWS)), []):
+                    self.send(''.join('\t'.join(row) + '\n' for row in batch))
+            except BaseException as err:
+                errors.append(err)
+            finally:
+                try:
+                    self.send('\n')
+                except OSError:
+                    pass
+
+        sender = threading.Thread(target=send_rows, daemon=True)
+        sender.start()
+
+        def results():
+            try:
+                for line in self.inf:
+                    if line == '\n':
+                        break
+                    yield line.rstrip('\n').split('\t')
+                else:
+                    raise DaemonError('The daemon closed the connection')
+                sender.join()
+                if errors:
+                    raise errors[0]
+            finally:
+                self.lock.release()
+        return columns, results()
+
+
+def add_address_arguments(parser):
+    address = parser.add_mutually_exclusive_group(required=True)
+    address.add_argument('--socket', dest='socket', metavar='<path>',
+                         help='Unix socket of the daemon')
+    address.add_argument('--port', dest='port', type=int, metavar='<port>',
+                         help='TCP port of the daemon on {}'.format(HOST))
+
+
+def add_daemon_parser(subparsers):
+    parser = subparsers.add_parser('daemon', help='Serve annotations from resident indexes')
+    daemon_parsers = parser.add_subparsers(dest='daemon_command', metavar='<daemon-command>')
+    daemon_parsers.required = True
+
+    start_parser = daemon_parsers.add_parser('start', help='Run the daemon in the foreground')
+    add_address_arguments(start_parser)
+    start_parser.add_argument('-x', dest='indexes', action='append', default=[],
+                              metavar='<index-file>', help='Breakpoint index to annotate with')
+    start_parser.add_argument('-n', dest='names', action='append', default=[],
+                              metavar='<names-file>', help='Gene-pair index to annotate with')
+    start_parser.set_defaults(func=run_daemon_start)
+
+    annotate_parser = daemon_parsers.add_parser('annotate',
+                                                help='Annotate BEDPE through a running daemon')
+    add_address_arguments(annotate_parser)
+    annotate_parser.add_argument('bedpe', metavar='<bedpe-file>', help='BEDPE to annotate')
+    annotate_parser.add_argument('-slop', dest='slop', type=int, default=0,
+                                 help='Largest gap between matching ends (default 0)')
+    annotate_parser.add_argument('-o', dest='outf', metavar='<out-file>',
+                                 help='Output destination (default STDOUT)')
+    annotate_parser.set_defaults(func=run_daemon_annotate)
+
+    for name, help_text in (('stats', 'Show what a running daemon serves'),
+                            ('reload', 'Make a running daemon reopen its index files'),
+                            ('stop', 'Shut a running daemon down')):
+        command_parser = daemon_parsers.add_parser(name, help=help_text)
+        add_address_arguments(command_parser)
+        command_parser.set_defaults(func=run_daemon_request, op={'stop': 'shutdown'}.get(name, name))
+    return parser
+
+
+def run_daemon_start(args):
+    if not args.indexes and not args.names:
+        raise ValueError('Give at least one index with -x or -n')
+    if args.socket:
+        remove_stale_socket(args.socket)
+    annotator = Annotator(args.indexes, args.names)
+    sys.stderr.write('fusebench daemon: serving {} on {}\n'.format(
+        ', '.join(annotator.columns()), args.socket or '{}:{}'.format(HOST, args.port)))
+    try:
+        asyncio.run(Daemon(annotator).serve(args.socket, args.port))
+    finally:
+        annotator.close()
+        if args.socket and os.path.exists(args.socket):
+            os.remove(args.socket)
+    return 0
+
+
+def run_daemon_annotate(args):
+    with Client(args.socket, args.port) as client:
+        with compressed_io.open_input(args.bedpe) as inf:
+            with compressed_io.open_output(args.outf) as outf:
+                header = inf.readline()
+                if header.startswith('#') or header.split('\t')[1:2] == ['start1']:
+                    lines = inf
+                else:
+                    header, lines = None, itertools.chain([header], inf)
+                columns, rows = client.annotate(pair_overlap.read_bedpe(lines), args.slop)
+                if header is not None:
+                    outf.write(header.rstrip('\r\n') + ''.join(
+                        '\t' + column for column in columns) + '\n')
+                for row in rows:
+                    outf.write('\t'.join(row) + '\n')
+    return 0
+
+
+def run_daemon_request(args):
+    with Client(args.socket, args.port) as client:
+        reply = client.request(args.op)
+    reply.pop('ok', None)
+    if reply:
+        sys.stdout.write(json.dumps(reply, indent=2) + '\n')
+    return 0
@@ -0,0 +1,242 @@
+'''
+Convert a whole cohort directory of caller outputs to BEDPE in parallel.
+
+The input tree follows the <caller>/<sample>/<file> layout used by
+pipeline/Makefile, e.g.
+
+    aml_cell_line_examples/fusioncatcher/A34048/final-list_candidate-fusion-genes.GRCh37.txt
+
+or <caller>/<sample>.<suffix> for callers that write one file per sample,
+e.g. pavfinder/A34048.events.bedpe.
+Every file whose header matches a registered format becomes one job writing
+<outdir>/<sample>.<caller>.bedpe. Jobs run on a process pool, each output is
+written atomically, and results are reported in input order.
+
+Can be run from the commandline with:
+    python fusebench.py batch -d <output_dir> [-j <workers>] <input_dir>
+    python fusebench.py batch -d <output_dir> --where 'star_fusion:JunctionReadCount >= 3' \
+        --where 'fusioncatcher:Spanning_unique_reads >= 2' <input_dir>
+'''
+
+import os,sys,time
+from concurrent.futures import ProcessPoolExecutor
+
+import bedpe_engine
+import external_sort
+import genes
+import quarantine
+import registry
+import validate_bedpe
+
+SUMMARY_FIELDS = ['sample', 'caller', 'format', 'input', 'output',
+                  'status', 'rows', 'quarantined', 'seconds', 'validation', 'error']
+
+
+class Job(object):
+    '''One input file to convert'''
+
+    def __init__(self, caller, sample, inf_path, fmt):
+        self.caller = caller
+        self.sample = sample
+        self.inf_path = inf_path
+        self.fmt = fmt
+        self.outf_path = None
+        self.validate = False
+        self.max_errors = None
+        self.quarantine = False
+        self.error_budget = None
+        self.normalized = True
+        self.ordered = False
+        self.genes = None
+        self.where = None
+        self.sort = False
+        self.spill_rows = None
+        self.tmp_dir = None
+
+
+def find_jobs(root):
+    '''
+    Find every convertible file below root
+
+    Args:
+        root (str): Directory laid out as <caller>/<sample>/<file>, or
+            <caller>/<sample>.<suffix> for callers writing one file per sample
+    Returns:
+        list: Job for each file whose header matches a registered format,
+            in sorted path order
+    '''
+    jobs = []
+    for caller in sorted(os.listdir(root)):
+        caller_dir = os.path.join(root, caller)
+        if not os.path.isdir(caller_dir):
+            continue
+        for entry in sorted(os.listdir(caller_dir)):
+            entry_path = os.path.join(caller_dir, entry)
+            if os.path.isfile(entry_path):
+                # <caller>/<sample>.events.bedpe, as PAVfinder writes them
+                candidates = [(entry.split('.', 1)[0], entry_path)]
+            elif os.path.isdir(entry_path):
+                candidates = [(entry, os.path.join(entry_path, name))
+                              for name in sorted(os.listdir(entry_path))]
+            else:
+                continue
+            for sample, path in candidates:
+                if not os.path.isfile(path):
+                    continue
+                try:
+                    converter = registry.sniff_file(path)
+                except (IOError, OSError, UnicodeDecodeError):
+                    converter = None
+                if converter is not None:
+                    jobs.append(Job(caller, sample, path, converter.name))
+    return jobs
+
+
+def assign_outputs(jobs, outdir):
+    '''
+    Name each job's output, disambiguating samples with several inputs
+    from the same caller by the input file name
+    '''
+    counts = dict()
+    for job in jobs:
+        key = (job.sample, job.caller)
+        counts[key] = counts.get(key, 0) + 1
+    for job in jobs:
+        parts = [job.sample, job.caller]
+        if counts[(job.sample, job.caller)] > 1:
+            parts.append(os.path.splitext(os.path.basename(job.inf_path))[0])
+        job.outf_path = os.path.join(outdir, '.'.join(parts) + '.bedpe')
+    return jobs
+
+
+def run_job(job):
+    '''
+    Convert one job's input, capturing any failure
+
+    Returns:
+        dict: one summary row for the job
+    '''
+    started = time.time()
+    result = {'sample': job.sample, 'caller': job.caller, 'format': job.fmt,
+              'input': job.inf_path, 'output': job.outf_path,
+              'status': 'ok', 'rows': 0, 'quarantined': '', 'validation': '', 'error': ''}
+    validator = None
+    if job.validate:
+        validator = validate_bedpe.Validator(max_errors=job.max_errors)
+    rejected = None
+    if job.quarantine:
+        rejected = quarantine.Quarantine(*(job.error_budget or (None, None)))
+    sorter = None
+    if job.sort:
+        sorter = external_sort.ExternalSorter(job.spill_rows, tmp_dir=job.tmp_dir)
+    try:
+        resolver = genes.load(job.genes) if job.genes else None
+        result['rows'] = registry.convert_file(job.inf_path, job.outf_path,
+                                               job.fmt, validator, normalized=job.normalized,
+                                               quarantine=rejected, resolver=resolver,
+                                               where=job.where, sorter=sorter,
+                                               ordered=job.ordered)
+        if validator is not None:
+            result['validation'] = 'valid' if validator.is_valid() else 'invalid'
+    except Exception as err:
+        result['status'] = 'failed'
+        result['error'] = '{}: {}'.format(type(err).__name__, err)
+    if rejected is not None:
+        result['quarantined'] = len(rejected)
+    result['seconds'] = '{:.3f}'.format(time.time() - started)
+    return result
+
+
+def run_batch(jobs, workers=None):
+    '''
+    Run jobs on a process pool
+
+    Args:
+        jobs (list): Jobs with outputs assigned
+        workers (int): Pool size (default: one per CPU)
+    Returns:
+        generator: summary rows, in the order of jobs
+    '''
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(jobs) < 2:
+        for job in jobs:
+            yield run_job(job)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for result in executor.map(run_job, jobs):
+            yield result
+
+
+def write_summary(results, outf):
+    '''Write summary rows as TSV and return the number of failures'''
+    failed = 0
+    outf.write('\t'.join(SUMMARY_FIELDS) + '\n')
+    for result in results:
+        if result['status'] != 'ok' or result['validation'] == 'invalid':
+            failed += 1
+        outf.write('\t'.join(str(result[field]) for field in SUMMARY_FIELDS) + '\n')
+        outf.flush()
+    return failed
+
+
+def parse_format_where(value):
+    '''Parse a [<format>:]<expression> argument into (format or None, RowFilter)'''
+    fmt, sep, expression = value.partition(':')
+    if not sep or fmt.strip() not in registry.format_names():
+        return None, bedpe_engine.parse_where(value)
+    return fmt.strip(), bedpe_engine.parse_where(expression)
+
+
+def add_batch_parser(subparsers):
+    parser = subparsers.add_parser('batch',
+                                   help='Convert a <caller>/<sample>/ tree in parallel')
+    parser.add_argument('root', metavar='<in-dir>',
+                        help='Directory of per-caller, per-sample outputs')
+    parser.add_argument('-d', dest='outdir', metavar='<out-dir>', required=True,
+                        help='Directory receiving <sample>.<caller>.bedpe files')
+    parser.add_argument('-j', dest='workers', metavar='<workers>', type=int,
+                        help='Number of worker processes (default: one per CPU)')
+    parser.add_argument('-s', dest='summary', metavar='<summary-file>',
+                        help='Per-file summary destination (default STDOUT)')
+    bedpe_engine.add_validate_arguments(parser)
+    bedpe_engine.add_quarantine_arguments(parser)
+    bedpe_engine.add_normalize_argument(parser)
+    parser.add_argument('--where', dest='where', action='append', type=parse_format_where,
+                        metavar='[<format>:]<expression>',
+                        help="Only write rows matching an expression (see row_filter.py). "
+                             "With a format prefix, e.g. 'star_fusion:JunctionReadCount >= 3', "
+                             "it applies to that format only; repeat for other formats. An "
+                             "expression without one applies to the remaining formats")
+    # Files are already converted in parallel, so runs are sorted in the workers
+    bedpe_engine.add_sort_arguments(parser, workers=False)
+    parser.set_defaults(func=run_batch_command)
+    return parser
+
+
+def run_batch_command(args):
+    '''
+    Convert every recognised file below args.root
+    '''
+    jobs = assign_outputs(find_jobs(args.root), args.outdir)
+    # Formats have different passthrough columns, so filters can be per format
+    wheres = dict(args.where or [])
+    for job in jobs:
+        job.validate = args.validate
+        job.max_errors = args.max_errors
+        job.quarantine = args.quarantine
+        job.error_budget = args.error_budget
+        job.normalized = args.normalized
+        job.ordered = args.ordered
+        job.genes = args.genes
+        job.where = wheres.get(job.fmt, wheres.get(None))
+        job.sort = args.sort
+        job.spill_rows = args.spill_rows
+        job.tmp_dir = args.tmp_dir
+    if not os.path.isdir(args.outdir):
+        os.makedirs(args.outdir)
+    results = run_batch(jobs, args.workers)
+    with open(args.summary, 'w') if args.summary else sys.stdout as outf:
+        failed = write_summary(results, outf)
+    sys.stderr.write('fusebench batch: {} converted, {} failed\n'.format(
+        len(jobs) - failed, failed))
+    return 1 if failed else 0
@@ -0,0 +1,475 @@
+'''
+Shared streaming conversion engine behind the *_to_bedpe.py converters.
+
+Each converter describes its input format once as a Converter. When the
+input header has been read, the converter's column mapping is compiled into a
+positional transform over csv.reader rows (lists), so the per-row work is a
+handful of index lookups instead of building and scanning dicts. Rows are
+streamed through in bounded batches, so memory use does not grow with the
+size of the input.
+'''
+
+import argparse,sys,csv,time
+from contextlib import contextmanager, nullcontext
+from itertools import islice
+from operator import itemgetter
+
+import columnar
+import compressed_io
+import external_sort
+import genes
+import metrics
+import normalize
+import quarantine
+import row_filter
+import validate_bedpe
+
+BEDPE_FIELDS = normalize.BEDPE_FIELDS
+
+# Number of rows read, mapped and written at a time
+BATCH_SIZE = 8192
+
+
+class Converter(object):
+    '''
+    Description of one caller or database output format.
+
+    Args:
+        name (str): Short name of the format, e.g. 'star_fusion'
+        compile_core (callable): Called once with a {heading: position}
+            mapping of the input header. Returns a function mapping one input
+            row (list) to a list of values for core_fields.
+        extra_fields (list or callable): Input headings passed through after
+            the core fields, or a function of the input headings returning
+            them. Headings missing from the input are written as '.'.
+        core_fields (list): Headings produced by compile_core
+        delimiter (str): Input field delimiter
+        signature (list): Input headings that identify the format when
+            sniffing a header line
+    '''
+
+    def __init__(self, name, compile_core, extra_fields=(),
+                 core_fields=BEDPE_FIELDS, delimiter='\t', signature=()):
+        self.name = name
+        self.compile_core = compile_core
+        self.extra_fields = extra_fields
+        self.core_fields = list(core_fields)
+        self.delimiter = delimiter
+        self.signature = frozenset(signature)
+
+    def matches(self, header_line):
+        '''Return True if header_line looks like the header of this format'''
+        if not self.signature:
+            return False
+        in_fields = next(csv.reader([header_line], delimiter=self.delimiter), [])
+        return self.signature.issubset(in_fields)
+
+    def output_fields(self, in_fields):
+        '''Return the output headings for an input with in_fields'''
+        extra = self.extra_fields
+        if callable(extra):
+            extra = extra(in_fields)
+        return self.core_fields + list(extra)
+
+    def compile(self, in_fields):
+        '''
+        Compile the column mapping for one input header
+
+        Args:
+            in_fields (list): Headings of the input file
+        Returns:
+            tuple: (output headings, function mapping an input row to a list)
+        '''
+        index = dict()
+        for pos, heading in enumerate(in_fields):
+            index.setdefault(heading, pos)
+        map_core = self.compile_core(index)
+        out_fields = self.output_fields(in_fields)
+
+        width = len(in_fields)
+        # Missing passthrough columns read a '.' appended past the last column
+        positions = [index.get(heading, width)
+                     for heading in out_fields[len(self.core_fields):]]
+        fill = width in positions
+        if len(positions) > 1:
+            get_extra = itemgetter(*positions)
+        elif positions:
+            get_extra = lambda row, pos=positions[0]: (row[pos],)
+        else:
+            get_extra = lambda row: ()
+
+        def transform(row):
+            if len(row) != width:
+                row = row[:width] + [''] * (width - len(row))
+            out_row = map_core(row)
+            if fill:
+                row.append('.')
+            out_row.extend(get_extra(row))
+            return out_row
+        return out_fields, transform
+
+
+def convert_batches(converter, inf, batch_size=BATCH_SIZE, normalized=True, stage=None,
+                    quarantine=None, resolver=None, where=None, ordered=False):
+    '''
+    Map one input file through a converter, batch by batch
+
+    Args:
+        converter (Converter): Input format description
+        inf (iterable): Text lines starting at the input header
+        batch_size (int): Number of rows held in memory at a time
+        normalized (bool): Canonicalise chromosomes (see normalize.py)
+        stage (metrics.StageMetrics): If given, counts input rows and times
+            the parse, map and normalize phases
+        quarantine (quarantine.Quarantine): If given, receives the rows the
+            converter fails to map instead of stopping the conversion
+        resolver (genes.GeneResolver): If given, rewrites names as current
+            gene symbols (see genes.py)
+        where (row_filter.RowFilter): If given, only rows it keeps are
+            passed on (see row_filter.py)
+        ordered (bool): With normalized, also put the lower breakpoint
+            first, losing the caller's 5'/3' order of the ends
+    Returns:
+        tuple: (output headings, generator of lists of output rows)
+    Raises:
+        row_filter.FilterError: if where does not fit the input headings
+    '''
+    reader = csv.reader(inf, delimiter=converter.delimiter)
+    in_fields = next(reader, None)
+    if in_fields is None:
+        in_fields = []
+    out_fields, transform = converter.compile(in_fields)
+    keep = where.compile(out_fields) if where is not None else None
+    # A filter on passthrough columns only sees the same values before
+    # normalizing, so it runs first and rejected rows are never normalized
+    early = keep is not None and not set(where.columns()) & set(converter.core_fields)
+    normalizer = normalize.Normalizer(ordered) if normalized else None
+    width = len(in_fields)
+
+    def map_batch(batch, number):
+        if quarantine is None:
+            return [transform(row) for row in batch if row]
+        return quarantine.map_rows(transform, batch, number, width)
+
+    def batches():
+        # Line 1 is the header
+        number = 2
+        for batch in compressed_io.iter_batches(reader, batch_size):
+            out_rows = map_batch(batch, number)
+            number += len(batch)
+            if early:
+                out_rows = list(filter(keep, out_rows))
+            if normalizer is not None:
+                normalizer.normalize_rows(out_rows)
+            if resolver is not None:
+                resolver.resolve_rows(out_rows)
+            if keep is not None and not early:
+                out_rows = list(filter(keep, out_rows))
+            yield out_rows
+
+    def timed_batches():
+        clock = time.perf_counter
+        rows = iter(reader)
+        number = 2
+        while True:
+            started = clock()
+            batch = list(islice(rows, batch_size))
+            parsed = clock()
+            stage.add('parse', parsed - started)
+            if not batch:
+                return
+            stage.rows_in += len(batch)
+            out_rows = map_batch(batch, number)
+            number += len(batch)
+            mapped = clock()
+            stage.add('map', mapped - parsed)
+            if early:
+                out_rows = list(filter(keep, out_rows))
+                filtered = clock()
+                stage.add('filter', filtered - mapped)
+                mapped = filtered
+            if normalizer is not None:
+                normalizer.normalize_rows(out_rows)
+            normalized_at = clock()
+            stage.add('normalize', normalized_at - mapped)
+            if resolver is not None:
+                resolver.resolve_rows(out_rows)
+                resolved = clock()
+                stage.add('resolve', resolved - normalized_at)
+                normalized_at = resolved
+            if keep is not None and not early:
+                out_rows = list(filter(keep, out_rows))
+                stage.add('filter', clock() - normalized_at)
+            yield out_rows
+    return out_fields, batches() if stage is None else timed_batches()
+
+
+def convert(converter, inf, outf, batch_size=BATCH_SIZE, validator=None, report=None,
+            cache=None, normalized=True, stage=None, quarantine=None, resolver=None,
+            where=None, sorter=None, ordered=False):
+    '''
+    Stream one input file through a converter
+
+    Args:
+        converter (Converter): Input format description
+        inf (iterable): Text lines starting at the input header
+        outf (file): Text stream receiving BEDPE
+        batch_size (int): Number of rows held in memory at a time
+        validator (validate_bedpe.Validator): If given, every emitted row is
+            checked with the validate_bedpe rules as it is written
+        report (file): Text stream receiving the validation report
+        cache (columnar.CacheWriter): If given, receives every emitted row,
+            labelled with the converter name as its caller
+        normalized (bool): Canonicalise chromosomes (see normalize.py)
+        stage (metrics.StageMetrics): If given, counts rows and times every
+            phase of the conversion
+        quarantine (quarantine.Quarantine): If given, receives the rows the
+            converter fails to map instead of stopping the conversion
+        resolver (genes.GeneResolver): If given, rewrites names as current
+            gene symbols (see genes.py)
+        where (row_filter.RowFilter): If given, rows it rejects are not
+            written (see row_filter.py)
+        sorter (external_sort.ExternalSorter): If given, rows are written
+            sorted by chrom1, chrom2, start1 and start2, spilling to disk
+            beyond its spill size (see external_sort.py)
+        ordered (bool): With normalized, also put the lower breakpoint
+            first, losing the caller's 5'/3' order of the ends
+    Returns:
+        int: the number of rows written
+    Raises:
+        quarantine.ErrorBudgetExceeded: if more rows fail than the
+            quarantine's error budget allows
+        row_filter.FilterError: if where does not fit the input headings
+    '''
+    out_fields, batches = convert_batches(converter, inf, batch_size, normalized, stage,
+                                          quarantine, resolver, where, ordered)
+    if sorter is not None:
+        batches = sorter.sorted_batches(batches, stage)
+    writer = csv.writer(outf, delimiter='\t', lineterminator='\n')
+    writer.writerow(out_fields)
+    if validator is not None:
+        validator.set_header(out_fields)
+        validate_bedpe.write_report_header(report)
+    clock = time.perf_counter
+    count = 0
+    for out_rows in batches:
+        started = clock()
+        writer.writerows(out_rows)
+        written = clock()
+        if validator is not None:
+            # Line 1 of the output is the header
+            errors = validator.check_values(out_rows, count + 2)
+            validate_bedpe.write_errors(errors, report)
+        validated = clock()
+        if cache is not None:
+            cache.add_rows(out_rows, out_fields, converter.name)
+        count += len(out_rows)
+        if stage is not None:
+            stage.add('write', written - started)
+            if validator is not None:
+                stage.add('validate', validated - written)
+            if cache is not None:
+                stage.add('cache', clock() - validated)
+    if validator is not None:
+        validator.write_summary(report)
+    if quarantine is not None:
+        quarantine.write_summary()
+        quarantine.check_fraction(final=True)
+    if stage is not None:
+        stage.rows_out += count
+    return count
+
+
+def report_path(outf_path):
+    '''Name the validation report written beside a BEDPE output'''
+    return outf_path + '.validated'
+
+
+def quarantine_path(outf_path):
+    '''Name the quarantine written beside a BEDPE output'''
+    return outf_path + '.quarantine'
+
+
+def get_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-i', dest='inf', metavar='<in-file>',
+                        help='File to parse, plain or gzip/BGZF (default STDIN)')
+    parser.add_argument('-o', dest='outf', metavar='<out-file>',
+                        help='Output BEDPE destination, BGZF if it ends in .gz '
+                             '(default STDOUT)')
+    add_validate_arguments(parser)
+    add_quarantine_arguments(parser)
+    add_normalize_argument(parser)
+    add_where_argument(parser)
+    add_sort_arguments(parser)
+    parser.add_argument('--columnar', dest='columnar', metavar='<cache-file>',
+                        help='Also write the rows as a columnar cache (see columnar.py)')
+    metrics.add_metrics_arguments(parser)
+    return parser
+
+
+def add_validate_arguments(parser):
+    parser.add_argument('--validate', action='store_true',
+                        help='Validate rows as they are written; the report goes '
+                             'to <out-file>.validated (default STDERR)')
+    parser.add_argument('--max-errors', dest='max_errors', type=int, metavar='<n>',
+                        help='Stop reporting after <n> violations')
+
+
+def add_quarantine_arguments(parser):
+    parser.add_argument('--quarantine', action='store_true',
+                        help='Divert rows that cannot be converted to <out-file>.quarantine '
+                             '(default STDERR) instead of stopping')
+    parser.add_argument('--error-budget', dest='error_budget', type=quarantine.parse_budget,
+                        metavar='<n>|<p>%',
+                        help='With --quarantine, stop once more than <n> rows, or <p>%% of '
+                             'the rows read, are quarantined (default: no limit)')
+
+
+def make_quarantine(args):
+    '''Return a Quarantine if one was requested on the command line'''
+    if not args.quarantine:
+        return None
+    max_rows, max_fraction = args.error_budget or (None, None)
+    return quarantine.Quarantine(max_rows, max_fraction)
+
+
+def add_normalize_argument(parser):
+    parser.add_argument('--no-normalize', dest='normalized', action='store_false',
+                        help="Keep the caller's chromosome names")
+    parser.add_argument('--order-ends', dest='ordered', action='store_true',
+                        help="Put the lower breakpoint of each pair first. The name and "
+                             "passthrough columns keep the caller's order, so the 5'/3' "
+                             "orientation of swapped rows is lost")
+    parser.add_argument('--genes', dest='genes', metavar='<annotation-file>',
+                        help='Rewrite names as SYMBOL1--SYMBOL2 using an HGNC or '
+                             'alias<TAB>symbol file (see genes.py)')
+
+
+def parse_where(expression):
+    '''Parse a --where argument, reporting syntax errors as usage errors'''
+    try:
+        return row_filter.RowFilter(expression)
+    except row_filter.FilterError as err:
+        raise argparse.ArgumentTypeError(str(err))
+
+
+def add_where_argument(parser):
+    parser.add_argument('--where', dest='where', type=parse_where, metavar='<expression>',
+                        help="Only write rows matching an expression over the output "
+                             "columns, e.g. 'JunctionReadCount >= 3' (see row_filter.py)")
+
+
+def add_sort_arguments(parser, workers=True):
+    parser.add_argument('--sort', action='store_true',
+                        help='Write rows sorted by chrom1, chrom2, start1 and start2, in '
+                             'bounded memory (see external_sort.py)')
+    parser.add_argument('--spill-rows', dest='spill_rows', type=external_sort.positive_int,
+                        default=external_sort.SPILL_ROWS, metavar='<rows>',
+                        help='With --sort, rows sorted in memory before a run is spilled '
+                             'to disk (default %(default)s)')
+    if workers:
+        parser.add_argument('--sort-workers', dest='sort_workers',
+                            type=external_sort.positive_int, default=1, metavar='<workers>',
+                            help='With --sort, number of processes sorting runs (default 1)')
+    parser.add_argument('--tmp-dir', dest='tmp_dir', metavar='<dir>',
+                        help='With --sort, directory for spilled runs '
+                             '(default: system temporary directory)')
+
+
+def make_sorter(args):
+    '''Return an ExternalSorter if sorting was requested on the command line'''
+    if not getattr(args, 'sort', False):
+        return None
+    return external_sort.ExternalSorter(args.spill_rows, getattr(args, 'sort_workers', 1),
+                                        args.tmp_dir)
+
+
+def make_resolver(args):
+    '''Return the GeneResolver requested on the command line, or None'''
+    if not getattr(args, 'genes', None):
+        return None
+    return genes.load(args.genes)
+
+
+@contextmanager
+def open_quarantine(rejected, outf_path):
+    '''
+    Attach a Quarantine (if not None) to <outf_path>.quarantine, or to
+    STDERR for STDOUT, for the duration of the block
+
+    The quarantine file is kept when the block stops with
+    ErrorBudgetExceeded, and removed if it raises anything else.
+    '''
+    if rejected is None:
+        yield None
+    elif not outf_path:
+        rejected.attach(sys.stderr)
+        yield rejected
+    else:
+        exceeded = None
+        with compressed_io.atomic_open(quarantine_path(outf_path)) as outf:
+            rejected.attach(outf)
+            try:
+                yield rejected
+            except quarantine.ErrorBudgetExceeded as err:
+                # Keep the rows that explain why the conversion stopped
+                rejected.write_summary()
+                exceeded = err
+        if exceeded is not None:
+            raise exceeded
+
+
+def make_validator(args):
+    '''Return a Validator if validation was requested on the command line'''
+    if not args.validate:
+        return None
+    return validate_bedpe.Validator(max_errors=args.max_errors)
+
+
+def main(converter, argv=None):
+    '''
+    Command-line entry point shared by the converters.
+    '''
+    # Get args
+    parser = get_parser()
+    args = parser.parse_args(argv)
+    return metrics.run_instrumented(args, converter.name,
+                                    lambda run: convert_main(converter, args, run))
+
+
+def convert_main(converter, args, run=None):
+    '''Convert as asked on the command line, recording into run if given'''
+    validator = make_validator(args)
+    cache = columnar.CacheWriter() if args.columnar else None
+    stage = run.stage('convert', input=args.inf or '-', format=converter.name) if run else None
+    resolver = make_resolver(args)
+    # -o only appears once complete; STDOUT and STDERR are left open
+    try:
+        with compressed_io.open_input(args.inf, newline='') as inf:
+            with compressed_io.atomic_open(args.outf) if args.outf else nullcontext(sys.stdout) as outf:
+                with open_quarantine(make_quarantine(args), args.outf) as rejected:
+                    if validator is None:
+                        convert(converter, inf, outf, cache=cache,
+                                normalized=args.normalized, stage=stage, quarantine=rejected,
+                                resolver=resolver, where=args.where, sorter=make_sorter(args),
+                                ordered=args.ordered)
+                    else:
+                        with compressed_io.atomic_open(report_path(args.outf)) if args.outf \
+                                else nullcontext(sys.stderr) as report:
+                            convert(converter, inf, outf, validator=validator, report=report,
+                                    cache=cache, normalized=args.normalized, stage=stage,
+                                    quarantine=rejected, resolver=resolver, where=args.where,
+                                    sorter=make_sorter(args), ordered=args.ordered)
+    except quarantine.ErrorBudgetExceeded as err:
+        sys.stderr.write('{}: {}\n'.format(converter.name, err))
+        return 1
+    if cache is not None:
+        cache.write(args.columnar)
+    if stage is not None:
+        stage.bytes_read = metrics.file_size(args.inf)
+        stage.bytes_written = metrics.file_size(args.outf)
+        stage.finish()
+    if validator is not None and not validator.is_valid():
+        return 1
+    return 0
@@ -0,0 +1,615 @@
+'''
+Synthetic caller outputs and throughput benchmarks for the converters.
+
+Every format fusebench reads has a generator writing schema-correct,
+reproducible input of any size: the callers STAR-Fusion, FusionCatcher,
+EricScript, SOAPfuse, FusionMap, JAFFA and INFUSION, and the databases
+PanCan, CIViC and ChimerDB. All generators of one seed draw from the same
+pool of fusion events, each caller reporting most of them with a few bp of
+breakpoint jitter and adding calls of its own, so merges and database
+lookups find realistic overlaps.
+
+A run times, for each input size,
+
+    convert    each format to BEDPE (registry.convert_file)
+    validate   the converted BEDPE of each caller
+    merge      the BEDPE of all callers into events (N-way)
+    index      each database into a breakpoint index
+    annotate   the merged events against all database indexes
+
+and reports rows/s, MB/s of input and peak RSS. Every case runs in a fresh
+process, so peak RSS is that of the case alone. Giving several sizes gives
+the scaling curve of each case.
+
+Can be run from the commandline with:
+    python fusebench.py bench generate -f <format> -n <rows> [-seed <n>] -o <output_file>
+    python fusebench.py bench run [-n <rows>,<rows>...] [-f <format> ...] [-d <work_dir>]
+        [-r <repeat>] [--baseline <results_file>] [-o <results_file>]
+
+With --baseline, a case whose rows/s drops by more than --tolerance against
+an earlier results file is reported, and the run exits with status 1.
+'''
+
+import csv,os,random,shutil,sys,tempfile,time
+from multiprocessing import Pool
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+import bedpe_engine
+import breakpoint_index
+import compressed_io
+import merge_calls
+import pair_overlap
+import registry
+import validate_bedpe
+
+RESULT_FIELDS = ['phase', 'format', 'size', 'rows', 'seconds', 'rows_per_s',
+                 'mb_per_s', 'peak_rss_mb']
+
+DEFAULT_SIZES = [10000, 100000]
+DEFAULT_TOLERANCE = 0.2
+
+# Chance that a caller reports a pooled event, rather than a call of its own
+RECALL = 0.7
+
+CHROMS = [str(number) for number in range(1, 23)] + ['X', 'Y']
+
+# Real fusions, so that names look like those of known drivers
+KNOWN_PAIRS = [('BCR', 'ABL1', '22', 23632600, '9', 133729451),
+               ('KMT2A', 'MLLT3', '11', 118355029, '9', 20365742),
+               ('RUNX1', 'RUNX1T1', '21', 36231771, '8', 93029591),
+               ('PML', 'RARA', '15', 74315749, '17', 38504568),
+               ('CBFB', 'MYH11', '16', 67116211, '16', 15814908),
+               ('TMPRSS2', 'ERG', '21', 42880008, '21', 39956869),
+               ('EML4', 'ALK', '2', 42522656, '2', 29446394),
+               ('ETV6', 'RUNX1', '12', 12022903, '21', 36421595)]
+
+
+class Event(object):
+    '''One fusion, with 1-based breakpoints'''
+
+    __slots__ = ('gene1', 'gene2', 'chrom1', 'pos1', 'strand1',
+                 'chrom2', 'pos2', 'strand2')
+
+    def __init__(self, gene1, gene2, chrom1, pos1, strand1, chrom2, pos2, strand2):
+        self.gene1 = gene1
+        self.gene2 = gene2
+        self.chrom1 = chrom1
+        self.pos1 = pos1
+        self.strand1 = strand1
+        self.chrom2 = chrom2
+        self.pos2 = pos2
+        self.strand2 = strand2
+
+
+def random_event(rng, number):
+    '''Make a fusion between two made-up genes'''
+    return Event('GENE{}A'.format(number), 'GENE{}B'.format(number),
+                 rng.choice(CHROMS), rng.randint(1000, 150000000), rng.choice('+-'),
+                 rng.choice(CHROMS), rng.randint(1000, 150000000), rng.choice('+-'))
+
+
+def make_events(size, seed=0):
+    '''Return the pool of events shared by all generators of a seed'''
+    rng = random.Random(seed)
+    events = [Event(gene1, gene2, chrom1, pos1, '+', chrom2, pos2, '+')
+              for gene1, gene2, chrom1, pos1, chrom2, pos2 in KNOWN_PAIRS]
+    events.extend(random_event(rng, number) for number in range(len(events), size))
+    return events[:size]
+
+
+def caller_events(fmt, size, seed=0):
+    '''
+    Yield the events one format reports: most of the shared pool, with
+    jittered breakpoints, and calls of its own in place of the rest
+    '''
+    pool = make_events(size, seed)
+    rng = random.Random('{}:{}'.format(seed, fmt))
+    for number, event in enumerate(pool):
+        if rng.random() >= RECALL:
+            yield random_event(rng, size + number)
+            continue
+        yield Event(event.gene1, event.gene2,
+                    event.chrom1, max(1, event.pos1 + rng.randint(-3, 3)), event.strand1,
+                    event.chrom2, max(1, event.pos2 + rng.randint(-3, 3)), event.strand2)
+
+
+def star_fusion_row(event, rng):
+    return ['{}--{}'.format(event.gene1, event.gene2), rng.randint(1, 200), rng.randint(0, 100),
+            'ONLY_REF_SPLICE', event.gene1 + '^ENSG00000186716.20',
+            'chr{}:{}:{}'.format(event.chrom1, event.pos1, event.strand1),
+            event.gene2 + '^ENSG00000097007.19',
+            'chr{}:{}:{}'.format(event.chrom2, event.pos2, event.strand2),
+            'YES_LDAS', 'GT', '1.9656', 'AG', '1.9656', '1.2001', '0.4512']
+
+
+def fusioncatcher_row(event, rng):
+    return [event.gene1, event.gene2, 'known,oncogene', rng.randint(0, 5), rng.randint(1, 100),
+            rng.randint(1, 100), rng.randint(10, 60), 'BOWTIE;BOWTIE+BLAT',
+            '{}:{}:{}'.format(event.chrom1, event.pos1, event.strand1),
+            '{}:{}:{}'.format(event.chrom2, event.pos2, event.strand2),
+            'ENSG00000186716', 'ENSG00000097007', 'ENSE00001147489', 'ENSE00001098040',
+            'CCTTTCCCCAAGAGTCCTCA*GAAGCCCTTCAGCGGCCAGT', 'in-frame']
+
+
+def ericscript_row(event, rng):
+    return [event.gene1, event.gene2, event.chrom1, event.pos1, event.strand1,
+            event.chrom2, event.pos2, event.strand2, 'ENSG00000186716', 'ENSG00000097007',
+            rng.randint(1, 100), rng.randint(1, 100), 301, 0, 'inter-chromosomal',
+            'BCR protein', 'ABL1 proto-oncogene', 'ACCATCGTGGGCGTCCGCAAGACCGG',
+            '8.53', '12.1', '3.2', '0.98', '0.73', '0.45',
+            '{:.4f}'.format(rng.random())]
+
+
+def soapfuse_row(event, rng):
+    # SOAPfuse positions are read as 0-based
+    return [event.gene1, 'chr' + event.chrom1, event.strand1, event.pos1 - 1, 'CDS',
+            event.gene2, 'chr' + event.chrom2, event.strand2, event.pos2 - 1, 'CDS',
+            rng.randint(1, 100), rng.randint(1, 100), 'inter-chr', 'in-frame']
+
+
+def fusionmap_row(event, rng):
+    return ['FUS_{}_{}'.format(event.pos1, event.pos2), rng.randint(1, 50), rng.randint(1, 200),
+            rng.randint(0, 20), event.strand1 + event.strand2,
+            event.chrom1, event.pos1 - 1, event.chrom2, event.pos2 - 1,
+            event.gene1, 'NM_004327', 13, '+', event.gene2, 'NM_005157', 2, '+',
+            'GAAGCCCTTCAGCGGCCAGT@AGCATCTGACTTTGAGCCTC', event.gene1 + '->' + event.gene2,
+            'GT-AG', 'CanonicalPattern[Major]', 'FrameShift', 'InFrame', '-1', 'Both', '']
+
+
+def jaffa_row(event, rng):
+    return ['sample1', '{}:{}'.format(event.gene1, event.gene2),
+            'chr' + event.chrom1, event.pos1, event.strand1,
+            'chr' + event.chrom2, event.pos2, event.strand2,
+            'Inf', rng.randint(0, 100), rng.randint(1, 100), 'TRUE', 'TRUE', 'TRUE',
+            'contig{}'.format(rng.randint(1, 100000)), rng.randint(50, 500),
+            'HighConfidence', '-']
+
+
+def infusion_row(event, rng):
+    return ['F{:08d}'.format(rng.randint(0, 99999999)),
+            event.chrom1, event.pos1, 'exon', event.chrom2, event.pos2, 'exon',
+            rng.randint(1, 100), rng.randint(0, 100), 0, 0, rng.randint(1, 50), 0,
+            'inter-chromosomal', 'GT-AG', event.gene1, event.gene2]
+
+
+def defuse_row(event, rng):
+    return [rng.randint(1, 100000), rng.randint(0, 50), event.gene1, event.gene2,
+            event.chrom1, event.chrom2, event.strand1, event.strand2,
+            event.pos1, event.pos2, event.strand1, event.strand2,
+            rng.randint(1, 100), 'Y' if event.chrom1 != event.chrom2 else 'N',
+            '{:.4f}'.format(rng.random())]
+
+
+def pavfinder_row(event, rng):
+    return ['chr' + event.chrom1, event.pos1 - 1, event.pos1,
+            'chr' + event.chrom2, event.pos2 - 1, event.pos2,
+            '{}-{}'.format(event.gene1, event.gene2), 0, event.strand1, event.strand2,
+            'fusion', rng.randint(1, 100), rng.randint(0, 50)]
+
+
+def pancan_row(event, rng):
+    start1 = max(0, event.pos1 - rng.randint(100, 50000))
+    start2 = max(0, event.pos2 - rng.randint(100, 50000))
+    return ['LAML', 'TCGA-AB-{:04d}-03A'.format(rng.randint(0, 9999)), event.gene1, event.gene2,
+            '{}:{}'.format(event.chrom1, event.pos1), '{}:{}'.format(event.chrom2, event.pos2),
+            event.chrom1, start1, event.pos1 + rng.randint(100, 50000),
+            1 if event.strand1 == '+' else -1,
+            event.chrom2, start2, event.pos2 + rng.randint(100, 50000),
+            1 if event.strand2 == '+' else -1,
+            rng.randint(0, 50), rng.randint(1, 50), rng.randint(0, 50), '0.0001', 'in-frame',
+            'tier1', 'NA', rng.randint(0, 99999), '{:.4f}'.format(rng.random()),
+            'NA', 'NA', 'NA', 'NA']
+
+
+def civic_row(event, rng):
+    return [event.gene1, rng.randint(1, 99999), '{}-{}'.format(event.gene1, event.gene2),
+            'Fusion summary.', 'Fusions', event.chrom1, event.pos1 - 1, event.pos1, '', '',
+            'ENST00000305877', event.chrom2, event.pos2 - 1, event.pos2, 'ENST00000318560',
+            75, 'GRCh37', 'transcript_fusion', '', '2017-10-20',
+            'https://civic.genome.wustl.edu/links/variants/1', rng.randint(1, 9999)]
+
+
+def chimerdb_row(event, rng):
+    return [rng.randint(1, 999999), '{}-{}'.format(event.gene1, event.gene2),
+            event.gene1, 'chr' + event.chrom1, event.pos1, event.strand1,
+            event.gene2, 'chr' + event.chrom2, event.pos2, event.strand2,
+            rng.choice(['Oncogene', '']), rng.choice(['Tumor suppressor gene', '']),
+            'PubMed', 'LAML']
+
+
+class Generator(object):
+    '''
+    Description of the synthetic output of one format.
+
+    Args:
+        name (str): Registered format name, e.g. 'star_fusion'
+        header (list): Input headings
+        make_row (callable): Maps an Event and a random.Random to a row
+        delimiter (str): Field delimiter
+        database (bool): True for database exports, which are indexed and
+            annotated against rather than merged
+    '''
+
+    def __init__(self, name, header, make_row, delimiter='\t', database=False):
+        self.name = name
+        self.header = header
+        self.make_row = make_row
+        self.delimiter = delimiter
+        self.database = database
+
+    def file_name(self, size, seed=0):
+        suffix = '.csv' if self.delimiter == ',' else '.tsv'
+        return '{}.{}.{}{}'.format(self.name, size, seed, suffix)
+
+    def write(self, outf, size, seed=0):
+        '''Write size rows to a text stream and return the number written'''
+        rng = random.Random('{}:{}:rows'.format(seed, self.name))
+        writer = csv.writer(outf, delimiter=self.delimiter, lineterminator='\n')
+        writer.writerow(self.header)
+        make_row = self.make_row
+        for batch in compressed_io.iter_batches(caller_events(self.name, size, seed)):
+            writer.writerows(make_row(event, rng) for event in batch)
+        return size
+
+
+GENERATORS = dict((generator.name, generator) for generator in [
+    Generator('star_fusion', ['#FusionName', 'JunctionReadCount', 'SpanningFragCount',
+                              'SpliceType', 'LeftGene', 'LeftBreakpoint', 'RightGene',
+                              'RightBreakpoint', 'LargeAnchorSupport', 'LeftBreakDinuc',
+                              'LeftBreakEntropy', 'RightBreakDinuc', 'RightBreakEntropy',
+                              'J_FFPM', 'S_FFPM'],
+              star_fusion_row),
+    Generator('fusioncatcher', ['Gene_1_symbol(5end_fusion_partner)',
+                                'Gene_2_symbol(3end_fusion_partner)', 'Fusion_description',
+                                'Counts_of_common_mapping_reads', 'Spanning_pairs',
+                                'Spanning_unique_reads', 'Longest_anchor_found',
+                                'Fusion_finding_method',
+                                'Fusion_point_for_gene_1(5end_fusion_partner)',
+                                'Fusion_point_for_gene_2(3end_fusion_partner)',
+                                'Gene_1_id(5end_fusion_partner)', 'Gene_2_id(3end_fusion_partner)',
+                                'Exon_1_id(5end_fusion_partner)', 'Exon_2_id(3end_fusion_partner)',
+                                'Fusion_sequence', 'Predicted_effect'],
+              fusioncatcher_row),
+    Generator('ericscript', ['GeneName1', 'GeneName2', 'chr1', 'Breakpoint1', 'strand1',
+                             'chr2', 'Breakpoint2', 'strand2', 'EnsembleGene1', 'EnsembleGene2',
+                             'crossingreads', 'spanningreads', 'mean.insertsize', 'homology',
+                             'fusiontype', 'InfoGene1', 'InfoGene2', 'JunctionSequence',
+                             'GeneExpr1', 'GeneExpr2', 'GeneExpr_Fused', 'ES', 'GJS', 'US',
+                             'EricScore'],
+              ericscript_row),
+    Generator('soapfuse', ['up_gene', 'up_chr', 'up_strand', 'up_Genome_pos', 'up_loc',
+                           'dw_gene', 'dw_chr', 'dw_strand', 'dw_Genome_pos', 'dw_loc',
+                           'Span_reads_num', 'Junc_reads_num', 'Fusion_Type',
+                           'down_fusion_part_frame-shift_or_not'],
+              soapfuse_row),
+    Generator('fusionmap', ['FusionID', 'UniqueCuttingPositionCount', 'SeedCount',
+                            'RescuedCount', 'Strand', 'Chromosome1', 'Position1', 'Chromosome2',
+                            'Position2', 'KnownGene1', 'KnownTranscript1', 'KnownExonNumber1',
+                            'KnownTranscriptStrand1', 'KnownGene2', 'KnownTranscript2',
+                            'KnownExonNumber2', 'KnownTranscriptStrand2',
+                            'FusionJunctionSequence', 'FusionGene', 'SplicePattern',
+                            'SplicePatternClass', 'FrameShift', 'FrameShiftClass', 'Distance',
+                            'OnExonBoundary', 'Filter'],
+              fusionmap_row),
+    Generator('jaffa', ['sample', 'fusion genes', 'chrom1', 'base1', 'strand1', 'chrom2',
+                        'base2', 'strand2', 'gap (kb)', 'spanning pairs', 'spanning reads',
+                        'inframe', 'aligns', 'rearrangement', 'contig', 'contig break',
+                        'classification', 'known'],
+              jaffa_row, delimiter=','),
+    Generator('infusion', ['#id', 'ref1', 'break_pos1', 'region1', 'ref2', 'break_pos2',
+                           'region2', 'num_split', 'num_paired', 'num_split_with_homology',
+                           'num_split_rescued', 'num_uniq_splits', 'paired_reads_with_homology',
+                           'fusion_class', 'splice_motif', 'genes_1', 'genes_2'],
+              infusion_row),
+    Generator('defuse', ['cluster_id', 'span_count', 'gene_name1', 'gene_name2',
+                         'gene_chromosome1', 'gene_chromosome2', 'gene_strand1', 'gene_strand2',
+                         'genomic_break_pos1', 'genomic_break_pos2', 'genomic_strand1',
+                         'genomic_strand2', 'splitr_count', 'interchromosomal', 'probability'],
+              defuse_row),
+    Generator('pavfinder', ['#chrom1', 'start1', 'end1', 'chrom2', 'start2', 'end2', 'name',
+                            'score', 'strand1', 'strand2', 'event_type', 'spanning_reads',
+                            'flanking_pairs'],
+              pavfinder_row),
+    Generator('pancan', ['Cancer', 'sampleId', 'Gene_A', 'Gene_B', 'Junction_A', 'Junction_B',
+                         'A_chr', 'gene_A_start', 'gene_A_end', 'A_strand', 'B_chr',
+                         'gene_B_start', 'gene_B_end', 'B_strand', 'Discordant_n', 'JSR_n',
+                         'perfectJSR_n', 'Evalue', 'frame', 'tier', 'WGS', 'id', 'centrality',
+                         'phos_A', 'phos_B', 'ubiq_A', 'ubiq_B'],
+              pancan_row, database=True),
+    Generator('civic', ['gene', 'entrez_id', 'variant', 'summary', 'variant_groups',
+                        'chromosome', 'start', 'stop', 'reference_bases', 'variant_bases',
+                        'representative_transcript', 'chromosome2', 'start2', 'stop2',
+                        'representative_transcript2', 'ensembl_version', 'reference_build',
+                        'variant_types', 'hgvs_expressions', 'last_review_date',
+                        'variant_civic_url', 'variant_id'],
+              civic_row, database=True),
+    Generator('chimerdb', ['id', 'Fusion_pair', 'H_gene', 'H_chr', 'H_position', 'H_strand',
+                           'T_gene', 'T_chr', 'T_position', 'T_strand', 'Oncogene',
+                           'Tumor_suppressor', 'Source', 'Cancertype'],
+              chimerdb_row, delimiter=',', database=True),
+])
+
+
+def get_generator(name):
+    '''Return the generator of the format called name'''
+    try:
+        return GENERATORS[name]
+    except KeyError:
+        raise ValueError('No generator for format: {}'.format(name))
+
+
+def generate(fmt, path, size, seed=0):
+    '''Write size synthetic rows of a format to path (STDOUT if None)'''
+    generator = get_generator(fmt)
+    if not path:
+        return generator.write(sys.stdout, size, seed)
+    with compressed_io.atomic_open(path) as outf:
+        return generator.write(outf, size, seed)
+
+
+def peak_rss_mb():
+    '''Return the peak resident set size of this process in MB, or None'''
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kB, macOS bytes
+    return peak / (1 << 20) if sys.platform == 'darwin' else peak / 1024.0
+
+
+def time_convert(inf_path, outf_path, fmt):
+    return registry.convert_file(inf_path, outf_path, fmt)
+
+
+def time_validate(path):
+    with compressed_io.open_input(path) as inf:
+        with open(os.devnull, 'w') as report:
+            validator = validate_bedpe.validate_stream(inf, report)
+    if validator is None or not validator.is_valid():
+        raise ValueError('Converted output is not valid BEDPE: {}'.format(path))
+    return validator.rows
+
+
+def time_merge(inputs, outf_path):
+    with compressed_io.atomic_open(outf_path) as outf:
+        merge_calls.merge(inputs, outf)
+    return count_rows(inputs)
+
+
+def count_rows(inputs):
+    '''Return the number of data rows of a list of (caller, path) BEDPE files'''
+    rows = 0
+    for _, path in inputs:
+        with compressed_io.open_input(path) as inf:
+            rows += sum(1 for line in inf) - 1
+    return rows
+
+
+def time_index(source, path, fmt):
+    breakpoint_index.build(source, path, fmt, force=True)
+    with breakpoint_index.BreakpointIndex(path) as index:
+        return len(index)
+
+
+def time_annotate(bedpe_path, index_paths):
+    indexes = [breakpoint_index.BreakpointIndex(path) for path in index_paths]
+    rows = 0
+    try:
+        with compressed_io.open_input(bedpe_path) as inf:
+            next(inf, None)
+            for _ in breakpoint_index.annotate(pair_overlap.read_bedpe(inf), indexes):
+                rows += 1
+    finally:
+        for index in indexes:
+            index.close()
+    return rows
+
+
+CASES = {'convert': time_convert, 'validate': time_validate, 'merge': time_merge,
+         'index': time_index, 'annotate': time_annotate}
+
+
+def run_case(phase, args):
+    '''
+    Time one case; runs in a fresh worker process
+
+    Returns:
+        tuple: (rows processed, seconds, peak RSS in MB or None)
+    '''
+    started = time.perf_counter()
+    rows = CASES[phase](*args)
+    seconds = time.perf_counter() - started
+    return rows, seconds, peak_rss_mb()
+
+
+class Bench(object):
+    '''
+    Generate inputs and time every case for a list of sizes
+
+    Args:
+        workdir (str): Directory holding inputs and outputs; inputs of a
+            size and seed are generated once and reused
+        formats (list): Format names to include (default: all generators)
+        repeat (int): Runs per case; the fastest is reported
+        seed (int): Seed of the synthetic data
+    '''
+
+    def __init__(self, workdir, formats=None, repeat=1, seed=0):
+        self.workdir = workdir
+        self.formats = [get_generator(name).name for name in formats or sorted(GENERATORS)]
+        self.repeat = repeat
+        self.seed = seed
+        # One task per worker, so ru_maxrss is the peak of one case
+        self.pool = Pool(processes=1, maxtasksperchild=1)
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+    def path(self, name):
+        return os.path.join(self.workdir, name)
+
+    def input_path(self, fmt, size):
+        path = self.path(GENERATORS[fmt].file_name(size, self.seed))
+        if not os.path.exists(path):
+            generate(fmt, path, size, self.seed)
+        return path
+
+    def time(self, phase, fmt, size, args, bytes_in=0):
+        best = None
+        for _ in range(self.repeat):
+            rows, seconds, peak = self.pool.apply(run_case, (phase, args))
+            if best is None or seconds < best[1]:
+                best = (rows, seconds, peak)
+        rows, seconds, peak = best
+        seconds = max(seconds, 1e-9)
+        return {'phase': phase, 'format': fmt, 'size': size, 'rows': rows,
+                'seconds': '{:.3f}'.format(seconds),
+                'rows_per_s': '{:.0f}'.format(rows / seconds),
+                'mb_per_s': '{:.2f}'.format(bytes_in / seconds / (1 << 20)) if bytes_in else '.',
+                'peak_rss_mb': '{:.1f}'.format(peak) if peak is not None else '.'}
+
+    def run_size(self, size):
+        '''Yield the results of every case at one input size'''
+        callers = []
+        databases = []
+        for fmt in self.formats:
+            if fmt not in registry.CONVERTERS:
+                sys.stderr.write('fusebench bench: no converter registered for {}, '
+                                 'skipping\n'.format(fmt))
+                continue
+            source = self.input_path(fmt, size)
+            bedpe = self.path('{}.{}.bedpe'.format(fmt, size))
+            yield self.time('convert', fmt, size, (source, bedpe, fmt),
+                            os.path.getsize(source))
+            if GENERATORS[fmt].database:
+                databases.append((fmt, source))
+                continue
+            yield self.time('validate', fmt, size, (bedpe,), os.path.getsize(bedpe))
+            callers.append((fmt, bedpe))
+        if not callers:
+            return
+
+        merged = self.path('merged.{}.tsv'.format(size))
+        yield self.time('merge', '{}-way'.format(len(callers)), size, (callers, merged),
+                        sum(os.path.getsize(path) for _, path in callers))
+        index_paths = []
+        for fmt, source in databases:
+            index_path = self.path('{}.{}{}'.format(fmt, size, breakpoint_index.INDEX_SUFFIX))
+            yield self.time('index', fmt, size, (source, index_path, fmt),
+                            os.path.getsize(source))
+            index_paths.append(index_path)
+        if index_paths:
+            yield self.time('annotate', '{}-db'.format(len(index_paths)), size,
+                            (merged, index_paths), os.path.getsize(merged))
+
+    def run(self, sizes):
+        for size in sizes:
+            for result in self.run_size(size):
+                yield result
+
+
+def read_results(path):
+    '''Read a results file into {(phase, format, size): rows/s}'''
+    with open(path) as inf:
+        reader = csv.DictReader(inf, delimiter='\t')
+        return dict(((row['phase'], row['format'], row['size']), float(row['rows_per_s']))
+                    for row in reader)
+
+
+def regressions(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    '''
+    Compare results against a baseline
+
+    Yields:
+        tuple: (result, baseline rows/s) for each case slower than the
+            baseline by more than tolerance
+    '''
+    for result in results:
+        key = (result['phase'], result['format'], str(result['size']))
+        if key in baseline and float(result['rows_per_s']) < baseline[key] * (1 - tolerance):
+            yield result, baseline[key]
+
+
+def parse_sizes(value):
+    return [int(size) for size in value.split(',') if size]
+
+
+def add_bench_parser(subparsers):
+    parser = subparsers.add_parser('bench',
+                                   help='Generate synthetic inputs and time every stage')
+    bench_parsers = parser.add_subparsers(dest='bench_command', metavar='<bench-command>')
+    bench_parsers.required = True
+
+    generate_parser = bench_parsers.add_parser('generate',
+                                               help='Write synthetic output of one format')
+    generate_parser.add_argument('-f', dest='fmt', required=True, choices=sorted(GENERATORS),
+                                 help='Format to generate')
+    generate_parser.add_argument('-n', dest='size', type=int, default=DEFAULT_SIZES[0],
+                                 metavar='<rows>', help='Number of rows')
+    generate_parser.add_argument('-seed', dest='seed', type=int, default=0,
+                                 help='Seed; formats of one seed share their events')
+    generate_parser.add_argument('-o', dest='outf', metavar='<out-file>',
+                                 help='Output destination (default STDOUT)')
+    generate_parser.set_defaults(func=run_bench_generate)
+
+    run_parser = bench_parsers.add_parser('run', help='Time every stage on synthetic inputs')
+    run_parser.add_argument('-n', dest='sizes', type=parse_sizes,
+                            default=DEFAULT_SIZES, metavar='<rows>,<rows>...',
+                            help='Input sizes (default {})'.format(
+                                ','.join(str(size) for size in DEFAULT_SIZES)))
+    run_parser.add_argument('-f', dest='formats', action='append', metavar='<format>',
+                            choices=sorted(GENERATORS),
+                            help='Format to include (default: all)')
+    run_parser.add_argument('-d', dest='workdir', metavar='<work-dir>',
+                            help='Keep inputs and outputs here (default: a temporary directory)')
+    run_parser.add_argument('-r', dest='repeat', type=int, default=1, metavar='<repeat>',
+                            help='Runs per case, reporting the fastest (default 1)')
+    run_parser.add_argument('-seed', dest='seed', type=int, default=0,
+                            help='Seed of the synthetic data')
+    run_parser.add_argument('-o', dest='outf', metavar='<results-file>',
+                            help='Results destination (default STDOUT)')
+    run_parser.add_argument('--baseline', dest='baseline', metavar='<results-file>',
+                            help='Earlier results to check for regressions')
+    run_parser.add_argument('--tolerance', dest='tolerance', type=float,
+                            default=DEFAULT_TOLERANCE,
+                            help='Allowed drop in rows/s against the baseline '
+                                 '(default {})'.format(DEFAULT_TOLERANCE))
+    run_parser.set_defaults(func=run_bench)
+    return parser
+
+
+def run_bench_generate(args):
+    generate(args.fmt, args.outf, args.size, args.seed)
+    return 0
+
+
+def run_bench(args):
+    workdir = args.workdir or tempfile.mkdtemp(prefix='fusebench-bench-')
+    if not os.path.isdir(workdir):
+        os.makedirs(workdir)
+    baseline = read_results(args.baseline) if args.baseline else None
+    bench = Bench(workdir, args.formats, args.repeat, args.seed)
+    results = []
+    try:
+        with open(args.outf, 'w') if args.outf else sys.stdout as outf:
+            outf.write('\t'.join(RESULT_FIELDS) + '\n')
+            for result in bench.run(args.sizes):
+                results.append(result)
+                outf.write('\t'.join(str(result[field]) for field in RESULT_FIELDS) + '\n')
+                outf.flush()
+    finally:
+        bench.close()
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+    if baseline is None:
+        return 0
+    slower = list(regressions(results, baseline, args.tolerance))
+    for result, expected in slower:
+        sys.stderr.write('fusebench bench: {phase} {format} at {size} rows: '
+                         '{rows_per_s} rows/s, baseline {expected:.0f}\n'.format(
+                             expected=expected, **result))
+    return 1 if slower else 0
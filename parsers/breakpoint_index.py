@@ -0,0 +1,294 @@
+'''
+Prebuilt, memory-mappable breakpoint index for annotation databases.
+
+An index is built once from a raw database export (CIViC, ChimerDB, PanCan or
+any other registered format). Records are oriented with their lower
+breakpoint first and sorted by chromosome pair, start1 and start2, then
+written as fixed-width column arrays so that a reader can memory-map the file
+and binary-search it without parsing anything.
+
+File layout:
+
+    8 bytes   magic, b'FBIDX002'
+    8 bytes   length of the JSON metadata (little-endian unsigned)
+    metadata  JSON: source path and SHA-256, format, record count, the
+              chromosome pair table and the offset of every column
+    columns   each starting on an 8-byte boundary:
+              start1, end1, start2, end2, record   int32
+              strand1, strand2                     uint8 (ord of the strand)
+              name_offsets                         int64, n + 1 entries
+              names                                UTF-8 bytes
+
+The metadata keeps the hash of the source export, so building again only
+does work when the source has changed.
+
+Can be run from the commandline with:
+    python fusebench.py index build [-f <format>] [-d <index_dir>] <database_file> ...
+    python fusebench.py index annotate [-slop <bp>] <bedpe_file> <index_file> ...
+'''
+
+import hashlib,itertools,os,sys
+from array import array
+from bisect import bisect_left, bisect_right
+
+import bedpe_engine
+import columnar
+import compressed_io
+import merge_calls
+import pair_overlap
+import registry
+
+MAGIC = b'FBIDX002'
+INDEX_SUFFIX = '.fbi'
+
+INT_COLUMNS = ['start1', 'end1', 'start2', 'end2', 'record']
+STRAND_COLUMNS = ['strand1', 'strand2']
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    '''Return the hex SHA-256 of the file at path'''
+    digest = hashlib.sha256()
+    with open(path, 'rb') as inf:
+        for chunk in iter(lambda: inf.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def index_path(source, index_dir=None):
+    '''Name the index for a database export'''
+    stem = os.path.splitext(os.path.basename(source))[0]
+    return os.path.join(index_dir or os.path.dirname(source), stem + INDEX_SUFFIX)
+
+
+def read_metadata(path):
+    '''Return the metadata of an index file, or None if it is not one'''
+    return columnar.read_column_metadata(path, MAGIC)
+
+
+def is_current(path, source_sha256):
+    '''Return True if the index at path was built from a source with this hash'''
+    metadata = read_metadata(path)
+    return metadata is not None and metadata.get('source_sha256') == source_sha256
+
+
+def database_records(converter, lines):
+    '''
+    Convert a database export and yield its placed records, oriented
+
+    Args:
+        converter (bedpe_engine.Converter): Format of the export
+        lines (iterable): Text lines of the export, starting at its header
+    Yields:
+        tuple: call tuples as returned by merge_calls.oriented_call, whose
+            last item is the record number in the export
+    '''
+    _, batches = bedpe_engine.convert_batches(converter, lines)
+    record = 0
+    for out_rows in batches:
+        for row in out_rows:
+            call = merge_calls.oriented_call([str(value) for value in row], record)
+            record += 1
+            if call is not None:
+                yield call
+
+
+def write_index(path, source, source_sha256, fmt, calls):
+    '''
+    Write sorted calls as an index file
+
+    Args:
+        path (str): Index destination
+        source (str): Database export the calls came from
+        source_sha256 (str): Hash of source
+        fmt (str): Format name of source
+        calls (list): Call tuples whose last item is the source record number
+    '''
+    calls.sort(key=lambda call: (call[0], call[1], call[2], call[4]))
+    columns = dict((name, array('i')) for name in INT_COLUMNS)
+    strands = dict((name, bytearray()) for name in STRAND_COLUMNS)
+    name_offsets = array('q', [0])
+    names = bytearray()
+    pairs = []
+    for i, call in enumerate(calls):
+        if not pairs or (pairs[-1][0], pairs[-1][1]) != (call[0], call[1]):
+            pairs.append([call[0], call[1], i, 0, 0])
+        pair = pairs[-1]
+        pair[3] += 1
+        pair[4] = max(pair[4], call[3] - call[2])
+        for name, value in zip(INT_COLUMNS, (call[2], call[3], call[4], call[5], call[9])):
+            columns[name].append(value)
+        strands['strand1'].append(ord(call[6][:1] or '.'))
+        strands['strand2'].append(ord(call[7][:1] or '.'))
+        names.extend(call[8].encode('utf8'))
+        name_offsets.append(len(names))
+
+    blobs = [(name, 'i', columns[name].tobytes()) for name in INT_COLUMNS]
+    blobs += [(name, 'B', bytes(strands[name])) for name in STRAND_COLUMNS]
+    blobs += [('name_offsets', 'q', name_offsets.tobytes()), ('names', 'B', bytes(names))]
+
+    metadata = {'source': os.path.abspath(source), 'source_sha256': source_sha256,
+                'format': fmt, 'records': len(calls),
+                # [chrom1, chrom2, first row, row count, longest first end]
+                'pairs': pairs}
+    columnar.write_column_file(path, MAGIC, metadata, blobs)
+
+
+def build(source, path=None, fmt=None, force=False):
+    '''
+    Build the index for a database export unless it is already current
+
+    Args:
+        source (str): Raw database export
+        path (str): Index destination (default <source stem>.fbi beside it)
+        fmt (str): Registered format name, or None to sniff the header
+        force (bool): Rebuild even if the source is unchanged
+    Returns:
+        tuple: (index path, True if it was rebuilt)
+    '''
+    path = path or index_path(source)
+    source_sha256 = file_sha256(source)
+    if not force and is_current(path, source_sha256):
+        return path, False
+    with compressed_io.open_input(source, newline='') as inf:
+        converter, lines = registry.resolve(inf, fmt)
+        calls = list(database_records(converter, lines))
+    write_index(path, source, source_sha256, converter.name, calls)
+    return path, True
+
+
+class BreakpointIndex(columnar.ColumnFile):
+    '''
+    Read-only, memory-mapped view of an index file.
+
+    Args:
+        path (str): Index file written by build
+    '''
+
+    def __init__(self, path):
+        super(BreakpointIndex, self).__init__(path, MAGIC)
+        self.label = os.path.splitext(os.path.basename(path))[0]
+        self.pairs = dict(((chrom1, chrom2), (first, count, longest))
+                          for chrom1, chrom2, first, count, longest
+                          in self.metadata['pairs'])
+
+    def __len__(self):
+        return self.metadata['records']
+
+    def name(self, i):
+        '''Return the name of record row i'''
+        offsets = self.columns['name_offsets']
+        return bytes(self.columns['names'][offsets[i]:offsets[i + 1]]).decode('utf8')
+
+    def query(self, call, slop=0, ignore_strand=False):
+        '''
+        Find records whose ends both overlap those of one call
+
+        Args:
+            call (tuple): Call tuple as returned by merge_calls.oriented_call
+            slop (int): Largest gap between matching ends
+            ignore_strand (bool): Match ends regardless of strand
+        Returns:
+            list: row numbers of the matching records
+        '''
+        entry = self.pairs.get((call[0], call[1]))
+        if entry is None:
+            return []
+        first, count, longest = entry
+        starts1 = self.columns['start1']
+        lo = bisect_right(starts1, call[2] - slop - longest, first, first + count)
+        hi = bisect_left(starts1, call[3] + slop, first, first + count)
+        ends1 = self.columns['end1']
+        starts2, ends2 = self.columns['start2'], self.columns['end2']
+        strands1, strands2 = self.columns['strand1'], self.columns['strand2']
+        hits = []
+        for i in range(lo, hi):
+            if ends1[i] + slop <= call[2]:
+                continue
+            if starts2[i] >= call[5] + slop or ends2[i] + slop <= call[4]:
+                continue
+            if not ignore_strand and not (
+                    pair_overlap.strands_match(call[6], chr(strands1[i])) and
+                    pair_overlap.strands_match(call[7], chr(strands2[i]))):
+                continue
+            hits.append(i)
+        return hits
+
+
+def annotate(rows, indexes, slop=0):
+    '''
+    Add the names of matching database records to BEDPE rows
+
+    Args:
+        rows (iterable): BEDPE rows (lists of strings)
+        indexes (list): Open BreakpointIndex objects
+        slop (int): Largest gap between matching ends
+    Yields:
+        list: each row followed by one column per index, holding the matching
+            record names or '.'
+    '''
+    for row in rows:
+        call = merge_calls.oriented_call(row, None)
+        extra = []
+        for index in indexes:
+            hits = index.query(call, slop) if call is not None else []
+            extra.append(','.join(sorted(set(index.name(i) for i in hits))) or '.')
+        yield row + extra
+
+
+def add_index_parser(subparsers):
+    parser = subparsers.add_parser('index', help='Build or use database breakpoint indexes')
+    index_parsers = parser.add_subparsers(dest='index_command', metavar='<index-command>')
+    index_parsers.required = True
+
+    build_parser = index_parsers.add_parser('build', help='Index database exports')
+    build_parser.add_argument('sources', nargs='+', metavar='<database-file>',
+                              help='Raw CIViC, ChimerDB, PanCan, ... exports')
+    build_parser.add_argument('-f', dest='fmt', choices=registry.format_names(),
+                              help='Input format (default: detect from header)')
+    build_parser.add_argument('-d', dest='index_dir', metavar='<index-dir>',
+                              help='Directory receiving <name>.fbi (default: beside source)')
+    build_parser.add_argument('--force', action='store_true',
+                              help='Rebuild even if the source is unchanged')
+    build_parser.set_defaults(func=run_index_build)
+
+    annotate_parser = index_parsers.add_parser('annotate',
+                                               help='Add matching database records to BEDPE')
+    annotate_parser.add_argument('bedpe', metavar='<bedpe-file>', help='BEDPE to annotate')
+    annotate_parser.add_argument('indexes', nargs='+', metavar='<index-file>',
+                                 help='Indexes built with index build')
+    annotate_parser.add_argument('-slop', dest='slop', type=int, default=0,
+                                 help='Largest gap between matching ends (default 0)')
+    annotate_parser.add_argument('-o', dest='outf', metavar='<out-file>',
+                                 help='Output destination (default STDOUT)')
+    annotate_parser.set_defaults(func=run_index_annotate)
+    return parser
+
+
+def run_index_build(args):
+    if args.index_dir and not os.path.isdir(args.index_dir):
+        os.makedirs(args.index_dir)
+    for source in args.sources:
+        path, rebuilt = build(source, index_path(source, args.index_dir), args.fmt, args.force)
+        sys.stderr.write('fusebench index: {} {}\n'.format(
+            path, 'built' if rebuilt else 'up to date'))
+    return 0
+
+
+def run_index_annotate(args):
+    indexes = [BreakpointIndex(path) for path in args.indexes]
+    try:
+        with compressed_io.open_input(args.bedpe) as inf:
+            with compressed_io.open_output(args.outf) as outf:
+                header = inf.readline()
+                if header.startswith('#') or header.split('\t')[1:2] == ['start1']:
+                    outf.write(header.rstrip('\r\n') + ''.join(
+                        '\t' + index.label for index in indexes) + '\n')
+                    lines = inf
+                else:
+                    lines = itertools.chain([header], inf)
+                for row in annotate(pair_overlap.read_bedpe(lines), indexes, args.slop):
+                    outf.write('\t'.join(row) + '\n')
+    finally:
+        for index in indexes:
+            index.close()
+    return 0
@@ -2,120 +2,73 @@
 Convert chimerDB output to BEDPE format.
 
 Can be run from the commandline with:
-    python fusioncatcher_to_bedpe.py -i <input_file> -o <output_file>
+    python chimerDB_to_bedpe.py -i <input_file> -o <output_file>
 
 If no <input_file> and/or <output_file> is specified, the file will read/write
 from/to STDIN/STDOUT, allowing for piping into and out of the program.
 '''
 
-import argparse,sys,csv
+import sys
 
-def map_fields(input_row, headings):
+import bedpe_engine
+
+def compile_core(index):
     '''
-    Map fields from the input row to bedpe_fields
+    Compile the mapping from input columns to the core BEDPE fields
 
     Args:
-        input_row (dict): {'heading': value} mapping for one row in input
-        headings (list): A list of all BEDPE headings to include
+        index (dict): {'heading': position} mapping for the input header
     Returns:
-        dict: the return value. A single BEDPE row
+        function: maps one input row (list) to a list of BEDPE values
     '''
-    out_row = dict()
-    print(input_row)
-    chrom1 = input_row['H_chr']
-    chrom2 = input_row['T_chr']
-    pos1 = input_row['H_position']
-    try:
-        start1 = int(pos1)
-    except:
-        start1 = -1
-    try:
-        end1 = int(pos1) + 1
-    except:
-        end1 = -1
-    pos2 = input_row['T_position']
-    try:
-        start2 = int(pos2)
-    except:
-        start2 = -1
-    try:
-        end2 = int(pos2) + 1
-    except:
-        end2 = -1
-
-    name = input_row['Fusion_pair']
-    strand1 = input_row['H_strand']
-    strand2 = input_row['T_strand']
-    oncogene = input_row['Oncogene']
-    tumor_sup = input_row['Tumor_suppressor']
-
-    out_row['chrom1'] = chrom1
-    out_row['start1'] = start1
-    out_row['end1'] = end1
-
-    out_row['chrom2'] = chrom2
-    out_row['start2'] = start2
-    out_row['end2'] = end2
-
-    out_row['name'] = name
-    out_row['score'] = 0
-    out_row['strand1'] = strand1
-    out_row['strand2'] = strand2
-    out_row['oncogene'] = oncogene
-    out_row['tumorsupressor'] = tumor_sup
-
-    for heading in headings:
-        if (heading not in out_row) and (heading in input_row):
-            out_row[heading] = input_row[heading]
-        elif heading not in out_row:
-            out_row[heading] = '.'
-    return out_row
+    chrom1, pos1, strand1 = index['H_chr'], index['H_position'], index['H_strand']
+    chrom2, pos2, strand2 = index['T_chr'], index['T_position'], index['T_strand']
+    name = index['Fusion_pair']
+    oncogene = index['Oncogene']
+    tumor_sup = index['Tumor_suppressor']
+
+    def map_core(row):
+        out_row = [row[chrom1], -1, -1, row[chrom2], -1, -1,
+                   row[name], 0, row[strand1], row[strand2],
+                   row[oncogene], row[tumor_sup]]
+        try:
+            out_row[1] = int(row[pos1])
+            out_row[2] = out_row[1] + 1
+        except ValueError:
+            pass
+        try:
+            out_row[4] = int(row[pos2])
+            out_row[5] = out_row[4] + 1
+        except ValueError:
+            pass
+        return out_row
+    return map_core
 
 
 def add_fields(bedpe_fields):
     '''Add fields from input to end of BEDPE format'''
 
-    return bedpe_fields
+    return bedpe_fields + ['oncogene', 'tumorsupressor']
+
+
+CONVERTER = bedpe_engine.Converter('chimerdb', compile_core,
+                                   core_fields=add_fields(bedpe_engine.BEDPE_FIELDS),
+                                   delimiter=',',
+                                   signature=['Fusion_pair', 'H_chr', 'T_chr'])
 
 
 def get_parser():
-    parser = argparse.ArgumentParser()
-    parser.add_argument('-i', dest='inf', metavar='<in-file>',
-                        help='File to parse (default STDIN)')
-    parser.add_argument('-o', dest='outf', metavar='<out-file>',
-                        help='Output BEDPE destination (default STDOUT)')
-    return parser
+    return bedpe_engine.get_parser()
 
 
 def main():
     '''
     Convert ChimerDB output to BEDPE format.
     '''
-    # Get args
-    parser = get_parser()
-    args = parser.parse_args()
-    with open(args.inf, 'r') if args.inf else sys.stdin as inf:
-        with open(args.outf, 'w') if args.outf else sys.stdout as outf:
-            #
-            # Organize I/O
-            #
-
-            # Input file is tab delimited plus heading
-            reader = csv.DictReader(inf, delimiter=',')
-
-            # Output is always BEDPE
-            init_fieldnames = ['chrom1', 'start1', 'end1', 'chrom2', 'start2',
-                                'end2', 'name', 'score', 'strand1', 'strand2', 'oncogene', 'tumorsupressor']
-            fieldnames = add_fields(init_fieldnames)
-            writer = csv.DictWriter(outf, fieldnames=fieldnames, delimiter='\t')
-            writer.writeheader()
-            for in_row in reader:
-                out_row = map_fields(in_row, fieldnames)
-                writer.writerow(out_row)
-    return 0
+    return bedpe_engine.main(CONVERTER)
 
 
 
 
 if __name__ == '__main__':
-    main()
+    sys.exit(main())
@@ -10,57 +10,37 @@ If no <input_file> and/or <output_file> is specified, the file will read/write
 from/to STDIN/STDOUT, allowing for piping into and out of the program.
 '''
 
-import argparse,sys,csv
+import sys
 
-def map_fields(input_row, headings):
+import bedpe_engine
+
+def compile_core(index):
     '''
-    Map fields from the input row to bedpe_fields
+    Compile the mapping from input columns to the core BEDPE fields
 
     Args:
-        input_row (dict): {'heading': value} mapping for one row in input
-        headings (list): A list of all BEDPE headings to include
+        index (dict): {'heading': position} mapping for the input header
     Returns:
-        dict: the return value. A single BEDPE row
+        function: maps one input row (list) to a list of BEDPE values
     '''
-    out_row = dict()
-
-    [chr1, start1, end1] = input_row['chromosome'], input_row['start'], input_row['stop']
-
-    out_row['chrom1'] = 'chr{num}'.format(num=chr1)
-    if(start1.isdigit() and end1.isdigit()):
-        out_row['start1'] = int(start1)
-        out_row['end1'] = int(end1)
-    else:
-        out_row['start1'] = -1
-        out_row['end1'] = -1
-
-    out_row['strand1'] = '.'
-
-
-    [chr2, start2, end2] = input_row['chromosome2'], input_row['start2'], input_row['stop2']
-
-    out_row['chrom2'] = 'chr{num}'.format(num=chr1)
-    if(start2.isdigit() and end2.isdigit()):
-        out_row['start2'] = int(start2)
-        out_row['end2'] = int(end2)
-    else:
-        out_row['start2'] = -1
-        out_row['end2'] = -1
-
-    out_row['strand2'] = '.'
-
-    gene1 = input_row['representative_transcript']
-    gene2 = input_row['representative_transcript2']
-    out_row['name'] = '{G1}-{G2}'.format(G1=gene1, G2=gene2)
-
-    out_row['score'] = 0
-
-    for heading in headings:
-        if (heading not in out_row) and (heading in input_row):
-            out_row[heading] = input_row[heading]
-        elif heading not in out_row:
-            out_row[heading] = '.'
-    return out_row
+    chr1, start1, end1 = index['chromosome'], index['start'], index['stop']
+    chr2, start2, end2 = index['chromosome2'], index['start2'], index['stop2']
+    gene1 = index['representative_transcript']
+    gene2 = index['representative_transcript2']
+
+    def map_core(row):
+        out_row = ['chr' + row[chr1], -1, -1, 'chr' + row[chr2], -1, -1,
+                   row[gene1] + '-' + row[gene2], 0, '.', '.']
+        start, end = row[start1], row[end1]
+        if start.isdigit() and end.isdigit():
+            out_row[1] = int(start)
+            out_row[2] = int(end)
+        start, end = row[start2], row[end2]
+        if start.isdigit() and end.isdigit():
+            out_row[4] = int(start)
+            out_row[5] = int(end)
+        return out_row
+    return map_core
 
 
 def add_fields(bedpe_fields):
@@ -83,44 +63,23 @@ def add_fields(bedpe_fields):
     return bedpe_fields + to_add
 
 
+CONVERTER = bedpe_engine.Converter('civic', compile_core,
+                                   extra_fields=add_fields([]),
+                                   signature=['chromosome2', 'representative_transcript2'])
+
+
 def get_parser():
-    parser = argparse.ArgumentParser()
-    parser.add_argument('-i', dest='inf', metavar='<in-file>',
-                        help='File to parse (default STDIN)')
-    parser.add_argument('-o', dest='outf', metavar='<out-file>',
-                        help='Output BEDPE destination (default STDOUT)')
-    return parser
+    return bedpe_engine.get_parser()
 
 
 def main():
     '''
-    Convert FusionCatcher output to BEDPE format.
+    Convert CIViC output to BEDPE format.
     '''
-    # Get args
-    parser = get_parser()
-    args = parser.parse_args()
-    with open(args.inf, 'r') if args.inf else sys.stdin as inf:
-        with open(args.outf, 'w') if args.outf else sys.stdout as outf:
-            #
-            # Organize I/O
-            #
-
-            # Input file is tab delimited plus heading
-            reader = csv.DictReader(inf, delimiter='\t')
-
-            # Output is always BEDPE
-            init_fieldnames = ['chrom1', 'start1', 'end1', 'chrom2', 'start2',
-                               'end2', 'name', 'score', 'strand1', 'strand2']
-            fieldnames = add_fields(init_fieldnames)
-            writer = csv.DictWriter(outf, fieldnames=fieldnames, delimiter='\t')
-            writer.writeheader()
-            for in_row in reader:
-                out_row = map_fields(in_row, fieldnames)
-                writer.writerow(out_row)
-    return 0
+    return bedpe_engine.main(CONVERTER)
 
 
 
 
 if __name__ == '__main__':
-    main()
+    sys.exit(main())
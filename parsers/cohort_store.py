@@ -0,0 +1,459 @@
+'''
+Persistent, indexed store of the calls of a whole cohort.
+
+Converted BEDPE files (<sample>.<caller>.bedpe, as written by batch, pipeline
+and flow) are bulk-loaded into one SQLite database, so cohort questions such
+as "which samples carry KMT2A-*?" or "in how many samples do 3 or more
+callers report ABL1-NUP214?" are answered from indexes instead of by
+re-reading every file.
+
+Tables:
+
+    samples, callers   name -> id
+    files              every loaded file with its SHA-256; a file is only
+                       loaded again when it has changed, replacing its calls
+    calls              one row per call: file, sample and caller ids, the
+                       unordered gene pair ('GENE1--GENE2', see
+                       normalize.fusion_key) and its two genes, the
+                       name as called, and the oriented BEDPE core fields
+    pair_samples       per gene pair and sample: number of distinct callers
+                       and of calls, refreshed for the samples of each load
+
+with indexes on the gene pair, each gene, chromosome pair plus start1 and
+start2, sample and caller. Recurrence queries read pair_samples, which has
+one row per fusion and sample however many callers reported it.
+
+Loading runs in a single transaction with executemany, and a load into an
+empty store builds the indexes once at the end instead of row by row.
+
+Can be run from the commandline with:
+    python fusebench.py store load <db_file> [<caller>=]<bedpe_file>|<dir> ...
+    python fusebench.py store query <db_file> [--gene <gene>] [--pair <name>] [--sample <sample>]
+        [--caller <caller>] [--breakpoint <chrom>:<pos>,<chrom>:<pos> [-slop <bp>]]
+    python fusebench.py store recurrent <db_file> [--gene <gene>] [--pair <name>]
+        [--min-callers <n>] [--min-samples <n>]
+
+From Python:
+
+    with CohortStore('cohort.db') as store:
+        store.load(['out/'])
+        for pair, samples, calls, names in store.recurrent(gene='KMT2A', min_callers=2):
+            ...
+'''
+
+import os,sqlite3,sys,time
+
+import bedpe_engine
+import breakpoint_index
+import compressed_io
+import incidence
+import merge_calls
+import normalize
+import pair_overlap
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS samples (id INTEGER PRIMARY KEY, name TEXT UNIQUE NOT NULL);
+CREATE TABLE IF NOT EXISTS callers (id INTEGER PRIMARY KEY, name TEXT UNIQUE NOT NULL);
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY, path TEXT UNIQUE NOT NULL, sha256 TEXT NOT NULL,
+    sample_id INTEGER NOT NULL, caller_id INTEGER NOT NULL,
+    calls INTEGER NOT NULL, skipped INTEGER NOT NULL, loaded TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS calls (
+    file_id INTEGER NOT NULL, sample_id INTEGER NOT NULL, caller_id INTEGER NOT NULL,
+    pair TEXT, gene1 TEXT, gene2 TEXT, name TEXT,
+    chrom1 TEXT NOT NULL, start1 INTEGER NOT NULL, end1 INTEGER NOT NULL,
+    chrom2 TEXT NOT NULL, start2 INTEGER NOT NULL, end2 INTEGER NOT NULL,
+    strand1 TEXT, strand2 TEXT);
+CREATE TABLE IF NOT EXISTS pair_samples (
+    pair TEXT NOT NULL, gene1 TEXT, gene2 TEXT, sample_id INTEGER NOT NULL,
+    callers INTEGER NOT NULL, calls INTEGER NOT NULL,
+    PRIMARY KEY (pair, sample_id)) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS pair_samples_gene1 ON pair_samples (gene1);
+CREATE INDEX IF NOT EXISTS pair_samples_gene2 ON pair_samples (gene2);
+CREATE INDEX IF NOT EXISTS pair_samples_sample ON pair_samples (sample_id);
+'''
+
+# Indexes of the calls table, built after the rows of a bulk load
+CALL_INDEXES = [
+    ('calls_pair', 'pair, sample_id, caller_id'),
+    ('calls_gene1', 'gene1'),
+    ('calls_gene2', 'gene2'),
+    ('calls_locus', 'chrom1, chrom2, start1, start2'),
+    ('calls_sample', 'sample_id, caller_id'),
+    ('calls_caller', 'caller_id'),
+    ('calls_file', 'file_id'),
+]
+
+CALL_COLUMNS = ['file_id', 'sample_id', 'caller_id', 'pair', 'gene1', 'gene2', 'name',
+                'chrom1', 'start1', 'end1', 'chrom2', 'start2', 'end2', 'strand1', 'strand2']
+
+QUERY_FIELDS = ['chrom1', 'start1', 'end1', 'chrom2', 'start2', 'end2',
+                'name', 'strand1', 'strand2', 'sample', 'caller', 'pair']
+
+RECURRENT_FIELDS = ['pair', 'samples', 'calls', 'sample_names']
+
+BEDPE_SUFFIXES = tuple('.bedpe' + suffix
+                       for suffix in ('',) + compressed_io.COMPRESSED_SUFFIXES)
+
+
+def file_labels(path):
+    '''Return (sample, caller) of a <sample>.<caller>.bedpe style file name'''
+    return os.path.basename(path).split('.', 1)[0], merge_calls.caller_label(path)
+
+
+def expand_inputs(specs):
+    '''
+    Turn [<caller>=]<path> arguments into (sample, caller, path) inputs
+
+    A directory stands for every BEDPE file directly inside it.
+    '''
+    inputs = []
+    for spec in specs:
+        caller, path = merge_calls.parse_input(spec)
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.endswith(BEDPE_SUFFIXES):
+                    inputs.append(file_labels(os.path.join(path, name)) +
+                                  (os.path.join(path, name),))
+        else:
+            inputs.append((file_labels(path)[0], caller, path))
+    return inputs
+
+
+def pair_genes(key):
+    '''Split a pair key into its two genes, or (key, None) if it has no pair'''
+    genes = key.split('--')
+    if len(genes) == 2:
+        return genes[0], genes[1]
+    return key, None
+
+
+class CohortStore(object):
+    '''
+    SQLite store of cohort calls
+
+    Args:
+        path (str): Database file, created if missing
+        resolver (genes.GeneResolver): If given, names are resolved to
+            current symbols when loading and querying
+    '''
+
+    def __init__(self, path, resolver=None):
+        self.path = path
+        self.resolver = resolver
+        self.db = sqlite3.connect(path, isolation_level=None)
+        self.db.execute('PRAGMA journal_mode = WAL')
+        self.db.execute('PRAGMA synchronous = NORMAL')
+        self.db.execute('PRAGMA temp_store = MEMORY')
+        self.db.execute('PRAGMA cache_size = -65536')
+        self.db.executescript(SCHEMA)
+        self.create_indexes()
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def create_indexes(self):
+        for name, columns in CALL_INDEXES:
+            self.db.execute('CREATE INDEX IF NOT EXISTS {} ON calls ({})'.format(name, columns))
+
+    def drop_indexes(self):
+        for name, _ in CALL_INDEXES:
+            self.db.execute('DROP INDEX IF EXISTS {}'.format(name))
+
+    def name_id(self, table, name):
+        '''Return the id of a sample or caller, adding it if new'''
+        self.db.execute('INSERT OR IGNORE INTO {} (name) VALUES (?)'.format(table), (name,))
+        return self.db.execute('SELECT id FROM {} WHERE name = ?'.format(table),
+                               (name,)).fetchone()[0]
+
+    def key(self, name):
+        '''Return the gene pair key of a fusion name, or None if it names no genes'''
+        if name in incidence.UNNAMED:
+            return None
+        return normalize.fusion_key(name, self.resolver)
+
+    def call_rows(self, file_id, sample_id, caller_id, path, counts):
+        '''Yield the calls table rows of one BEDPE file, counting them in counts'''
+        keys = dict()
+        with compressed_io.open_input(path) as inf:
+            for row in pair_overlap.read_bedpe(inf):
+                call = merge_calls.oriented_call(row, None)
+                if call is None:
+                    counts[1] += 1
+                    continue
+                name = call[8]
+                key = keys.get(name, False)
+                if key is False:
+                    key = keys[name] = self.key(name)
+                gene1, gene2 = pair_genes(key) if key is not None else (None, None)
+                counts[0] += 1
+                yield (file_id, sample_id, caller_id, key, gene1, gene2, name,
+                       call[0], call[2], call[3], call[1], call[4], call[5], call[6], call[7])
+
+    def load_file(self, path, sample, caller, force=False):
+        '''
+        Load the calls of one BEDPE file, replacing those of an earlier load
+
+        Must run inside a transaction (see load).
+
+        Returns:
+            tuple: (ids of the samples whose calls changed, calls loaded,
+                unplaced calls skipped), or None if the file is unchanged
+                since it was loaded
+        '''
+        path = os.path.abspath(path)
+        sha256 = breakpoint_index.file_sha256(path)
+        held = self.db.execute('SELECT id, sha256, sample_id FROM files WHERE path = ?',
+                               (path,)).fetchone()
+        if held is not None and held[1] == sha256 and not force:
+            return None
+        sample_id = self.name_id('samples', sample)
+        caller_id = self.name_id('callers', caller)
+        if held is not None:
+            file_id = held[0]
+            self.db.execute('DELETE FROM calls WHERE file_id = ?', (file_id,))
+        else:
+            file_id = self.db.execute(
+                "INSERT INTO files (path, sha256, sample_id, caller_id, calls, skipped, loaded)"
+                " VALUES (?, '', ?, ?, 0, 0, '')", (path, sample_id, caller_id)).lastrowid
+        counts = [0, 0]
+        self.db.executemany(
+            'INSERT INTO calls ({}) VALUES ({})'.format(', '.join(CALL_COLUMNS),
+                                                         ', '.join('?' * len(CALL_COLUMNS))),
+            self.call_rows(file_id, sample_id, caller_id, path, counts))
+        self.db.execute(
+            'UPDATE files SET sha256 = ?, sample_id = ?, caller_id = ?, calls = ?, skipped = ?,'
+            ' loaded = ? WHERE id = ?',
+            (sha256, sample_id, caller_id, counts[0], counts[1],
+             time.strftime('%Y-%m-%dT%H:%M:%S'), file_id))
+        affected = [sample_id]
+        if held is not None and held[2] != sample_id:
+            affected.append(held[2])
+        return affected, counts[0], counts[1]
+
+    def refresh_samples(self, sample_ids):
+        '''Recount pair_samples for the given samples'''
+        for sample_id in sample_ids:
+            self.db.execute('DELETE FROM pair_samples WHERE sample_id = ?', (sample_id,))
+            self.db.execute(
+                'INSERT INTO pair_samples (pair, gene1, gene2, sample_id, callers, calls)'
+                ' SELECT pair, MIN(gene1), MIN(gene2), sample_id, COUNT(DISTINCT caller_id),'
+                ' COUNT(*) FROM calls WHERE sample_id = ? AND pair IS NOT NULL'
+                ' GROUP BY pair', (sample_id,))
+
+    def load(self, specs, force=False, log=None):
+        '''
+        Bulk-load BEDPE files in one transaction
+
+        Args:
+            specs (list): [<caller>=]<path> arguments; directories stand for
+                the BEDPE files inside them
+            force (bool): Reload files even if they are unchanged
+            log (file): If given, receives a line per file
+        Returns:
+            tuple: (files loaded, calls loaded)
+        '''
+        inputs = expand_inputs(specs)
+        bulk = self.db.execute('SELECT 1 FROM calls LIMIT 1').fetchone() is None
+        loaded = calls = 0
+        affected = set()
+        self.db.execute('BEGIN')
+        try:
+            if bulk:
+                self.drop_indexes()
+            for sample, caller, path in inputs:
+                result = self.load_file(path, sample, caller, force)
+                if log is not None:
+                    log.write('fusebench store: {} {}\n'.format(
+                        path, 'up to date' if result is None else
+                        '{} calls as {}/{}'.format(result[1], sample, caller)))
+                if result is None:
+                    continue
+                affected.update(result[0])
+                loaded += 1
+                calls += result[1]
+            if bulk:
+                self.create_indexes()
+            self.refresh_samples(sorted(affected))
+            self.db.execute('COMMIT')
+        except BaseException:
+            self.db.execute('ROLLBACK')
+            raise
+        return loaded, calls
+
+    def query(self, gene=None, pair=None, sample=None, caller=None, breakpoint=None, slop=0):
+        '''
+        Find calls by gene, gene pair, sample, caller and/or breakpoint
+
+        Args:
+            gene (str): Either partner of the fusion
+            pair (str): Fusion name, in either gene order
+            sample (str): Sample name
+            caller (str): Caller name
+            breakpoint (tuple): ((chrom, pos), (chrom, pos)) of the two ends,
+                in either order
+            slop (int): Largest distance of a start from the breakpoint
+        Returns:
+            iterator: tuples of the QUERY_FIELDS values
+        '''
+        clauses, params = [], []
+        if gene is not None:
+            gene = self.key(gene)
+            clauses.append('(c.gene1 = ? OR c.gene2 = ?)')
+            params += [gene, gene]
+        if pair is not None:
+            clauses.append('c.pair = ?')
+            params.append(self.key(pair))
+        if sample is not None:
+            clauses.append('s.name = ?')
+            params.append(sample)
+        if caller is not None:
+            clauses.append('k.name = ?')
+            params.append(caller)
+        if breakpoint is not None:
+            (chrom1, pos1), (chrom2, pos2) = breakpoint
+            locus = ('(c.chrom1 = ? AND c.chrom2 = ? AND c.start1 BETWEEN ? AND ?'
+                     ' AND c.start2 BETWEEN ? AND ?)')
+            clauses.append('({} OR {})'.format(locus, locus))
+            params += [chrom1, chrom2, pos1 - slop, pos1 + slop, pos2 - slop, pos2 + slop,
+                       chrom2, chrom1, pos2 - slop, pos2 + slop, pos1 - slop, pos1 + slop]
+        sql = ('SELECT c.chrom1, c.start1, c.end1, c.chrom2, c.start2, c.end2, c.name,'
+               ' c.strand1, c.strand2, s.name, k.name, c.pair FROM calls c'
+               ' JOIN samples s ON s.id = c.sample_id JOIN callers k ON k.id = c.caller_id')
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+        sql += ' ORDER BY s.name, k.name, c.chrom1, c.start1, c.chrom2, c.start2'
+        return self.db.execute(sql, params)
+
+    def recurrent(self, gene=None, pair=None, min_callers=1, min_samples=1):
+        '''
+        Count the samples in which each fusion is reported by enough callers
+
+        Args:
+            gene (str): Only fusions with this partner
+            pair (str): Only this fusion, in either gene order
+            min_callers (int): Distinct callers needed in a sample
+            min_samples (int): Samples needed for a fusion to be reported
+        Returns:
+            list: (pair, samples, calls, sorted sample names) tuples, most
+                recurrent first
+        '''
+        clauses, params = ['p.callers >= ?'], [min_callers]
+        if gene is not None:
+            gene = self.key(gene)
+            clauses.append('(p.gene1 = ? OR p.gene2 = ?)')
+            params += [gene, gene]
+        if pair is not None:
+            clauses.append('p.pair = ?')
+            params.append(self.key(pair))
+        sql = ('SELECT p.pair, COUNT(*), SUM(p.calls), GROUP_CONCAT(s.name, ?)'
+               ' FROM pair_samples p JOIN samples s ON s.id = p.sample_id'
+               ' WHERE {} GROUP BY p.pair HAVING COUNT(*) >= ?'.format(' AND '.join(clauses)))
+        rows = self.db.execute(sql, ['\t'] + params + [min_samples]).fetchall()
+        result = [(pair, samples, calls, sorted(names.split('\t')))
+                  for pair, samples, calls, names in rows]
+        result.sort(key=lambda row: (-row[1], -row[2], row[0]))
+        return result
+
+
+def parse_breakpoint(value):
+    '''Parse '<chrom>:<pos>,<chrom>:<pos>' into ((chrom, pos), (chrom, pos))'''
+    try:
+        ends = []
+        for end in value.split(','):
+            chrom, pos = end.rsplit(':', 1)
+            ends.append((normalize.canonical_chrom(chrom), int(pos)))
+        (end1, end2) = ends
+    except ValueError:
+        raise ValueError('Breakpoint must be <chrom>:<pos>,<chrom>:<pos>: {}'.format(value))
+    return end1, end2
+
+
+def add_store_parser(subparsers):
+    parser = subparsers.add_parser('store', help='Load and query a cohort call store')
+    store_parsers = parser.add_subparsers(dest='store_command', metavar='<store-command>')
+    store_parsers.required = True
+
+    load_parser = store_parsers.add_parser('load', help='Bulk-load converted BEDPE files')
+    load_parser.add_argument('db', metavar='<db-file>', help='Store, created if missing')
+    load_parser.add_argument('inputs', nargs='+', metavar='[<caller>=]<bedpe-file>|<dir>',
+                             help='<sample>.<caller>.bedpe files, or directories of them')
+    load_parser.add_argument('--genes', dest='genes', metavar='<annotation-file>',
+                             help='Resolve names to current gene symbols (see genes.py)')
+    load_parser.add_argument('--force', action='store_true',
+                             help='Reload files even if they are unchanged')
+    load_parser.set_defaults(func=run_store_load)
+
+    query_parser = store_parsers.add_parser('query', help='Write matching calls')
+    query_parser.add_argument('db', metavar='<db-file>', help='Store to query')
+    add_filter_arguments(query_parser)
+    query_parser.add_argument('--sample', dest='sample', metavar='<sample>',
+                              help='Only calls of this sample')
+    query_parser.add_argument('--caller', dest='caller', metavar='<caller>',
+                              help='Only calls of this caller')
+    query_parser.add_argument('--breakpoint', dest='breakpoint', type=parse_breakpoint,
+                              metavar='<chrom>:<pos>,<chrom>:<pos>',
+                              help='Only calls starting at these two ends')
+    query_parser.add_argument('-slop', dest='slop', type=int, default=0,
+                              help='Largest distance from --breakpoint (default 0)')
+    query_parser.add_argument('-o', dest='outf', metavar='<out-file>',
+                              help='Output destination (default STDOUT)')
+    query_parser.set_defaults(func=run_store_query)
+
+    recurrent_parser = store_parsers.add_parser('recurrent',
+                                                help='Count samples per fusion')
+    recurrent_parser.add_argument('db', metavar='<db-file>', help='Store to query')
+    add_filter_arguments(recurrent_parser)
+    recurrent_parser.add_argument('--min-callers', dest='min_callers', type=int, default=1,
+                                  help='Callers a sample needs to count (default 1)')
+    recurrent_parser.add_argument('--min-samples', dest='min_samples', type=int, default=1,
+                                  help='Samples a fusion needs to be written (default 1)')
+    recurrent_parser.add_argument('-o', dest='outf', metavar='<out-file>',
+                                  help='Output destination (default STDOUT)')
+    recurrent_parser.set_defaults(func=run_store_recurrent)
+    return parser
+
+
+def add_filter_arguments(parser):
+    parser.add_argument('--gene', dest='gene', metavar='<gene>',
+                        help='Only fusions with this partner')
+    parser.add_argument('--pair', dest='pair', metavar='<fusion-name>',
+                        help='Only this fusion, in either gene order')
+    parser.add_argument('--genes', dest='genes', metavar='<annotation-file>',
+                        help='Resolve names to current gene symbols (see genes.py)')
+
+
+def run_store_load(args):
+    with CohortStore(args.db, bedpe_engine.make_resolver(args)) as store:
+        started = time.time()
+        loaded, calls = store.load(args.inputs, args.force, sys.stderr)
+        sys.stderr.write('fusebench store: {} files, {} calls loaded in {:.2f}s\n'.format(
+            loaded, calls, time.time() - started))
+    return 0
+
+
+def run_store_query(args):
+    with CohortStore(args.db, bedpe_engine.make_resolver(args)) as store:
+        with compressed_io.open_output(args.outf) as outf:
+            outf.write('\t'.join(QUERY_FIELDS) + '\n')
+            for row in store.query(args.gene, args.pair, args.sample, args.caller,
+                                   args.breakpoint, args.slop):
+                outf.write('\t'.join('.' if value is None else str(value)
+                                     for value in row) + '\n')
+    return 0
+
+
+def run_store_recurrent(args):
+    with CohortStore(args.db, bedpe_engine.make_resolver(args)) as store:
+        with compressed_io.open_output(args.outf) as outf:
+            outf.write('\t'.join(RECURRENT_FIELDS) + '\n')
+            for pair, samples, calls, names in store.recurrent(
+                    args.gene, args.pair, args.min_callers, args.min_samples):
+                outf.write('{}\t{}\t{}\t{}\n'.format(pair, samples, calls, ','.join(names)))
+    return 0
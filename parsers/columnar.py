@@ -0,0 +1,379 @@
+'''
+Typed, memory-mappable columnar cache of BEDPE calls.
+
+Text BEDPE has to be re-tokenised by every downstream summary. A columnar
+cache holds the same rows once as typed arrays, so that reading a column is a
+memory map and a cast rather than a parse:
+
+    start1, end1, start2, end2   int32 (-1 for unknown positions)
+    every other column           dictionary codes (uint8, uint16 or uint32,
+                                 whichever fits the dictionary)
+
+The chromosome, strand, name and passthrough columns are dictionary encoded,
+and every row carries the code of the caller that produced it, so calls from
+a whole cohort can be kept in one file.
+
+File layout:
+
+    8 bytes   magic, b'FBCOL001'
+    8 bytes   length of the JSON metadata (little-endian unsigned)
+    metadata  JSON: record count, column order, the dictionary of every
+              encoded column and the offset of every column
+    columns   each starting on an 8-byte boundary
+
+Can be run from the commandline with:
+    python fusebench.py cache build -o <cache_file> [<caller>=]<bedpe_file> ...
+    python fusebench.py cache dump [-o <output_file>] <cache_file>
+    python fusebench.py cache count <cache_file> <column> ...
+'''
+
+import json,mmap,struct,sys
+from array import array
+from collections import Counter
+from operator import itemgetter
+
+import compressed_io
+import merge_calls
+import normalize
+
+MAGIC = b'FBCOL001'
+CACHE_SUFFIX = '.fbc'
+
+INT_FIELDS = ('start1', 'end1', 'start2', 'end2')
+CALLER_FIELD = 'caller'
+
+
+def write_column_file(path, magic, metadata, blobs):
+    '''
+    Write metadata and column blobs as an 8-byte aligned column file
+
+    Args:
+        path (str): Destination, replaced atomically
+        magic (bytes): 8-byte file type marker
+        metadata (dict): JSON-serialisable metadata; its 'columns' entry is
+            filled in with [offset, typecode, length] for every blob
+        blobs (list): (name, typecode, bytes) for each column
+    '''
+    metadata['columns'] = dict()
+    # Column offsets depend on the header length, which depends on the offsets
+    header_length = 0
+    while True:
+        offset = header_length
+        for name, typecode, blob in blobs:
+            offset += -offset % 8
+            metadata['columns'][name] = [offset, typecode, len(blob)]
+            offset += len(blob)
+        encoded = json.dumps(metadata, sort_keys=True).encode('utf8')
+        length = len(magic) + 8 + len(encoded)
+        length += -length % 8
+        if length == header_length:
+            break
+        header_length = length
+
+    with compressed_io.atomic_open(path, 'wb') as outf:
+        outf.write(magic + struct.pack('<Q', len(encoded)) + encoded)
+        position = len(magic) + 8 + len(encoded)
+        for name, _, blob in blobs:
+            offset = metadata['columns'][name][0]
+            outf.write(b'\0' * (offset - position))
+            outf.write(blob)
+            position = offset + len(blob)
+
+
+def read_column_metadata(path, magic):
+    '''Return the metadata of a column file, or None if it is not one'''
+    try:
+        with open(path, 'rb') as inf:
+            if inf.read(len(magic)) != magic:
+                return None
+            (length,) = struct.unpack('<Q', inf.read(8))
+            return json.loads(inf.read(length).decode('utf8'))
+    except (IOError, OSError, ValueError, struct.error):
+        return None
+
+
+class ColumnFile(object):
+    '''
+    Read-only, memory-mapped view of a column file.
+
+    Columns are exposed as memoryviews cast to their type, straight over the
+    mapped file, so nothing is copied until values are used.
+
+    Args:
+        path (str): File written by write_column_file
+        magic (bytes): Expected file type marker
+    '''
+
+    def __init__(self, path, magic):
+        self.path = path
+        self.metadata = read_column_metadata(path, magic)
+        if self.metadata is None:
+            raise ValueError('Not a {} file: {}'.format(magic.decode('ascii'), path))
+        self._file = open(path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._map)
+        self.columns = dict()
+        for name, (offset, typecode, length) in self.metadata['columns'].items():
+            self.columns[name] = view[offset:offset + length].cast(typecode)
+
+    def close(self):
+        for column in self.columns.values():
+            column.release()
+        self.columns = dict()
+        self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class Dictionary(dict):
+    '''Value -> code mapping that assigns the next code to unseen values'''
+
+    def __missing__(self, value):
+        code = self[value] = len(self)
+        return code
+
+    def values_by_code(self):
+        return sorted(self, key=self.__getitem__)
+
+
+def code_typecode(size):
+    '''Return the narrowest unsigned array typecode holding size codes'''
+    if size <= 1 << 8:
+        return 'B'
+    if size <= 1 << 16:
+        return 'H'
+    return 'I'
+
+
+class CacheWriter(object):
+    '''
+    Accumulate BEDPE rows column by column and write them as a cache.
+
+    Args:
+        fields (list): Leading headings (default: the core BEDPE fields)
+    '''
+
+    def __init__(self, fields=None):
+        self.fields = []
+        self.values = dict()
+        self.dictionaries = dict()
+        self.size = 0
+        self.add_fields(list(fields or normalize.BEDPE_FIELDS) + [CALLER_FIELD])
+
+    def add_fields(self, fields):
+        '''Add columns, filling them with '.' for rows already added'''
+        for field in fields:
+            if field in self.values:
+                continue
+            self.fields.append(field)
+            if field in INT_FIELDS:
+                self.values[field] = array('i', [-1]) * self.size
+            else:
+                self.dictionaries[field] = Dictionary()
+                self.values[field] = array('I', [self.dictionaries[field]['.']]) * self.size
+
+    def add_rows(self, rows, fields, caller):
+        '''
+        Add one batch of rows
+
+        Args:
+            rows (list): Rows (lists) of values, strings or integers
+            fields (list): Headings of the rows
+            caller (str): Caller recorded for every row
+        '''
+        if not rows:
+            return
+        self.add_fields(fields)
+        positions = dict()
+        for pos, field in enumerate(fields):
+            positions.setdefault(field, pos)
+        first = rows[0]
+        for field in self.fields:
+            pos = positions.get(field)
+            if field == CALLER_FIELD:
+                code = self.dictionaries[field][caller]
+                self.values[field].extend(array('I', [code]) * len(rows))
+            elif pos is None:
+                if field in INT_FIELDS:
+                    self.values[field].extend(array('i', [-1]) * len(rows))
+                else:
+                    code = self.dictionaries[field]['.']
+                    self.values[field].extend(array('I', [code]) * len(rows))
+            elif field in INT_FIELDS:
+                self.values[field].extend(map(normalize.to_int, map(itemgetter(pos), rows)))
+            else:
+                # Converters emit a fixed type per column, e.g. int scores
+                column = map(itemgetter(pos), rows)
+                if type(first[pos]) is not str:
+                    column = map(str, column)
+                self.values[field].extend(map(self.dictionaries[field].__getitem__, column))
+        self.size += len(rows)
+
+    def write(self, path):
+        '''Write the accumulated rows to path'''
+        blobs = []
+        dictionaries = dict()
+        for field in self.fields:
+            if field in INT_FIELDS:
+                blobs.append((field, 'i', self.values[field].tobytes()))
+                continue
+            dictionary = self.dictionaries[field]
+            typecode = code_typecode(len(dictionary))
+            codes = self.values[field]
+            if typecode != 'I':
+                codes = array(typecode, codes)
+            blobs.append((field, typecode, codes.tobytes()))
+            dictionaries[field] = dictionary.values_by_code()
+        metadata = {'records': self.size, 'fields': self.fields,
+                    'dictionaries': dictionaries}
+        write_column_file(path, MAGIC, metadata, blobs)
+
+
+class ColumnarBedpe(ColumnFile):
+    '''
+    Read-only, memory-mapped view of a columnar cache.
+
+    Args:
+        path (str): Cache file written by CacheWriter
+    '''
+
+    def __init__(self, path):
+        super(ColumnarBedpe, self).__init__(path, MAGIC)
+        self.fields = self.metadata['fields']
+        self.dictionaries = self.metadata['dictionaries']
+
+    def __len__(self):
+        return self.metadata['records']
+
+    def column(self, field):
+        '''Return the raw column: coordinates, or dictionary codes'''
+        return self.columns[field]
+
+    def dictionary(self, field):
+        '''Return the values of an encoded column, indexed by code'''
+        return self.dictionaries[field]
+
+    def values(self, field):
+        '''Return the decoded values of one column as a list'''
+        column = self.columns[field]
+        if field in INT_FIELDS:
+            return column.tolist()
+        return [self.dictionaries[field][code] for code in column]
+
+    def rows(self):
+        '''Yield every row as a list of strings, in field order'''
+        columns = []
+        for field in self.fields:
+            if field in INT_FIELDS:
+                columns.append(map(str, self.columns[field]))
+            else:
+                columns.append(map(self.dictionaries[field].__getitem__, self.columns[field]))
+        for row in zip(*columns):
+            yield list(row)
+
+    def counts(self, *fields):
+        '''Count the rows having each combination of values of fields'''
+        counts = Counter(zip(*(self.columns[field] for field in fields)))
+        decoded = Counter()
+        for codes, count in counts.items():
+            key = tuple(code if field in INT_FIELDS else self.dictionaries[field][code]
+                        for field, code in zip(fields, codes))
+            decoded[key] += count
+        return decoded
+
+
+def read_header(lines):
+    '''
+    Read the heading line of a BEDPE file, if it has one
+
+    Returns:
+        tuple: (headings, iterator over the remaining lines)
+    '''
+    lines = iter(lines)
+    first = next(lines, '')
+    fields = first.rstrip('\r\n').lstrip('#').split('\t')
+    if fields[1:2] == ['start1']:
+        return fields, lines
+    fields = normalize.BEDPE_FIELDS + ['field{}'.format(i + 1) for i in
+                                         range(len(normalize.BEDPE_FIELDS), len(fields))]
+
+    def rest():
+        if first.strip():
+            yield first
+        for line in lines:
+            yield line
+    return fields, rest()
+
+
+def add_bedpe_file(writer, path, caller):
+    '''Add every row of a BEDPE file to a CacheWriter'''
+    with compressed_io.open_input(path) as inf:
+        fields, lines = read_header(inf)
+        rows = (line.rstrip('\r\n').split('\t') for line in lines
+                if line.strip() and not line.startswith('#'))
+        for batch in compressed_io.iter_batches(rows):
+            writer.add_rows(batch, fields, caller)
+
+
+def add_cache_parser(subparsers):
+    parser = subparsers.add_parser('cache', help='Build or read columnar BEDPE caches')
+    cache_parsers = parser.add_subparsers(dest='cache_command', metavar='<cache-command>')
+    cache_parsers.required = True
+
+    build_parser = cache_parsers.add_parser('build', help='Cache BEDPE files in one file')
+    build_parser.add_argument('inputs', nargs='+', metavar='[<caller>=]<bedpe-file>',
+                              help='BEDPE files to cache')
+    build_parser.add_argument('-o', dest='outf', metavar='<cache-file>', required=True,
+                              help='Cache destination')
+    build_parser.set_defaults(func=run_cache_build)
+
+    dump_parser = cache_parsers.add_parser('dump', help='Write a cache back out as BEDPE')
+    dump_parser.add_argument('cache', metavar='<cache-file>', help='Cache to read')
+    dump_parser.add_argument('-o', dest='outf', metavar='<out-file>',
+                             help='Output destination (default STDOUT)')
+    dump_parser.set_defaults(func=run_cache_dump)
+
+    count_parser = cache_parsers.add_parser('count',
+                                            help='Count cached rows by column values')
+    count_parser.add_argument('cache', metavar='<cache-file>', help='Cache to read')
+    count_parser.add_argument('fields', nargs='+', metavar='<column>',
+                              help='Columns to group by, e.g. caller name')
+    count_parser.set_defaults(func=run_cache_count)
+    return parser
+
+
+def run_cache_build(args):
+    writer = CacheWriter()
+    for spec in args.inputs:
+        caller, path = merge_calls.parse_input(spec)
+        add_bedpe_file(writer, path, caller)
+    writer.write(args.outf)
+    sys.stderr.write('fusebench cache: {} rows from {} files\n'.format(
+        writer.size, len(args.inputs)))
+    return 0
+
+
+def run_cache_dump(args):
+    with ColumnarBedpe(args.cache) as cache:
+        with compressed_io.open_output(args.outf) as outf:
+            outf.write('\t'.join(cache.fields) + '\n')
+            for row in cache.rows():
+                outf.write('\t'.join(row) + '\n')
+    return 0
+
+
+def run_cache_count(args):
+    with ColumnarBedpe(args.cache) as cache:
+        missing = [field for field in args.fields if field not in cache.fields]
+        if missing:
+            raise SystemExit('fusebench cache: no column {}'.format(', '.join(missing)))
+        counts = cache.counts(*args.fields)
+        sys.stdout.write('\t'.join(args.fields + ['count']) + '\n')
+        for key, count in sorted(counts.items(), key=lambda item: (-item[1], item[0])):
+            sys.stdout.write('\t'.join(str(value) for value in key + (count,)) + '\n')
+    return 0
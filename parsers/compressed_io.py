@@ -0,0 +1,315 @@
+'''
+Transparent gzip and BGZF reading and writing for the fusebench tools.
+
+Inputs are recognised by their leading bytes rather than their names, so a
+compressed file (or STDIN) is read directly. BGZF files, as written by bgzip
+and htslib, are sequences of independent gzip members of at most 64 KiB, so
+their blocks are decompressed in parallel on a thread pool. Other gzip files
+are decompressed on a background thread, overlapping with the parsing done by
+the reader. zlib releases the GIL while it works, so both scale beyond one
+core.
+
+Outputs whose names end in .gz or .bgz are written as BGZF, compressed block
+by block on the same kind of thread pool. BGZF is valid gzip, so the files
+can be read with zcat and indexed with tabix.
+'''
+
+import io,os,queue,struct,sys,threading,zlib
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+GZIP_MAGIC = b'\x1f\x8b'
+COMPRESSED_SUFFIXES = ('.gz', '.bgz')
+
+# Uncompressed bytes per BGZF block, as in htslib
+BGZF_BLOCK_SIZE = 0xff00
+BGZF_HEADER = struct.Struct('<4BI2BH2B2H')
+BGZF_FOOTER = struct.Struct('<2I')
+BGZF_EOF = bytes.fromhex('1f8b08040000000000ff0600424302001b0003000000000000000000')
+
+# Bytes handed to the text layer at a time when decompressing plain gzip
+CHUNK_SIZE = 1 << 20
+
+DEFAULT_THREADS = min(4, os.cpu_count() or 1)
+
+# Rows handed on at a time by iter_batches
+BATCH_SIZE = 8192
+
+
+def is_compressed_name(path):
+    '''Return True if path names a file that should be written compressed'''
+    return path is not None and path.endswith(COMPRESSED_SUFFIXES)
+
+
+def is_bgzf(header):
+    '''Return True if header (the first 18 bytes of a file) starts a BGZF block'''
+    return (len(header) >= 18 and header[:4] == b'\x1f\x8b\x08\x04'
+            and header[12:14] == b'BC')
+
+
+def _inflate_block(cdata, crc, size):
+    data = zlib.decompress(cdata, -15)
+    if len(data) != size or zlib.crc32(data) != crc:
+        raise IOError('BGZF block failed its CRC/size check')
+    return data
+
+
+def _deflate_block(data, level):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    cdata = compressor.compress(data) + compressor.flush()
+    header = BGZF_HEADER.pack(0x1f, 0x8b, 8, 4, 0, 0, 0xff, 6,
+                              ord('B'), ord('C'), 2,
+                              BGZF_HEADER.size + len(cdata) + BGZF_FOOTER.size - 1)
+    return header + cdata + BGZF_FOOTER.pack(zlib.crc32(data), len(data))
+
+
+def read_bgzf_blocks(raw):
+    '''
+    Yield (compressed data, crc, size) for each BGZF block of a binary stream
+    '''
+    while True:
+        header = raw.read(BGZF_HEADER.size)
+        if not header:
+            return
+        if len(header) < BGZF_HEADER.size:
+            raise IOError('Truncated BGZF block')
+        if not is_bgzf(header):
+            raise IOError('Not a BGZF block')
+        block_size = BGZF_HEADER.unpack(header)[-1] + 1
+        rest = raw.read(block_size - BGZF_HEADER.size)
+        if len(rest) != block_size - BGZF_HEADER.size:
+            raise IOError('Truncated BGZF block')
+        crc, size = BGZF_FOOTER.unpack(rest[-BGZF_FOOTER.size:])
+        if size:
+            yield rest[:-BGZF_FOOTER.size], crc, size
+
+
+def iter_bgzf(raw, threads=DEFAULT_THREADS):
+    '''Yield the decompressed blocks of a BGZF stream, in order'''
+    if threads < 2:
+        for block in read_bgzf_blocks(raw):
+            yield _inflate_block(*block)
+        return
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        for block in read_bgzf_blocks(raw):
+            pending.append(executor.submit(_inflate_block, *block))
+            if len(pending) > 2 * threads:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def iter_gzip(raw):
+    '''
+    Yield the decompressed chunks of a (possibly multi-member) gzip stream,
+    inflating on a background thread
+    '''
+    chunks = queue.Queue(maxsize=8)
+
+    def inflate():
+        try:
+            decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+            in_member = False
+            while True:
+                data = raw.read(CHUNK_SIZE)
+                if not data:
+                    break
+                while data:
+                    in_member = True
+                    chunks.put(decompressor.decompress(data))
+                    data = decompressor.unused_data
+                    if decompressor.eof:
+                        decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+                        in_member = False
+                        # Trailing zero padding after the last member
+                        if not data.strip(b'\0'):
+                            data = b''
+            if in_member:
+                raise EOFError('Compressed file ended before the end-of-stream marker')
+            chunks.put(None)
+        except Exception as err:
+            chunks.put(err)
+
+    thread = threading.Thread(target=inflate, daemon=True)
+    thread.start()
+    while True:
+        chunk = chunks.get()
+        if chunk is None:
+            return
+        if isinstance(chunk, Exception):
+            raise chunk
+        if chunk:
+            yield chunk
+
+
+class ChunkReader(io.RawIOBase):
+    '''Read-only binary stream over an iterator of byte strings'''
+
+    def __init__(self, chunks, raw):
+        self._chunks = chunks
+        self._raw = raw
+        self._pending = memoryview(b'')
+        self._offset = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buf):
+        while self._offset == len(self._pending):
+            chunk = next(self._chunks, b'')
+            if not chunk:
+                return 0
+            self._pending = memoryview(chunk)
+            self._offset = 0
+        size = min(len(buf), len(self._pending) - self._offset)
+        buf[:size] = self._pending[self._offset:self._offset + size]
+        self._offset += size
+        return size
+
+    def close(self):
+        if not self.closed:
+            self._chunks.close()
+            self._raw.close()
+        super(ChunkReader, self).close()
+
+
+class BgzfWriter(io.RawIOBase):
+    '''
+    Write-only binary stream compressing to BGZF
+
+    Args:
+        raw (file): Binary stream receiving the compressed blocks
+        threads (int): Blocks compressed concurrently
+        level (int): zlib compression level
+    '''
+
+    def __init__(self, raw, threads=DEFAULT_THREADS, level=6):
+        self._raw = raw
+        self._level = level
+        self._buffer = bytearray()
+        self._pending = deque()
+        self._threads = threads
+        self._executor = ThreadPoolExecutor(max_workers=threads) if threads > 1 else None
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._buffer += data
+        while len(self._buffer) >= BGZF_BLOCK_SIZE:
+            self._submit(bytes(self._buffer[:BGZF_BLOCK_SIZE]))
+            del self._buffer[:BGZF_BLOCK_SIZE]
+        return len(data)
+
+    def _submit(self, data):
+        if self._executor is None:
+            self._raw.write(_deflate_block(data, self._level))
+            return
+        self._pending.append(self._executor.submit(_deflate_block, data, self._level))
+        while len(self._pending) > 2 * self._threads:
+            self._raw.write(self._pending.popleft().result())
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            if self._buffer:
+                self._submit(bytes(self._buffer))
+                self._buffer = bytearray()
+            while self._pending:
+                self._raw.write(self._pending.popleft().result())
+            self._raw.write(BGZF_EOF)
+        finally:
+            if self._executor is not None:
+                self._executor.shutdown()
+            self._raw.close()
+            super(BgzfWriter, self).close()
+
+
+def iter_batches(rows, size=BATCH_SIZE):
+    '''Yield successive lists of at most size rows'''
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+def open_input(path=None, newline=None, threads=DEFAULT_THREADS):
+    '''
+    Open a text input, decompressing gzip or BGZF transparently
+
+    Args:
+        path (str): File to read, or None for STDIN
+        newline (str): As for open(); '' for csv readers
+        threads (int): Decompression threads
+    Returns:
+        file: text stream
+    '''
+    raw = open(path, 'rb') if path else sys.stdin.buffer
+    if not isinstance(raw, io.BufferedReader):
+        raw = io.BufferedReader(raw)
+    header = raw.peek(BGZF_HEADER.size)[:BGZF_HEADER.size]
+    if not header.startswith(GZIP_MAGIC):
+        # Reuse the peeked stream: reopening would lose the data of a pipe
+        return io.TextIOWrapper(raw, newline=newline)
+    chunks = iter_bgzf(raw, threads) if is_bgzf(header) else iter_gzip(raw)
+    return io.TextIOWrapper(io.BufferedReader(ChunkReader(chunks, raw), CHUNK_SIZE),
+                            newline=newline)
+
+
+def open_stdout(mode, **kwargs):
+    '''Open STDOUT's file descriptor again, so that closing the file keeps it open'''
+    sys.stdout.flush()
+    return open(sys.stdout.fileno(), mode, closefd=False, **kwargs)
+
+
+def open_output(path=None, newline=None, compress=None, threads=DEFAULT_THREADS):
+    '''
+    Open a text output, writing BGZF for .gz and .bgz names
+
+    Args:
+        path (str): File to write, or None for STDOUT
+        newline (str): As for open(); '' for csv writers
+        compress (bool): Force compression on or off, overriding the name
+        threads (int): Compression threads
+    Returns:
+        file: text stream; for STDOUT, closing it leaves STDOUT open
+    '''
+    if compress is None:
+        compress = is_compressed_name(path)
+    if not compress:
+        if path:
+            return open(path, 'w', newline=newline)
+        return open_stdout('w', newline=newline, encoding=sys.stdout.encoding)
+    raw = open(path, 'wb') if path else open_stdout('wb')
+    return io.TextIOWrapper(io.BufferedWriter(BgzfWriter(raw, threads), CHUNK_SIZE),
+                            newline=newline)
+
+
+@contextmanager
+def atomic_open(path, mode='w'):
+    '''
+    Open path for writing so that it only appears once complete
+
+    Output goes to a temporary file in the same directory, which replaces
+    path when the block exits cleanly and is removed if it raises. Text
+    written to a .gz or .bgz path is BGZF compressed.
+    '''
+    tmp_path = '{}.tmp{}'.format(path, os.getpid())
+    try:
+        if 'b' in mode:
+            outf = open(tmp_path, mode)
+        else:
+            outf = open_output(tmp_path, newline='', compress=is_compressed_name(path))
+        with outf:
+            yield outf
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
@@ -0,0 +1,449 @@
+'''
+In-process execution of the per-sample pipeline, passing row batches
+between stages in memory.
+
+pipeline/Makefile, and the steps of pipeline_runner.py, hand every stage
+its input through a file and start a new interpreter per step. Here all
+samples of a cohort run in one process, and the rows of each caller output
+flow through
+
+    convert    read and map the caller output (one stream per file)
+    normalize  canonical chromosomes (normalize.py)
+    validate   validate_bedpe checks; the report is written to
+               <sample>.<caller>.bedpe.validated
+    collect    keep the calls for merging, and write <sample>.<caller>.bedpe
+               if asked to
+    merge      cluster the calls of all callers of the sample (merge_calls.py)
+    annotate   add the matching records of breakpoint indexes
+
+writing only <sample>.merged.tsv and the validation reports. Every caller
+is converted in-process, deFuse and PAVfinder included (see
+defuse_to_bedpe.py and pavfinder_to_bedpe.py), so a flow run and a
+pipeline run merge the same calls.
+
+Batches of one stream pass each stage in order, but batches of different
+streams, and the later stages of earlier batches, run at the same time on
+one shared thread pool. Every stage can be limited:
+
+    --limit <stage>=<n>[:<rows>]
+
+runs at most <n> batches in the stage at once, and holds at most <rows> rows
+between reading them and leaving the stage; readers wait for room before
+reading more. For convert, rows are held from reading them until they leave
+collect. Merge and annotate work on all calls of a sample at once, so they
+take only <n>. zlib, file I/O and mmap lookups release the GIL, so
+decompression and writing overlap with parsing.
+
+Can be run from the commandline with:
+    python fusebench.py flow -d <output_dir> [-j <workers>] [--limit <stage>=<n>[:<rows>]]
+        [-x <index_file> ...] [--bedpe] <input_dir>
+'''
+
+import csv,os,sys,threading,time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import batch_convert
+import bedpe_engine
+import breakpoint_index
+import compressed_io
+import merge_calls
+import normalize
+import registry
+import validate_bedpe
+
+STAGES = ['convert', 'normalize', 'validate', 'collect', 'merge', 'annotate']
+
+# Stages passing row batches, whose rows can be capped
+STREAM_STAGES = STAGES[:4]
+
+SUMMARY_FIELDS = ['sample', 'inputs', 'calls', 'events', 'invalid', 'status',
+                  'seconds', 'error']
+
+
+class StreamAborted(Exception):
+    '''Raised in the batches of a stream after one of them failed'''
+
+
+class RowBudget(object):
+    '''
+    Cap on the rows held by a stage
+
+    A batch larger than the whole budget is let through on its own, so a
+    small cap slows a stage down rather than blocking it.
+    '''
+
+    def __init__(self, limit=None):
+        self.limit = limit
+        self.used = 0
+        self.condition = threading.Condition()
+
+    def acquire(self, rows):
+        if self.limit is None:
+            return
+        with self.condition:
+            while self.used and self.used + rows > self.limit:
+                self.condition.wait()
+            self.used += rows
+
+    def release(self, rows):
+        if self.limit is None:
+            return
+        with self.condition:
+            self.used -= rows
+            self.condition.notify_all()
+
+
+class Stream(object):
+    '''Ordering and failure state of the batches of one source'''
+
+    def __init__(self, num_stages):
+        self.next = [0] * num_stages
+        self.condition = threading.Condition()
+        self.error = None
+
+    @contextmanager
+    def turn(self, stage, seq):
+        '''Wait until batch seq is the next one due at stage'''
+        with self.condition:
+            while self.next[stage] != seq and self.error is None:
+                self.condition.wait()
+            if self.error is not None:
+                raise StreamAborted()
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.next[stage] += 1
+                self.condition.notify_all()
+
+    def fail(self, err):
+        with self.condition:
+            if self.error is None:
+                self.error = err
+            self.condition.notify_all()
+
+
+class Scheduler(object):
+    '''
+    Shared worker pool with per-stage concurrency and row limits
+
+    Args:
+        workers (int): Threads in the pool (default: one per CPU, at least 4)
+        limits (dict): {stage: (concurrency or None, rows or None)}
+    '''
+
+    def __init__(self, workers=None, limits=None):
+        limits = limits or dict()
+        self.workers = workers or max(4, os.cpu_count() or 1)
+        self.pool = ThreadPoolExecutor(max_workers=self.workers)
+        self.slots = dict()
+        self.limits = dict()
+        self.budgets = dict()
+        for stage in STAGES:
+            concurrency, rows = limits.get(stage, (None, None))
+            self.slots[stage] = threading.BoundedSemaphore(concurrency) if concurrency else None
+            self.limits[stage] = concurrency or self.workers
+            if stage in STREAM_STAGES:
+                self.budgets[stage] = RowBudget(rows)
+
+    def concurrency(self, stage):
+        '''Return the number of batches stage may run at once'''
+        return self.limits[stage]
+
+    @contextmanager
+    def slot(self, stage):
+        '''Hold one of the concurrency slots of a stage'''
+        slot = self.slots[stage]
+        if slot is None:
+            yield
+            return
+        with slot:
+            yield
+
+    def stream(self, source, batches, stages):
+        '''
+        Push the batches of one source through stages, in order
+
+        Args:
+            source (str): Stage producing batches, e.g. 'convert'
+            batches (iterable): Lists of rows
+            stages (list): (stage name, function of a batch returning a batch)
+        Raises:
+            the first exception raised by a stage
+        '''
+        stream = Stream(len(stages))
+        # The source holds a batch's rows until the batch leaves the last stage
+        names = [source] + [name for name, _ in stages]
+        pending = deque()
+        try:
+            with self.slot(source):
+                for seq, batch in enumerate(batches):
+                    if stream.error is not None:
+                        break
+                    # Always in stage order, so readers never deadlock
+                    for name in names:
+                        self.budgets[name].acquire(len(batch))
+                    pending.append(self.pool.submit(self._run, stream, seq, batch, source,
+                                                    stages))
+                    while pending and pending[0].done():
+                        pending.popleft()
+        except BaseException as err:
+            stream.fail(err)
+            raise
+        finally:
+            for future in pending:
+                future.exception()
+        if stream.error is not None:
+            raise stream.error
+
+    def _run(self, stream, seq, batch, source, stages):
+        rows = len(batch)
+        released = 0
+        try:
+            for i, (name, func) in enumerate(stages):
+                with stream.turn(i, seq):
+                    with self.slot(name):
+                        batch = func(batch)
+                self.budgets[name].release(rows)
+                released += 1
+        except StreamAborted:
+            pass
+        except BaseException as err:
+            stream.fail(err)
+        finally:
+            for name, _ in stages[released:]:
+                self.budgets[name].release(rows)
+            self.budgets[source].release(rows)
+
+    def task(self, stage, func, *args):
+        '''Run func in the pool, holding a slot of stage'''
+        def run():
+            with self.slot(stage):
+                return func(*args)
+        return self.pool.submit(run)
+
+    def shutdown(self):
+        self.pool.shutdown()
+
+
+def parse_limit(spec):
+    '''
+    Parse a <stage>=<n>[:<rows>] limit
+
+    Returns:
+        tuple: (stage, (concurrency or None, rows or None))
+    '''
+    stage, sep, value = spec.partition('=')
+    if not sep or stage not in STAGES:
+        raise ValueError('Expected <stage>=<n>[:<rows>] with a stage of {}: {!r}'.format(
+            ', '.join(STAGES), spec))
+    concurrency, _, rows = value.partition(':')
+    if rows and stage not in STREAM_STAGES:
+        raise ValueError('{} works on whole samples, so only its concurrency can be '
+                         'limited: {!r}'.format(stage, spec))
+    return stage, (int(concurrency) if concurrency else None, int(rows) if rows else None)
+
+
+class SampleRun(object):
+    '''
+    Everything one sample produces, filled in as its streams finish
+
+    Args:
+        sample (str): Sample name
+        jobs (list): batch_convert.Job for each caller output of the sample
+    '''
+
+    def __init__(self, sample, jobs):
+        self.sample = sample
+        self.jobs = jobs
+        self.calls = [[] for _ in jobs]
+        self.invalid = 0
+        self.events = 0
+        self.error = ''
+        self.started = time.time()
+
+
+def normalized_calls(rows, caller):
+    '''
+    Turn normalised BEDPE rows into call tuples, lower breakpoint first, as
+    merge_calls.oriented_call does, without canonicalising their chromosomes
+    a second time. The rows themselves keep the caller's order of the ends
+
+    Yields:
+        tuple: the call of every placed row
+    '''
+    to_int = normalize.to_int
+    is_ordered = normalize.is_ordered
+    for row in rows:
+        start1, end1 = to_int(row[1]), to_int(row[2])
+        start2, end2 = to_int(row[4]), to_int(row[5])
+        if start1 < 0 or start2 < 0:
+            continue
+        end1, end2 = max(end1, start1 + 1), max(end2, start2 + 1)
+        if is_ordered(row[0], start1, row[3], start2):
+            yield (row[0], row[3], start1, end1, start2, end2, row[8], row[9], row[6], caller)
+        else:
+            yield (row[3], row[0], start2, end2, start1, end1, row[9], row[8], row[6], caller)
+
+
+def run_stream(scheduler, job, calls, keep_bedpe=False, max_errors=None):
+    '''
+    Convert, normalise, validate and collect the calls of one caller output
+
+    Returns:
+        bool: True if the output is valid BEDPE
+    '''
+    with compressed_io.open_input(job.inf_path, newline='') as inf:
+        converter, lines = registry.resolve(inf, job.fmt)
+        out_fields, batches = bedpe_engine.convert_batches(converter, lines, normalized=False)
+        normalizer = normalize.Normalizer()
+        validator = validate_bedpe.Validator(max_errors=max_errors)
+        validator.set_header(out_fields)
+        with compressed_io.atomic_open(bedpe_engine.report_path(job.outf_path)) as report:
+            with compressed_io.atomic_open(job.outf_path) if keep_bedpe else open(os.devnull, 'w') as outf:
+                writer = csv.writer(outf, delimiter='\t', lineterminator='\n')
+                if keep_bedpe:
+                    writer.writerow(out_fields)
+                validate_bedpe.write_report_header(report)
+                # Line 1 of the BEDPE is its header
+                position = [2]
+
+                def validate(batch):
+                    errors = validator.check_values(batch, position[0])
+                    validate_bedpe.write_errors(errors, report)
+                    position[0] += len(batch)
+                    return batch
+
+                def collect(batch):
+                    if keep_bedpe:
+                        writer.writerows(batch)
+                    calls.extend(normalized_calls(batch, job.caller))
+                    return batch
+
+                scheduler.stream('convert', batches, [('normalize', normalizer.normalize_rows),
+                                                      ('validate', validate),
+                                                      ('collect', collect)])
+                validator.write_summary(report)
+    return validator.is_valid()
+
+
+def finish_sample(scheduler, run, outdir, indexes, slop):
+    '''Merge and annotate the calls of one sample, writing <sample>.merged.tsv'''
+    calls = [call for calls in run.calls for call in calls]
+    with scheduler.slot('merge'):
+        rows = list(merge_calls.events(calls, slop))
+    fields = list(merge_calls.MERGE_FIELDS)
+    if indexes:
+        with scheduler.slot('annotate'):
+            rows = list(breakpoint_index.annotate(rows, indexes))
+        fields += [index.label for index in indexes]
+    with compressed_io.atomic_open(os.path.join(outdir, run.sample + '.merged.tsv')) as outf:
+        outf.write('\t'.join(fields) + '\n')
+        for row in rows:
+            outf.write('\t'.join(row) + '\n')
+    run.events = len(rows)
+
+
+def run_cohort(root, outdir, scheduler, indexes=(), slop=merge_calls.DEFAULT_SLOP,
+               keep_bedpe=False, max_errors=None):
+    '''
+    Run every sample below root through the in-memory stages
+
+    Yields:
+        dict: one summary row per sample, as it finishes
+    '''
+    jobs = batch_convert.assign_outputs(batch_convert.find_jobs(root), outdir)
+    by_sample = dict()
+    for job in jobs:
+        by_sample.setdefault(job.sample, []).append(job)
+    runs = [SampleRun(sample, by_sample[sample]) for sample in sorted(by_sample)]
+
+    # Readers block on their stage limits, so they get threads of their own
+    with ThreadPoolExecutor(max_workers=scheduler.concurrency('convert')) as readers:
+        streams = []
+        for run in runs:
+            for job, calls in zip(run.jobs, run.calls):
+                streams.append((run, readers.submit(run_stream, scheduler, job, calls,
+                                                    keep_bedpe, max_errors)))
+        merges = deque()
+        waiting = dict((run.sample, len(run.jobs)) for run in runs)
+        for run, future in streams:
+            try:
+                if not future.result():
+                    run.invalid += 1
+            except Exception as err:
+                run.error = run.error or '{}: {}'.format(type(err).__name__, err)
+            waiting[run.sample] -= 1
+            if waiting[run.sample] == 0:
+                merges.append((run, None if run.error else scheduler.pool.submit(
+                    finish_sample, scheduler, run, outdir, indexes, slop)))
+            while merges and (merges[0][1] is None or merges[0][1].done()):
+                yield summary_row(*merges.popleft())
+        while merges:
+            yield summary_row(*merges.popleft())
+
+
+def summary_row(run, future):
+    if future is not None:
+        try:
+            future.result()
+        except Exception as err:
+            run.error = '{}: {}'.format(type(err).__name__, err)
+    return {'sample': run.sample, 'inputs': len(run.jobs),
+            'calls': sum(len(calls) for calls in run.calls), 'events': run.events,
+            'invalid': run.invalid, 'status': 'failed' if run.error else 'ok',
+            'seconds': '{:.3f}'.format(time.time() - run.started), 'error': run.error}
+
+
+def add_flow_parser(subparsers):
+    parser = subparsers.add_parser('flow',
+                                   help='Convert, validate, merge and annotate a cohort in memory')
+    parser.add_argument('root', metavar='<in-dir>',
+                        help='Directory of per-caller, per-sample outputs')
+    parser.add_argument('-d', dest='outdir', metavar='<out-dir>', required=True,
+                        help='Directory receiving <sample>.merged.tsv and validation reports')
+    parser.add_argument('-j', dest='workers', metavar='<workers>', type=int,
+                        help='Threads in the shared pool (default: one per CPU, at least 4)')
+    parser.add_argument('--limit', dest='limits', action='append', default=[],
+                        metavar='<stage>=<n>[:<rows>]',
+                        help='Run at most <n> batches of a stage at once, holding at most '
+                             '<rows> rows; stages are ' + ', '.join(STAGES) + ' (<rows> only '
+                             'for ' + ', '.join(STREAM_STAGES) + ')')
+    parser.add_argument('-x', dest='indexes', action='append', default=[],
+                        metavar='<index-file>', help='Breakpoint index to annotate with')
+    parser.add_argument('-slop', dest='slop', type=int, default=merge_calls.DEFAULT_SLOP,
+                        help='Largest gap between merged ends (default {})'.format(
+                            merge_calls.DEFAULT_SLOP))
+    parser.add_argument('--bedpe', dest='keep_bedpe', action='store_true',
+                        help='Also write <sample>.<caller>.bedpe')
+    parser.add_argument('--max-errors', dest='max_errors', type=int, metavar='<n>',
+                        help='Stop reporting after <n> violations per file')
+    parser.set_defaults(func=run_flow)
+    return parser
+
+
+def run_flow(args):
+    try:
+        limits = dict(parse_limit(spec) for spec in args.limits)
+    except ValueError as err:
+        raise SystemExit('fusebench flow: {}'.format(err))
+    if not os.path.isdir(args.outdir):
+        os.makedirs(args.outdir)
+    scheduler = Scheduler(args.workers, limits)
+    indexes = [breakpoint_index.BreakpointIndex(path) for path in args.indexes]
+    failed = 0
+    try:
+        sys.stdout.write('\t'.join(SUMMARY_FIELDS) + '\n')
+        for row in run_cohort(args.root, args.outdir, scheduler, indexes, args.slop,
+                              args.keep_bedpe, args.max_errors):
+            if row['status'] != 'ok':
+                failed += 1
+            sys.stdout.write('\t'.join(str(row[field]) for field in SUMMARY_FIELDS) + '\n')
+            sys.stdout.flush()
+    finally:
+        scheduler.shutdown()
+        for index in indexes:
+            index.close()
+    return 1 if failed else 0
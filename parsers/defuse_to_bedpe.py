@@ -0,0 +1,69 @@
+'''
+Convert deFuse output (results.classify.tsv or results.filtered.tsv) to
+BEDPE format.
+
+Can be run from the commandline with:
+    python defuse_to_bedpe.py -i <input_file> -o <output_file>
+
+If no <input_file> and/or <output_file> is specified, the file will read/write
+from/to STDIN/STDOUT, allowing for piping into and out of the program.
+'''
+
+import sys
+
+import bedpe_engine
+
+def compile_core(index):
+    '''
+    Compile the mapping from input columns to the core BEDPE fields
+
+    Args:
+        index (dict): {'heading': position} mapping for the input header
+    Returns:
+        function: maps one input row (list) to a list of BEDPE values
+    '''
+    chr1, chr2 = index['gene_chromosome1'], index['gene_chromosome2']
+    pos1, pos2 = index['genomic_break_pos1'], index['genomic_break_pos2']
+    gene1, gene2 = index['gene_name1'], index['gene_name2']
+    strand1, strand2 = index['gene_strand1'], index['gene_strand2']
+    def map_core(row):
+        break1 = int(row[pos1])
+        break2 = int(row[pos2])
+        return ['chr' + row[chr1], break1, break1 + 1,
+                'chr' + row[chr2], break2, break2 + 1,
+                row[gene1] + '-' + row[gene2], 0, row[strand1], row[strand2]]
+    return map_core
+
+
+def add_fields(bedpe_fields, input_fields):
+    '''Add fields from input to end of BEDPE format'''
+    to_add = []
+    specified_fields = ['gene_chromosome1', 'gene_chromosome2',
+                        'genomic_break_pos1', 'genomic_break_pos2',
+                        'gene_name1', 'gene_name2', 'gene_strand1', 'gene_strand2']
+    #add all but specified fields
+    to_add += [elem for elem in input_fields if elem not in specified_fields]
+    return bedpe_fields + to_add
+
+
+CONVERTER = bedpe_engine.Converter('defuse', compile_core,
+                                   extra_fields=lambda in_fields: add_fields([], in_fields),
+                                   signature=['cluster_id', 'gene_name1', 'gene_name2',
+                                              'genomic_break_pos1', 'genomic_break_pos2'])
+
+
+def get_parser():
+    return bedpe_engine.get_parser()
+
+
+def main():
+    '''
+    Convert deFuse output to BEDPE format.
+    '''
+    return bedpe_engine.main(CONVERTER)
+
+
+
+
+if __name__ == '__main__':
+    sys.exit(main())
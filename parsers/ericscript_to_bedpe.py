@@ -3,115 +3,75 @@
 Convert EricScript output to BEDPE format.
 
 Can be run from the commandline with:
-    python fusioncatcher_to_bedpe.py -i <input_file> -o <output_file>
+    python ericscript_to_bedpe.py -i <input_file> -o <output_file>
 
 If no <input_file> and/or <output_file> is specified, the file will read/write
 from/to STDIN/STDOUT, allowing for piping into and out of the program.
 '''
 
-import argparse,sys,csv
+import sys
 
-def map_fields(input_row, headings):
+import bedpe_engine
+
+def compile_core(index):
     '''
-    Map fields from the input row to bedpe_fields
+    Compile the mapping from input columns to the core BEDPE fields
 
     Args:
-        input_row (dict): {'heading': value} mapping for one row in input
-        headings (list): A list of all BEDPE headings to include
+        index (dict): {'heading': position} mapping for the input header
     Returns:
-        dict: the return value. A single BEDPE row
+        function: maps one input row (list) to a list of BEDPE values
     '''
-    out_row = dict()
-
-    [chr1, pos1, strand1 ] = input_row['chr1'], input_row['Breakpoint1'], input_row['strand1']
-
-    out_row['chrom1'] = 'chr{num}'.format(num=chr1)
-    if(pos1.isdigit()):
-        out_row['start1'] = int(pos1)
-        out_row['end1'] = int(pos1)
-    else:
-        out_row['start1'] = -1
-        out_row['end1'] = -1
-
-    out_row['strand1'] = strand1
-
-    [chr2, pos2, strand2 ] = input_row['chr2'], input_row['Breakpoint2'], input_row['strand2']
-
-    out_row['chrom2'] = 'chr{num}'.format(num=chr2)
-
-    if(pos2.isdigit()):
-        out_row['start2'] = int(pos2) - 1
-        out_row['end2'] = int(pos2)
-    else:
-        out_row['start2'] = -1
-        out_row['end2'] = -1
-
-    out_row['strand2'] = strand1
-
-
-    gene1 = input_row['GeneName1']
-    gene2 = input_row['GeneName2']
-    out_row['name'] = '{G1}-{G2}'.format(G1=gene1, G2=gene2)
-
-    out_row['score'] = input_row['EricScore']
-
-    for heading in headings:
-        if (heading not in out_row) and (heading in input_row):
-            out_row[heading] = input_row[heading]
-        elif heading not in out_row:
-            out_row[heading] = '.'
-    return out_row
+    chr1, pos1, strand1 = index['chr1'], index['Breakpoint1'], index['strand1']
+    chr2, pos2, strand2 = index['chr2'], index['Breakpoint2'], index['strand2']
+    gene1, gene2 = index['GeneName1'], index['GeneName2']
+    score = index['EricScore']
+
+    def map_core(row):
+        out_row = ['chr' + row[chr1], -1, -1, 'chr' + row[chr2], -1, -1,
+                   row[gene1] + '-' + row[gene2], row[score],
+                   row[strand1], row[strand2]]
+        pos = row[pos1]
+        if pos.isdigit():
+            out_row[1] = int(pos) - 1
+            out_row[2] = int(pos)
+        pos = row[pos2]
+        if pos.isdigit():
+            out_row[4] = int(pos) - 1
+            out_row[5] = int(pos)
+        return out_row
+    return map_core
 
 
 def add_fields(bedpe_fields):
     '''Add fields from input to end of BEDPE format'''
     '''Specific to EricScript'''
     to_add = ['ES', 'EnsembleGene1', 'EnsembleGene2', 'GJS',
-              'GeneExpr1', 'GeneExpr2', 'GeneExpr_Fused'
+              'GeneExpr1', 'GeneExpr2', 'GeneExpr_Fused',
               'InfoGene1', 'InfoGene2', 'JunctionSequence', 'US',
-              'crossingreads', 'fusiontype', 'homology', 'mean.insertsize'
+              'crossingreads', 'fusiontype', 'homology', 'mean.insertsize',
               'spanningreads']
     return bedpe_fields + to_add
 
 
+CONVERTER = bedpe_engine.Converter('ericscript', compile_core,
+                                   extra_fields=add_fields([]),
+                                   signature=['GeneName1', 'GeneName2',
+                                              'Breakpoint1', 'Breakpoint2', 'EricScore'])
+
+
 def get_parser():
-    parser = argparse.ArgumentParser()
-    parser.add_argument('-i', dest='inf', metavar='<in-file>',
-                        help='File to parse (default STDIN)')
-    parser.add_argument('-o', dest='outf', metavar='<out-file>',
-                        help='Output BEDPE destination (default STDOUT)')
-    return parser
+    return bedpe_engine.get_parser()
 
 
 def main():
     '''
-    Convert FusionCatcher output to BEDPE format.
+    Convert EricScript output to BEDPE format.
     '''
-    # Get args
-    parser = get_parser()
-    args = parser.parse_args()
-    with open(args.inf, 'r') if args.inf else sys.stdin as inf:
-        with open(args.outf, 'w') if args.outf else sys.stdout as outf:
-            #
-            # Organize I/O
-            #
-
-            # Input file is tab delimited plus heading
-            reader = csv.DictReader(inf, delimiter='\t')
-
-            # Output is always BEDPE
-            init_fieldnames = ['chrom1', 'start1', 'end1', 'chrom2', 'start2',
-                                'end2', 'name', 'score', 'strand1', 'strand2']
-            fieldnames = add_fields(init_fieldnames)
-            writer = csv.DictWriter(outf, fieldnames=fieldnames, delimiter='\t')
-            writer.writeheader()
-            for in_row in reader:
-                out_row = map_fields(in_row, fieldnames)
-                writer.writerow(out_row)
-    return 0
+    return bedpe_engine.main(CONVERTER)
 
 
 
 
 if __name__ == '__main__':
-    main()
+    sys.exit(main())
@@ -0,0 +1,315 @@
+'''
+Sort BEDPE by (chrom1, chrom2, start1, start2) in bounded memory.
+
+The merge in merge_annotations.sh and the setkey in data_table_merger.r want
+sorted inputs, and sorting a whole ChimerDB or PanCan export in memory is
+what runs small nodes out of memory. Here at most <spill-rows> rows are held
+at a time: each full buffer is sorted and spilled to a temporary run file,
+and the runs are merged with a heap holding one row per run. With more than
+MERGE_FAN_IN runs, groups of runs are first merged into longer ones, so the
+number of open files is bounded as well.
+
+With several workers, full buffers are handed to worker processes, which
+sort and write the runs while the main process goes on reading (and
+converting) the next rows. At most one buffer per worker is in flight.
+
+Chromosomes compare as strings and starts as integers, with unparseable
+starts first, so for numeric starts the order is that of
+
+    LC_ALL=C sort -s -t $'\\t' -k1,1 -k4,4 -k2,2n -k5,5n
+
+and rows with equal keys keep their input order. Converters write sorted
+output with --sort (see bedpe_engine.py), and
+
+    python fusebench.py sort [-o <out-file>] [-S <rows>] [-j <workers>] <bedpe_file> ...
+
+sorts existing BEDPE files into one, keeping the heading of the first.
+'''
+
+import csv,heapq,io,os,shutil,sys,tempfile,time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain, islice
+
+import compressed_io
+import metrics
+import normalize
+
+# Rows held in memory before a run is spilled
+SPILL_ROWS = 1 << 20
+
+# Runs merged at once; more are merged in several passes
+MERGE_FAN_IN = 128
+
+# Rows yielded at a time
+BATCH_SIZE = 8192
+
+RUN_BUFFER_SIZE = 1 << 16
+
+
+def sort_key(row):
+    '''Return the (chrom1, chrom2, start1, start2) key of a BEDPE row'''
+    to_int = normalize.to_int
+    return (row[0], row[3], to_int(row[1]), to_int(row[4]))
+
+
+def write_rows(rows, path):
+    with open(path, 'w', newline='', buffering=RUN_BUFFER_SIZE) as outf:
+        csv.writer(outf, delimiter='\t', lineterminator='\n').writerows(rows)
+
+
+def read_run(path):
+    '''Yield the rows of a run file'''
+    with open(path, newline='', buffering=RUN_BUFFER_SIZE) as inf:
+        for row in csv.reader(inf, delimiter='\t'):
+            yield row
+
+
+def sort_run(text, path):
+    '''Sort rows formatted as TSV text and write them as a run (in a worker)'''
+    rows = list(csv.reader(io.StringIO(text, newline=''), delimiter='\t'))
+    rows.sort(key=sort_key)
+    write_rows(rows, path)
+    return path
+
+
+def merge_runs(paths, path):
+    '''Merge sorted runs into one longer run, removing the inputs'''
+    write_rows(heapq.merge(*[read_run(run) for run in paths], key=sort_key), path)
+    for run in paths:
+        os.remove(run)
+    return path
+
+
+def format_rows(rows):
+    '''Format rows as the TSV text a run holds'''
+    text = io.StringIO(newline='')
+    csv.writer(text, delimiter='\t', lineterminator='\n').writerows(rows)
+    return text.getvalue()
+
+
+class ExternalSorter(object):
+    '''
+    Sort a stream of BEDPE rows, spilling sorted runs to disk
+
+    A sorter is used for one stream: sorted_batches may be called once.
+
+    Args:
+        spill_rows (int): Rows held in memory before a sorted run is written
+        workers (int): Processes sorting and writing runs; with 1 they are
+            sorted in this process
+        tmp_dir (str): Directory for the runs (default: the system's)
+        batch_size (int): Rows per yielded batch
+    '''
+
+    def __init__(self, spill_rows=SPILL_ROWS, workers=1, tmp_dir=None, batch_size=BATCH_SIZE):
+        if spill_rows < 1:
+            raise ValueError('spill_rows must be positive, not {}'.format(spill_rows))
+        self.spill_rows = spill_rows
+        self.workers = max(1, workers or 1)
+        self.tmp_dir = tmp_dir
+        self.batch_size = batch_size
+        self.runs = []
+
+    def sorted_batches(self, batches, stage=None):
+        '''
+        Sort every row of batches
+
+        Args:
+            batches (iterable): Lists of rows (lists of strings)
+            stage (metrics.StageMetrics): If given, times the sort phase
+                (buffering and spilling) and the merge phase
+        Returns:
+            generator: lists of at most batch_size rows, in key order
+        '''
+        clock = time.perf_counter
+        run_dir = tempfile.mkdtemp(prefix='fusebench-sort-', dir=self.tmp_dir)
+        executor = ProcessPoolExecutor(max_workers=self.workers) if self.workers > 1 else None
+        try:
+            pending = deque()
+            buffer = []
+            for rows in batches:
+                started = clock()
+                buffer.extend(rows)
+                if len(buffer) >= self.spill_rows:
+                    self.spill(buffer, run_dir, executor, pending)
+                    buffer = []
+                if stage is not None:
+                    stage.add('sort', clock() - started)
+            started = clock()
+            buffer.sort(key=sort_key)
+            while pending:
+                pending.popleft().result()
+            self.reduce_runs(run_dir, executor)
+            if stage is not None:
+                stage.add('sort', clock() - started)
+            if self.runs:
+                rows = heapq.merge(*[read_run(run) for run in self.runs] + [buffer],
+                                   key=sort_key)
+            else:
+                rows = iter(buffer)
+            while True:
+                started = clock()
+                batch = list(islice(rows, self.batch_size))
+                if stage is not None:
+                    stage.add('merge', clock() - started)
+                if not batch:
+                    return
+                yield batch
+        finally:
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
+            shutil.rmtree(run_dir, ignore_errors=True)
+
+    def spill(self, rows, run_dir, executor, pending):
+        path = os.path.join(run_dir, 'run{:06d}'.format(len(self.runs)))
+        self.runs.append(path)
+        if executor is None:
+            rows.sort(key=sort_key)
+            write_rows(rows, path)
+            return
+        # Text pickles far faster than lists of rows
+        pending.append(executor.submit(sort_run, format_rows(rows), path))
+        while len(pending) > self.workers:
+            pending.popleft().result()
+
+    def reduce_runs(self, run_dir, executor):
+        '''Merge runs in groups until at most MERGE_FAN_IN are left'''
+        passes = 0
+        while len(self.runs) > MERGE_FAN_IN:
+            passes += 1
+            groups = [self.runs[i:i + MERGE_FAN_IN]
+                      for i in range(0, len(self.runs), MERGE_FAN_IN)]
+            paths = [os.path.join(run_dir, 'merge{}-{:06d}'.format(passes, number))
+                     for number in range(len(groups))]
+            if executor is None:
+                self.runs = [merge_runs(group, path) for group, path in zip(groups, paths)]
+            else:
+                self.runs = list(executor.map(merge_runs, groups, paths))
+
+
+def read_sort_input(inf, heading):
+    '''
+    Yield batches of the data rows of a BEDPE stream
+
+    Leading comment and heading lines are appended to heading instead.
+    '''
+    lines = iter(inf)
+    for line in lines:
+        if line.startswith('#') or line.split('\t')[1:2] == ['start1']:
+            heading.append(line.rstrip('\r\n'))
+            continue
+        lines = chain([line], lines)
+        break
+    batch = []
+    for line in lines:
+        if not line.strip():
+            continue
+        row = line.rstrip('\r\n').split('\t')
+        if len(row) < 5:
+            raise ValueError('Expected at least 5 fields, not {}: {}'.format(
+                len(row), line.rstrip('\r\n')))
+        batch.append(row)
+        if len(batch) == BATCH_SIZE:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def sort_files(inf_paths, outf, sorter, stage=None):
+    '''
+    Sort the rows of BEDPE files into one stream
+
+    Args:
+        inf_paths (list): BEDPE files, plain or gzip/BGZF; None is STDIN
+        outf (file): Text stream receiving the heading of the first file
+            and every row in key order
+        sorter (ExternalSorter): Sorter to use
+        stage (metrics.StageMetrics): If given, counts rows and times the
+            sort, merge and write phases
+    Returns:
+        int: the number of rows written
+    '''
+    headings = []
+
+    def batches():
+        for inf_path in inf_paths:
+            heading = []
+            with compressed_io.open_input(inf_path) as inf:
+                for batch in read_sort_input(inf, heading):
+                    if stage is not None:
+                        stage.rows_in += len(batch)
+                    yield batch
+            headings.append(heading)
+
+    sorted_batches = sorter.sorted_batches(batches(), stage)
+    # Every input has been read once the first sorted batch is out
+    first = next(sorted_batches, [])
+    if headings and headings[0]:
+        outf.write('\n'.join(headings[0]) + '\n')
+    count = 0
+    clock = time.perf_counter
+    for batch in chain([first], sorted_batches):
+        started = clock()
+        outf.writelines(['\t'.join(row) + '\n' for row in batch])
+        count += len(batch)
+        if stage is not None:
+            stage.add('write', clock() - started)
+    if stage is not None:
+        stage.rows_out += count
+    return count
+
+
+def positive_int(value):
+    '''Parse a count that must be at least 1'''
+    number = int(value)
+    if number < 1:
+        raise ValueError(value)
+    return number
+
+
+def add_sort_parser(subparsers):
+    parser = subparsers.add_parser('sort',
+                                   help='Sort BEDPE by chrom1, chrom2, start1, start2 '
+                                        'in bounded memory')
+    parser.add_argument('inputs', nargs='*', metavar='<bedpe-file>',
+                        help='BEDPE files to sort into one (default STDIN)')
+    parser.add_argument('-o', dest='outf', metavar='<out-file>',
+                        help='Output destination, BGZF if it ends in .gz (default STDOUT)')
+    parser.add_argument('-S', '--spill-rows', dest='spill_rows', type=positive_int,
+                        default=SPILL_ROWS, metavar='<rows>',
+                        help='Rows sorted in memory before a run is spilled to disk '
+                             '(default %(default)s)')
+    parser.add_argument('-j', dest='workers', type=positive_int, default=1,
+                        metavar='<workers>',
+                        help='Number of processes sorting runs (default 1)')
+    parser.add_argument('-T', '--tmp-dir', dest='tmp_dir', metavar='<dir>',
+                        help='Directory for spilled runs (default: system temporary directory)')
+    metrics.add_metrics_arguments(parser)
+    parser.set_defaults(func=run_sort)
+    return parser
+
+
+def run_sort(args):
+    return metrics.run_instrumented(args, 'sort', lambda run: sort_main(args, run))
+
+
+def sort_main(args, run=None):
+    sorter = ExternalSorter(args.spill_rows, args.workers, args.tmp_dir)
+    stage = run.stage('sort', input=','.join(args.inputs) or '-') if run else None
+    inf_paths = args.inputs or [None]
+    try:
+        if args.outf:
+            with compressed_io.atomic_open(args.outf) as outf:
+                sort_files(inf_paths, outf, sorter, stage)
+        else:
+            sort_files(inf_paths, sys.stdout, sorter, stage)
+    except (IOError, OSError, ValueError) as err:
+        sys.stderr.write('fusebench sort: {}\n'.format(err))
+        return 1
+    if stage is not None:
+        stage.bytes_read = sum(metrics.file_size(path) for path in args.inputs)
+        stage.bytes_written = metrics.file_size(args.outf)
+        stage.finish()
+    return 0
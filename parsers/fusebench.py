@@ -0,0 +1,177 @@
+'''
+Single command-line entry point for fusebench.
+
+Can be run from the commandline with:
+    python fusebench.py convert [-f <format>] -o <output_file> <input_file>
+    python fusebench.py convert [-f <format>] -d <output_dir> <input_file> ...
+    python fusebench.py batch -d <output_dir> [-j <workers>] <input_dir>
+    python fusebench.py pairtopair -a <bedpe_a> -b <bedpe_b> [-type both]
+    python fusebench.py annotate <bedpe_a> <bedpe_b> [-o <output_file>]
+    python fusebench.py merge [-slop <bp>] [<caller>=]<bedpe_file> ...
+    python fusebench.py index build [-d <index_dir>] <database_file> ...
+    python fusebench.py index annotate <bedpe_file> <index_file> ...
+    python fusebench.py names build [-d <index_dir>] <database_file> ...
+    python fusebench.py names annotate <bedpe_file> <index_file> ...
+    python fusebench.py daemon start --socket <path> [-x <index_file> ...] [-n <names_file> ...]
+    python fusebench.py daemon annotate --socket <path> <bedpe_file>
+    python fusebench.py cache build -o <cache_file> [<caller>=]<bedpe_file> ...
+    python fusebench.py incidence build -o <matrix_file> [<set>=]<bedpe_file> ...
+    python fusebench.py store load <db_file> <bedpe_file>|<output_dir> ...
+    python fusebench.py store recurrent <db_file> [--gene <gene>] [--min-callers <n>]
+    python fusebench.py pipeline -d <output_dir> [-j <workers>] <input_dir>
+    python fusebench.py bench run [-n <rows>,<rows>...] [-o <results_file>]
+    python fusebench.py flow -d <output_dir> [-j <workers>] [--limit <stage>=<n>] <input_dir>
+    python fusebench.py sort [-S <rows>] [-j <workers>] [-o <output_file>] <bedpe_file> ...
+
+The input format is detected from the header line unless -f is given. Any
+number of input files are converted in a single process. With no input files,
+convert reads from STDIN and writes to STDOUT. batch converts a whole
+<caller>/<sample>/ directory tree on a process pool (see batch_convert.py).
+pairtopair and annotate compare two BEDPE files (see pair_overlap.py), and
+merge clusters the calls of any number of callers (see merge_calls.py).
+index builds and queries persisted database indexes (see breakpoint_index.py),
+and names does the same by unordered gene pair (see gene_pair_index.py).
+daemon keeps both kinds of index open and annotates for any number of
+clients over a Unix socket or loopback port (see annotation_daemon.py).
+cache keeps BEDPE files as one typed, memory-mapped columnar file (see
+columnar.py), and incidence builds fusion x caller matrices and UpSet
+intersection counts (see incidence.py). store bulk-loads converted calls into
+an indexed SQLite cohort store and answers gene, breakpoint and recurrence
+queries from it (see cohort_store.py). pipeline converts, validates and
+merges a whole cohort, redoing only what changed (see pipeline_runner.py),
+and flow does the same in one process, passing rows between the stages in
+memory (see dataflow.py). bench generates synthetic inputs of every format
+and times conversion, validation, merging and annotation (see benchmark.py).
+convert and merge write per-phase timings with --metrics <json-file> and
+profiles with --profile or --sample-profile (see metrics.py). convert and
+batch divert rows they cannot convert to a side file with --quarantine (see
+quarantine.py), write fusion names as current gene symbols with --genes
+(see genes.py), drop calls with too little evidence as they convert with
+--where '<expression>' (see row_filter.py), and write rows sorted by
+chrom1, chrom2, start1 and start2 with --sort. sort does the same for
+existing BEDPE files, spilling sorted runs to disk so that memory use is
+bounded by -S <rows> (see external_sort.py).
+'''
+
+import argparse,os,sys
+
+import annotation_daemon
+import batch_convert
+import benchmark
+import bedpe_engine
+import breakpoint_index
+import cohort_store
+import columnar
+import dataflow
+import external_sort
+import gene_pair_index
+import incidence
+import merge_calls
+import metrics
+import pair_overlap
+import pipeline_runner
+import registry
+
+
+def output_path(outdir, inf_path):
+    '''Name the BEDPE output for inf_path inside outdir'''
+    stem = os.path.splitext(os.path.basename(inf_path))[0]
+    return os.path.join(outdir, stem + '.bedpe')
+
+
+def add_convert_parser(subparsers):
+    parser = subparsers.add_parser('convert',
+                                   help='Convert caller or database output to BEDPE')
+    parser.add_argument('inputs', nargs='*', metavar='<in-file>',
+                        help='Files to parse (default STDIN)')
+    parser.add_argument('-f', dest='fmt', choices=registry.format_names(),
+                        help='Input format (default: detect from header)')
+    parser.add_argument('-o', dest='outf', metavar='<out-file>',
+                        help='Output BEDPE destination for a single input '
+                             '(default STDOUT)')
+    parser.add_argument('-d', dest='outdir', metavar='<out-dir>',
+                        help='Directory receiving one <name>.bedpe per input')
+    bedpe_engine.add_validate_arguments(parser)
+    bedpe_engine.add_quarantine_arguments(parser)
+    bedpe_engine.add_normalize_argument(parser)
+    bedpe_engine.add_where_argument(parser)
+    bedpe_engine.add_sort_arguments(parser)
+    metrics.add_metrics_arguments(parser)
+    parser.set_defaults(func=run_convert)
+    return parser
+
+
+def run_convert(args):
+    '''
+    Convert every input file, reporting failures without stopping
+    '''
+    return metrics.run_instrumented(args, 'convert', lambda run: convert_all(args, run))
+
+
+def convert_all(args, run=None):
+    if args.outdir is None:
+        if len(args.inputs) > 1:
+            raise SystemExit('fusebench convert: -d is required with several inputs')
+        jobs = [(args.inputs[0] if args.inputs else None, args.outf)]
+    else:
+        if args.outf:
+            raise SystemExit('fusebench convert: -o and -d are mutually exclusive')
+        jobs = [(path, output_path(args.outdir, path)) for path in args.inputs]
+        outputs = [outf_path for _, outf_path in jobs]
+        if len(set(outputs)) != len(outputs):
+            raise SystemExit('fusebench convert: input names collide in {}'.format(args.outdir))
+        if not os.path.isdir(args.outdir):
+            os.makedirs(args.outdir)
+
+    status = 0
+    for inf_path, outf_path in jobs:
+        validator = bedpe_engine.make_validator(args)
+        stage = run.stage('convert', input=inf_path or '-') if run else None
+        try:
+            rejected = bedpe_engine.make_quarantine(args)
+            registry.convert_file(inf_path, outf_path, args.fmt, validator, args.normalized,
+                                  stage, rejected, bedpe_engine.make_resolver(args), args.where,
+                                  bedpe_engine.make_sorter(args), args.ordered)
+        except (IOError, OSError, ValueError, KeyError) as err:
+            sys.stderr.write('fusebench convert: {}: {}\n'.format(inf_path or '<stdin>', err))
+            status = 1
+        else:
+            if validator is not None and not validator.is_valid():
+                status = 1
+    return status
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(prog='fusebench')
+    subparsers = parser.add_subparsers(dest='command', metavar='<command>')
+    subparsers.required = True
+    add_convert_parser(subparsers)
+    batch_convert.add_batch_parser(subparsers)
+    pair_overlap.add_overlap_parsers(subparsers)
+    merge_calls.add_merge_parser(subparsers)
+    breakpoint_index.add_index_parser(subparsers)
+    gene_pair_index.add_names_parser(subparsers)
+    annotation_daemon.add_daemon_parser(subparsers)
+    columnar.add_cache_parser(subparsers)
+    incidence.add_incidence_parser(subparsers)
+    cohort_store.add_store_parser(subparsers)
+    pipeline_runner.add_pipeline_parser(subparsers)
+    dataflow.add_flow_parser(subparsers)
+    external_sort.add_sort_parser(subparsers)
+    benchmark.add_bench_parser(subparsers)
+    return parser
+
+
+def main(argv=None):
+    '''
+    Run one fusebench command.
+    '''
+    parser = get_parser()
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -8,47 +8,31 @@ If no <input_file> and/or <output_file> is specified, the file will read/write
 from/to STDIN/STDOUT, allowing for piping into and out of the program.
 '''
 
-import argparse,sys,csv,codecs
+import sys
 
-sys.stdin = codecs.getreader('utf8')(sys.stdin)
-sys.stdout = codecs.getwriter('utf8')(sys.stdout)
+import bedpe_engine
 
-def map_fields(input_row, headings):
+def compile_core(index):
     '''
-    Map fields from the input row to bedpe_fields
+    Compile the mapping from input columns to the core BEDPE fields
 
     Args:
-        input_row (dict): {'heading': value} mapping for one row in input
-        headings (list): A list of all BEDPE headings to include
+        index (dict): {'heading': position} mapping for the input header
     Returns:
-        dict: the return value. A single BEDPE row
+        function: maps one input row (list) to a list of BEDPE values
     '''
-    out_row = dict()
+    point1 = index['Fusion_point_for_gene_1(5end_fusion_partner)']
+    point2 = index['Fusion_point_for_gene_2(3end_fusion_partner)']
+    gene1 = index['Gene_1_symbol(5end_fusion_partner)']
+    gene2 = index['Gene_2_symbol(3end_fusion_partner)']
 
-    [chr1, pos1, strand1 ] = input_row['Fusion_point_for_gene_1(5end_fusion_partner)'].split(':')
-    out_row['chrom1'] = 'chr{num}'.format(num=chr1)
-    out_row['start1'] = int(pos1) - 1 # 1-based
-    out_row['end1'] = pos1
-    out_row['strand1'] = strand1
-
-    [chr2, pos2, strand2] = input_row['Fusion_point_for_gene_2(3end_fusion_partner)'].split(':')
-    out_row['chrom2'] = 'chr{num}'.format(num=chr2)
-    out_row['start2'] = int(pos2) - 1
-    out_row['end2'] = pos2
-    out_row['strand2'] = strand2
-
-    gene1 = input_row['Gene_1_symbol(5end_fusion_partner)']
-    gene2 = input_row['Gene_2_symbol(3end_fusion_partner)']
-    out_row['name'] = '{G1}-{G2}'.format(G1=gene1, G2=gene2)
-
-    out_row['score'] = 0
-
-    for heading in headings:
-        if (heading not in out_row) and (heading in input_row):
-            out_row[heading] = input_row[heading]
-        elif heading not in out_row:
-            out_row[heading] = '.'
-    return out_row
+    def map_core(row):
+        [chr1, pos1, strand1] = row[point1].split(':')
+        [chr2, pos2, strand2] = row[point2].split(':')
+        return ['chr' + chr1, int(pos1) - 1, pos1, # 1-based
+                'chr' + chr2, int(pos2) - 1, pos2,
+                row[gene1] + '-' + row[gene2], 0, strand1, strand2]
+    return map_core
 
 
 def add_fields(bedpe_fields):
@@ -62,45 +46,24 @@ def add_fields(bedpe_fields):
     return bedpe_fields + to_add
 
 
+CONVERTER = bedpe_engine.Converter('fusioncatcher', compile_core,
+                                   extra_fields=add_fields([]),
+                                   signature=['Fusion_point_for_gene_1(5end_fusion_partner)',
+                                              'Fusion_point_for_gene_2(3end_fusion_partner)'])
+
+
 def get_parser():
-    parser = argparse.ArgumentParser()
-    parser.add_argument('-i', dest='inf', metavar='<in-file>',
-                        help='File to parse (default STDIN)')
-    parser.add_argument('-o', dest='outf', metavar='<out-file>',
-                        help='Output BEDPE destination (default STDOUT)')
-    return parser
+    return bedpe_engine.get_parser()
 
 
 def main():
     '''
     Convert FusionCatcher output to BEDPE format.
     '''
-    # Get args
-    parser = get_parser()
-    args = parser.parse_args()
-    with open(args.inf, 'rU') if args.inf else sys.stdin as inf:
-        with open(args.outf, 'wb') if args.outf else sys.stdout as outf:
-            #
-            # Organize I/O
-            #
-
-            # Input file is tab delimited plus heading
-            reader = csv.DictReader(inf, delimiter='\t')
-
-            # Output is always BEDPE
-            init_fieldnames = ['chrom1', 'start1', 'end1', 'chrom2', 'start2',
-                                'end2', 'name', 'score', 'strand1', 'strand2']
-            fieldnames = add_fields(init_fieldnames)
-            writer = csv.DictWriter(outf, fieldnames=fieldnames,
-                                    lineterminator='\n', delimiter='\t')
-            writer.writeheader()
-            for in_row in reader:
-                out_row = map_fields(in_row, fieldnames)
-                writer.writerow(out_row)
-    return 0
+    return bedpe_engine.main(CONVERTER)
 
 
 
 
 if __name__ == '__main__':
-    main()
+    sys.exit(main())
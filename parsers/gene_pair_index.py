@@ -0,0 +1,347 @@
+'''
+Prebuilt, memory-mappable gene-pair index for annotation databases.
+
+Where breakpoint_index.py answers "which database records overlap this
+call", a gene-pair index answers "which records name this fusion": every
+record of a database export (CIViC, ChimerDB, PanCan or any other registered
+format) is keyed by its unordered gene pair, so KMT2A-MLLT3, MLLT3--KMT2A and
+kmt2a_mllt3 all find the same records. Names that do not split into two
+genes are keyed by the whole name.
+
+Keys live in an open-addressing hash table (CRC-32 of the key, linear
+probing, at most half full) written as fixed-width column arrays, so a
+reader memory-maps the file and a lookup is a hash, one or two probes and a
+byte comparison, with nothing parsed or loaded up front. Worker processes
+that open the same index share its pages through the page cache.
+
+File layout:
+
+    8 bytes   magic, b'FBGPI001'
+    8 bytes   length of the JSON metadata (little-endian unsigned)
+    metadata  JSON: source path and SHA-256, format, record and key counts,
+              table size, gene annotation hash and the offset of every column
+    columns   each starting on an 8-byte boundary:
+              slots           int32, table size entries: key number or -1
+              key_hashes      uint32, CRC-32 of each key
+              key_offsets     int64, keys + 1 entries
+              keys            UTF-8 bytes, 'GENE1--GENE2' in sorted order
+              record_offsets  int64, keys + 1 entries
+              records         int32, record numbers in the export, grouped
+                              by key
+
+With --genes, names are resolved to current symbols (see genes.py) both
+when building and when looking up, so aliases and transcript ids match too.
+The metadata keeps the hash of the source export and of the gene
+annotation, so building again only does work when either has changed.
+
+Can be run from the commandline with:
+    python fusebench.py names build [-f <format>] [-d <index_dir>] [--genes <file>] <database_file> ...
+    python fusebench.py names annotate [--genes <file>] <bedpe_file> <index_file> ...
+    python fusebench.py names lookup <index_file> <fusion_name> ...
+'''
+
+import itertools,os,sys,zlib
+from array import array
+
+import bedpe_engine
+import breakpoint_index
+import columnar
+import compressed_io
+import genes
+import normalize
+import pair_overlap
+import registry
+
+MAGIC = b'FBGPI001'
+INDEX_SUFFIX = '.fbg'
+
+EMPTY = -1
+
+
+def key_hash(encoded):
+    '''Return the table hash of an encoded key, the same in every process'''
+    return zlib.crc32(encoded) & 0xffffffff
+
+
+def table_size(keys):
+    '''Return the smallest power of two at least twice the number of keys'''
+    size = 8
+    while size < 2 * keys:
+        size <<= 1
+    return size
+
+
+def index_path(source, index_dir=None):
+    '''Name the index for a database export'''
+    stem = os.path.splitext(os.path.basename(source))[0]
+    return os.path.join(index_dir or os.path.dirname(source), stem + INDEX_SUFFIX)
+
+
+def read_metadata(path):
+    '''Return the metadata of an index file, or None if it is not one'''
+    return columnar.read_column_metadata(path, MAGIC)
+
+
+def is_current(path, source_sha256, genes_sha256=None):
+    '''Return True if the index at path was built from these source and gene files'''
+    metadata = read_metadata(path)
+    return (metadata is not None and metadata.get('source_sha256') == source_sha256 and
+            metadata.get('genes_sha256') == genes_sha256)
+
+
+def database_names(converter, lines, resolver=None):
+    '''
+    Convert a database export and yield the name of every record
+
+    Args:
+        converter (bedpe_engine.Converter): Format of the export
+        lines (iterable): Text lines of the export, starting at its header
+        resolver (genes.GeneResolver): If given, names are resolved to
+            current symbols
+    Yields:
+        tuple: (record number in the export, name)
+    '''
+    _, batches = bedpe_engine.convert_batches(converter, lines, resolver=resolver)
+    record = 0
+    for out_rows in batches:
+        for row in out_rows:
+            yield record, str(row[6])
+            record += 1
+
+
+def write_index(path, source, source_sha256, fmt, names, genes_sha256=None):
+    '''
+    Write the hash table of record names as an index file
+
+    Args:
+        path (str): Index destination
+        source (str): Database export the names came from
+        source_sha256 (str): Hash of source
+        fmt (str): Format name of source
+        names (iterable): (record number, name) pairs
+        genes_sha256 (str): Hash of the gene annotation names were resolved
+            with, if any
+    '''
+    grouped = dict()
+    records = 0
+    for record, name in names:
+        records += 1
+        if name and name != '.':
+            grouped.setdefault(normalize.fusion_key(name), []).append(record)
+
+    size = table_size(len(grouped))
+    mask = size - 1
+    slots = array('i', [EMPTY]) * size
+    key_hashes = array('I')
+    key_offsets = array('q', [0])
+    keys = bytearray()
+    record_offsets = array('q', [0])
+    record_column = array('i')
+    for number, key in enumerate(sorted(grouped)):
+        encoded = key.encode('utf8')
+        hashed = key_hash(encoded)
+        slot = hashed & mask
+        while slots[slot] != EMPTY:
+            slot = (slot + 1) & mask
+        slots[slot] = number
+        key_hashes.append(hashed)
+        keys.extend(encoded)
+        key_offsets.append(len(keys))
+        record_column.extend(grouped[key])
+        record_offsets.append(len(record_column))
+
+    blobs = [('slots', 'i', slots.tobytes()), ('key_hashes', 'I', key_hashes.tobytes()),
+             ('key_offsets', 'q', key_offsets.tobytes()), ('keys', 'B', bytes(keys)),
+             ('record_offsets', 'q', record_offsets.tobytes()),
+             ('records', 'i', record_column.tobytes())]
+    metadata = {'source': os.path.abspath(source), 'source_sha256': source_sha256,
+                'format': fmt, 'records': records, 'keys': len(grouped),
+                'table_size': size, 'genes_sha256': genes_sha256}
+    columnar.write_column_file(path, MAGIC, metadata, blobs)
+
+
+def build(source, path=None, fmt=None, force=False, genes_path=None):
+    '''
+    Build the gene-pair index for a database export unless it is already current
+
+    Args:
+        source (str): Raw database export
+        path (str): Index destination (default <source stem>.fbg beside it)
+        fmt (str): Registered format name, or None to sniff the header
+        force (bool): Rebuild even if the source is unchanged
+        genes_path (str): Gene annotation to resolve names with (see genes.py)
+    Returns:
+        tuple: (index path, True if it was rebuilt)
+    '''
+    path = path or index_path(source)
+    source_sha256 = breakpoint_index.file_sha256(source)
+    genes_sha256 = breakpoint_index.file_sha256(genes_path) if genes_path else None
+    if not force and is_current(path, source_sha256, genes_sha256):
+        return path, False
+    resolver = genes.load(genes_path) if genes_path else None
+    with compressed_io.open_input(source, newline='') as inf:
+        converter, lines = registry.resolve(inf, fmt)
+        write_index(path, source, source_sha256, converter.name,
+                    database_names(converter, lines, resolver), genes_sha256)
+    return path, True
+
+
+class GenePairIndex(columnar.ColumnFile):
+    '''
+    Read-only, memory-mapped view of a gene-pair index file.
+
+    Args:
+        path (str): Index file written by build
+        resolver (genes.GeneResolver): Resolves looked up names the way the
+            index was built (see --genes)
+    '''
+
+    def __init__(self, path, resolver=None):
+        super(GenePairIndex, self).__init__(path, MAGIC)
+        self.label = os.path.splitext(os.path.basename(path))[0]
+        self.resolver = resolver
+        self.mask = self.metadata['table_size'] - 1
+
+    def __len__(self):
+        return self.metadata['keys']
+
+    def __contains__(self, name):
+        return self.find(normalize.fusion_key(name, self.resolver)) != EMPTY
+
+    def key(self, number):
+        '''Return key number as a string'''
+        offsets = self.columns['key_offsets']
+        return bytes(self.columns['keys'][offsets[number]:offsets[number + 1]]).decode('utf8')
+
+    def find(self, key):
+        '''Return the number of a key (see normalize.fusion_key), or -1 if it is not indexed'''
+        encoded = key.encode('utf8')
+        hashed = key_hash(encoded)
+        slots, key_hashes = self.columns['slots'], self.columns['key_hashes']
+        offsets, keys = self.columns['key_offsets'], self.columns['keys']
+        slot = hashed & self.mask
+        while True:
+            number = slots[slot]
+            if number == EMPTY:
+                return EMPTY
+            if key_hashes[number] == hashed and \
+                    keys[offsets[number]:offsets[number + 1]] == encoded:
+                return number
+            slot = (slot + 1) & self.mask
+
+    def lookup(self, name):
+        '''
+        Find the records naming the same gene pair as name
+
+        Args:
+            name (str): Fusion name, in either gene order
+        Returns:
+            list: record numbers in the export (empty if none)
+        '''
+        number = self.find(normalize.fusion_key(name, self.resolver))
+        if number == EMPTY:
+            return []
+        offsets = self.columns['record_offsets']
+        return self.columns['records'][offsets[number]:offsets[number + 1]].tolist()
+
+
+def annotate(rows, indexes):
+    '''
+    Add the database records sharing the gene pair of BEDPE rows
+
+    Args:
+        rows (iterable): BEDPE rows (lists of strings)
+        indexes (list): Open GenePairIndex objects
+    Yields:
+        list: each row followed by one column per index, holding the matching
+            record numbers or '.'
+    '''
+    for row in rows:
+        extra = []
+        for index in indexes:
+            records = index.lookup(row[6]) if len(row) > 6 else []
+            extra.append(','.join(map(str, records)) or '.')
+        yield row + extra
+
+
+def add_names_parser(subparsers):
+    parser = subparsers.add_parser('names', help='Build or use database gene-pair indexes')
+    names_parsers = parser.add_subparsers(dest='names_command', metavar='<names-command>')
+    names_parsers.required = True
+
+    build_parser = names_parsers.add_parser('build', help='Index database exports by gene pair')
+    build_parser.add_argument('sources', nargs='+', metavar='<database-file>',
+                              help='Raw CIViC, ChimerDB, PanCan, ... exports')
+    build_parser.add_argument('-f', dest='fmt', choices=registry.format_names(),
+                              help='Input format (default: detect from header)')
+    build_parser.add_argument('-d', dest='index_dir', metavar='<index-dir>',
+                              help='Directory receiving <name>.fbg (default: beside source)')
+    build_parser.add_argument('--genes', dest='genes', metavar='<annotation-file>',
+                              help='Resolve names to current gene symbols (see genes.py)')
+    build_parser.add_argument('--force', action='store_true',
+                              help='Rebuild even if the source is unchanged')
+    build_parser.set_defaults(func=run_names_build)
+
+    annotate_parser = names_parsers.add_parser(
+        'annotate', help='Add database records with the same gene pair to BEDPE')
+    annotate_parser.add_argument('bedpe', metavar='<bedpe-file>', help='BEDPE to annotate')
+    annotate_parser.add_argument('indexes', nargs='+', metavar='<index-file>',
+                                 help='Indexes built with names build')
+    annotate_parser.add_argument('--genes', dest='genes', metavar='<annotation-file>',
+                                 help='Resolve names to current gene symbols (see genes.py)')
+    annotate_parser.add_argument('-o', dest='outf', metavar='<out-file>',
+                                 help='Output destination (default STDOUT)')
+    annotate_parser.set_defaults(func=run_names_annotate)
+
+    lookup_parser = names_parsers.add_parser('lookup', help='Look fusion names up in an index')
+    lookup_parser.add_argument('index', metavar='<index-file>', help='Index built with names build')
+    lookup_parser.add_argument('names', nargs='+', metavar='<fusion-name>',
+                               help='Fusion names, e.g. KMT2A-MLLT3')
+    lookup_parser.add_argument('--genes', dest='genes', metavar='<annotation-file>',
+                               help='Resolve names to current gene symbols (see genes.py)')
+    lookup_parser.set_defaults(func=run_names_lookup)
+    return parser
+
+
+def run_names_build(args):
+    if args.index_dir and not os.path.isdir(args.index_dir):
+        os.makedirs(args.index_dir)
+    for source in args.sources:
+        path, rebuilt = build(source, index_path(source, args.index_dir), args.fmt,
+                              args.force, args.genes)
+        sys.stderr.write('fusebench names: {} {}\n'.format(
+            path, 'built' if rebuilt else 'up to date'))
+    return 0
+
+
+def run_names_annotate(args):
+    resolver = bedpe_engine.make_resolver(args)
+    indexes = [GenePairIndex(path, resolver) for path in args.indexes]
+    try:
+        with compressed_io.open_input(args.bedpe) as inf:
+            with compressed_io.open_output(args.outf) as outf:
+                header = inf.readline()
+                if header.startswith('#') or header.split('\t')[1:2] == ['start1']:
+                    outf.write(header.rstrip('\r\n') + ''.join(
+                        '\t' + index.label for index in indexes) + '\n')
+                    lines = inf
+                else:
+                    lines = itertools.chain([header], inf)
+                for row in annotate(pair_overlap.read_bedpe(lines), indexes):
+                    outf.write('\t'.join(row) + '\n')
+    finally:
+        for index in indexes:
+            index.close()
+    return 0
+
+
+def run_names_lookup(args):
+    with GenePairIndex(args.index, bedpe_engine.make_resolver(args)) as index:
+        found = 0
+        for name in args.names:
+            records = index.lookup(name)
+            found += len(records) > 0
+            sys.stdout.write('{}\t{}\t{}\n'.format(
+                name, normalize.fusion_key(name, index.resolver),
+                ','.join(map(str, records)) or '.'))
+    return 0 if found == len(args.names) else 1
@@ -0,0 +1,160 @@
+'''
+Resolve gene aliases, previous symbols and transcript ids to current gene
+symbols, so that fusion names agree across callers.
+
+Callers name the partners of a fusion by whatever identifier they were run
+with: MLL-MLLT3 from one and KMT2A--MLLT3 from another, CIViC by Ensembl
+transcript. Given a local annotation file, every partner is looked up and
+the name is written as SYMBOL1--SYMBOL2.
+
+The annotation is either an HGNC download (hgnc_complete_set.txt, or any
+tab-separated file with a 'symbol' column), from which these columns are
+read, each holding one or more '|'-separated ids:
+
+    symbol            current symbol
+    ensembl_gene_id   Ensembl gene (ENSG)
+    entrez_id         NCBI gene
+    refseq_accession  RefSeq transcripts (NM_, NR_)
+    mane_select       MANE transcripts (ENST and NM_)
+    ucsc_id           UCSC transcript
+    prev_symbol       symbols the gene had before
+    alias_symbol      other names in use
+
+or a two-column, headerless alias<TAB>symbol file. Lookups ignore case and
+the version of versioned accessions (ENST00000305877.12). An id claimed by
+several genes resolves to the gene for which it is the strongest kind of
+id (current symbol, then database ids, then previous symbols, then
+aliases); if that still leaves more than one gene, the id is left as it is.
+
+Ids map to shared (interned) symbol strings in one dict, and resolved
+names go through an LRU cache, so resolving the name of a row is usually a
+single cache hit.
+'''
+
+import sys
+from functools import lru_cache
+
+import compressed_io
+import normalize
+
+# Annotation columns, strongest first
+ID_COLUMNS = [('symbol', 0), ('ensembl_gene_id', 1), ('entrez_id', 1),
+              ('refseq_accession', 1), ('mane_select', 1), ('ucsc_id', 1),
+              ('prev_symbol', 2), ('alias_symbol', 3)]
+
+ALIAS_RANK = 1
+
+# Prefixes of accessions whose '.<version>' suffix is ignored
+VERSIONED_PREFIXES = ('ENS', 'NM_', 'NR_', 'XM_', 'XR_', 'UC')
+
+CACHE_SIZE = 1 << 16
+
+_RESOLVERS = dict()
+
+
+def id_key(value):
+    '''Return the lookup key of a gene or transcript id'''
+    key = value.strip().strip('"').upper()
+    if key.startswith(VERSIONED_PREFIXES):
+        stem, dot, version = key.rpartition('.')
+        if dot and version.isdigit():
+            key = stem
+    return key
+
+
+class GeneResolver(object):
+    '''
+    Map gene and transcript ids to current symbols
+
+    Args:
+        path (str): Annotation file, plain or gzip compressed
+        cache_size (int): Number of fusion names kept in the LRU cache
+    '''
+
+    def __init__(self, path=None, cache_size=CACHE_SIZE):
+        self.symbols = dict()
+        self.ranks = dict()
+        if path is not None:
+            self.load(path)
+        self.name = lru_cache(maxsize=cache_size)(self.resolve_name)
+
+    def add(self, value, symbol, rank):
+        '''Record that id value names symbol, as an id of the given rank'''
+        key = id_key(value)
+        if not key:
+            return
+        held = self.ranks.get(key)
+        if held is None or rank < held:
+            self.symbols[key] = symbol
+            self.ranks[key] = rank
+        elif rank == held and self.symbols[key] != symbol:
+            # Ambiguous at its strongest rank: leave the id unresolved
+            self.symbols[key] = None
+
+    def load(self, path):
+        '''Add the ids of an annotation file'''
+        with compressed_io.open_input(path) as inf:
+            header = inf.readline().rstrip('\r\n').split('\t')
+            fields = [field.strip('"') for field in header]
+            if 'symbol' in fields:
+                self.load_table(inf, fields)
+            else:
+                self.load_pairs([header])
+                self.load_pairs(line.rstrip('\r\n').split('\t') for line in inf)
+
+    def load_table(self, lines, fields):
+        columns = [(fields.index(name), rank) for name, rank in ID_COLUMNS if name in fields]
+        symbol_column = fields.index('symbol')
+        for line in lines:
+            values = line.rstrip('\r\n').split('\t')
+            if len(values) <= symbol_column:
+                continue
+            symbol = sys.intern(values[symbol_column].strip('"'))
+            if not symbol:
+                continue
+            for column, rank in columns:
+                if column < len(values) and values[column]:
+                    for value in values[column].strip('"').split('|'):
+                        self.add(value, symbol, rank)
+
+    def load_pairs(self, rows):
+        for row in rows:
+            if len(row) < 2 or not row[1]:
+                continue
+            symbol = sys.intern(row[1].strip())
+            self.add(symbol, symbol, 0)
+            self.add(row[0], symbol, ALIAS_RANK)
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def resolve(self, gene):
+        '''Return the current symbol of a gene or transcript id, or the id itself'''
+        # STAR-Fusion writes genes as SYMBOL^ENSG00000...
+        gene = gene.split('^', 1)[0].strip()
+        return self.symbols.get(id_key(gene)) or gene
+
+    def resolve_name(self, name):
+        '''
+        Return the canonical name of a fusion: SYMBOL1--SYMBOL2 if the name
+        splits into two genes, the resolved id if it is a single one
+        '''
+        pair = normalize.gene_pair(name)
+        if pair is None:
+            return self.resolve(name)
+        return '{}--{}'.format(self.resolve(pair[0]), self.resolve(pair[1]))
+
+    def resolve_rows(self, rows):
+        '''Resolve the name (field 6) of a batch of BEDPE rows in place'''
+        name = self.name
+        for row in rows:
+            row[6] = name(row[6])
+        return rows
+
+
+def load(path):
+    '''Return the resolver of an annotation file, loading it once per process'''
+    resolver = _RESOLVERS.get(path)
+    if resolver is None:
+        resolver = _RESOLVERS[path] = GeneResolver(path)
+    return resolver
@@ -0,0 +1,213 @@
+'''
+Fusion-by-set incidence matrix for UpSet plots and cohort summaries.
+
+Any number of BEDPE files are streamed once. Each file belongs to a set,
+usually a caller or an annotation database, and each call is keyed on its
+fusion, i.e. the unordered gene pair of its name (see normalize.fusion_key),
+so that BCR--ABL1 from one caller and ABL1-BCR from another are the same
+fusion.
+Files of many samples can share a set, e.g. A1.starfusion.bedpe and
+A2.starfusion.bedpe both count towards starfusion.
+
+The matrix is kept sparse and written as a column file:
+
+    8 bytes   magic, b'FBINC001'
+    8 bytes   length of the JSON metadata (little-endian unsigned)
+    metadata  JSON: set names, fusion keys, bytes per bitset row and the
+              offset of every column
+    columns   each starting on an 8-byte boundary:
+              bits      uint8, one bitset row per fusion (bit i = set i)
+              indptr    int64, n + 1 offsets into set_ids and calls
+              set_ids   uint16 (uint32 past 65536 sets)
+              calls     int32, calls of the fusion in the set
+
+Intersections are counted straight from the memory-mapped bitsets, giving the
+exclusive intersection sizes an UpSet plot draws, without ever building a
+dense fusion x set matrix.
+
+Can be run from the commandline with:
+    python fusebench.py incidence build -o <matrix_file> [<set>=]<bedpe_file> ...
+    python fusebench.py incidence intersect [-o <output_file>] <matrix_file>
+    python fusebench.py incidence table [-o <output_file>] <matrix_file>
+
+intersect writes one line per non-empty intersection, 'set1&set2<TAB>size',
+which UpSetR::fromExpression reads. table writes the 0/1 fusion x set table
+that upset() takes as a data frame.
+'''
+
+import sys
+from array import array
+from collections import Counter
+
+import columnar
+import compressed_io
+import merge_calls
+import normalize
+import pair_overlap
+
+MAGIC = b'FBINC001'
+MATRIX_SUFFIX = '.fbm'
+
+# Names of calls that carry no gene pair, e.g. '-' from two empty gene columns
+UNNAMED = frozenset(['', '.', '-'])
+
+
+class IncidenceBuilder(object):
+    '''Accumulate fusion x set call counts'''
+
+    def __init__(self):
+        self.fusions = columnar.Dictionary()
+        self.sets = columnar.Dictionary()
+        self.calls = Counter()
+
+    def add_rows(self, rows, set_name):
+        '''Count the calls of BEDPE rows towards one set'''
+        set_id = self.sets[set_name]
+        fusions = self.fusions
+        keys = (normalize.fusion_key(row[6]) for row in rows if len(row) > 6)
+        self.calls.update((fusions[key], set_id) for key in keys if key not in UNNAMED)
+
+    def add_file(self, path, set_name):
+        with compressed_io.open_input(path) as inf:
+            self.add_rows(pair_overlap.read_bedpe(inf), set_name)
+
+    def write(self, path):
+        '''Write the matrix to path'''
+        num_sets = len(self.sets)
+        width = (num_sets + 7) // 8
+        by_fusion = [[] for _ in range(len(self.fusions))]
+        for (fusion_id, set_id), count in self.calls.items():
+            by_fusion[fusion_id].append((set_id, count))
+
+        bits = bytearray(width * len(by_fusion))
+        indptr = array('q', [0])
+        set_ids = array('H' if num_sets <= 1 << 16 else 'I')
+        calls = array('i')
+        for fusion_id, entries in enumerate(by_fusion):
+            entries.sort()
+            mask = 0
+            for set_id, count in entries:
+                mask |= 1 << set_id
+                set_ids.append(set_id)
+                calls.append(count)
+            indptr.append(len(set_ids))
+            bits[fusion_id * width:(fusion_id + 1) * width] = mask.to_bytes(width, 'little')
+
+        metadata = {'sets': self.sets.values_by_code(),
+                    'fusions': self.fusions.values_by_code(),
+                    'width': width}
+        blobs = [('bits', 'B', bytes(bits)),
+                 ('indptr', 'q', indptr.tobytes()),
+                 ('set_ids', set_ids.typecode, set_ids.tobytes()),
+                 ('calls', 'i', calls.tobytes())]
+        columnar.write_column_file(path, MAGIC, metadata, blobs)
+
+
+class IncidenceMatrix(columnar.ColumnFile):
+    '''
+    Read-only, memory-mapped view of a matrix file.
+
+    Args:
+        path (str): Matrix file written by IncidenceBuilder
+    '''
+
+    def __init__(self, path):
+        super(IncidenceMatrix, self).__init__(path, MAGIC)
+        self.sets = self.metadata['sets']
+        self.fusions = self.metadata['fusions']
+        self.width = self.metadata['width']
+
+    def __len__(self):
+        return len(self.fusions)
+
+    def masks(self):
+        '''Return an iterator over the bitset of every fusion, as byte tuples'''
+        bits = self.columns['bits']
+        return zip(*(bits[i::self.width] for i in range(self.width)))
+
+    def members(self, mask):
+        '''Return the names of the sets in a bitset'''
+        value = int.from_bytes(bytes(mask), 'little')
+        return [name for i, name in enumerate(self.sets) if value >> i & 1]
+
+    def calls(self, fusion_id):
+        '''Return {set name: number of calls} for one fusion'''
+        indptr = self.columns['indptr']
+        first, last = indptr[fusion_id], indptr[fusion_id + 1]
+        return dict((self.sets[set_id], count) for set_id, count in
+                    zip(self.columns['set_ids'][first:last], self.columns['calls'][first:last]))
+
+    def intersections(self):
+        '''
+        Count fusions by the exact combination of sets they are found in
+
+        Returns:
+            list: (set names, number of fusions), largest first
+        '''
+        counts = Counter(self.masks())
+        return sorted(((self.members(mask), count) for mask, count in counts.items()),
+                      key=lambda item: (-item[1], len(item[0]), item[0]))
+
+    def set_sizes(self):
+        '''Return {set name: number of fusions found in it}'''
+        sizes = Counter(self.columns['set_ids'])
+        return dict((name, sizes[i]) for i, name in enumerate(self.sets))
+
+
+def add_incidence_parser(subparsers):
+    parser = subparsers.add_parser('incidence',
+                                   help='Build fusion x caller matrices for UpSet plots')
+    incidence_parsers = parser.add_subparsers(dest='incidence_command',
+                                              metavar='<incidence-command>')
+    incidence_parsers.required = True
+
+    build_parser = incidence_parsers.add_parser('build', help='Build a matrix from BEDPE files')
+    build_parser.add_argument('inputs', nargs='+', metavar='[<set>=]<bedpe-file>',
+                              help='BEDPE files; the set defaults to the caller in the name')
+    build_parser.add_argument('-o', dest='outf', metavar='<matrix-file>', required=True,
+                              help='Matrix destination')
+    build_parser.set_defaults(func=run_incidence_build)
+
+    intersect_parser = incidence_parsers.add_parser('intersect',
+                                                    help='Count fusions per set intersection')
+    intersect_parser.add_argument('matrix', metavar='<matrix-file>', help='Matrix to read')
+    intersect_parser.add_argument('-o', dest='outf', metavar='<out-file>',
+                                  help='Output destination (default STDOUT)')
+    intersect_parser.set_defaults(func=run_incidence_intersect)
+
+    table_parser = incidence_parsers.add_parser('table', help='Write the 0/1 fusion x set table')
+    table_parser.add_argument('matrix', metavar='<matrix-file>', help='Matrix to read')
+    table_parser.add_argument('-o', dest='outf', metavar='<out-file>',
+                              help='Output destination (default STDOUT)')
+    table_parser.set_defaults(func=run_incidence_table)
+    return parser
+
+
+def run_incidence_build(args):
+    builder = IncidenceBuilder()
+    for spec in args.inputs:
+        set_name, path = merge_calls.parse_input(spec)
+        builder.add_file(path, set_name)
+    builder.write(args.outf)
+    sys.stderr.write('fusebench incidence: {} fusions in {} sets\n'.format(
+        len(builder.fusions), len(builder.sets)))
+    return 0
+
+
+def run_incidence_intersect(args):
+    with IncidenceMatrix(args.matrix) as matrix:
+        with compressed_io.open_output(args.outf) as outf:
+            for members, count in matrix.intersections():
+                outf.write('{}\t{}\n'.format('&'.join(members), count))
+    return 0
+
+
+def run_incidence_table(args):
+    with IncidenceMatrix(args.matrix) as matrix:
+        with compressed_io.open_output(args.outf) as outf:
+            outf.write('\t'.join(['Identifier'] + matrix.sets) + '\n')
+            for fusion, mask in zip(matrix.fusions, matrix.masks()):
+                value = int.from_bytes(bytes(mask), 'little')
+                outf.write(fusion + ''.join('\t1' if value >> i & 1 else '\t0'
+                                            for i in range(len(matrix.sets))) + '\n')
+    return 0
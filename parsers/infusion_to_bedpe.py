@@ -0,0 +1,70 @@
+'''
+Convert INFUSION output (fusions.detailed.txt) to BEDPE format.
+
+Can be run from the commandline with:
+    python infusion_to_bedpe.py -i <input_file> -o <output_file>
+
+If no <input_file> and/or <output_file> is specified, the file will read/write
+from/to STDIN/STDOUT, allowing for piping into and out of the program.
+'''
+
+import sys
+
+import bedpe_engine
+
+def compile_core(index):
+    '''
+    Compile the mapping from input columns to the core BEDPE fields
+
+    Args:
+        index (dict): {'heading': position} mapping for the input header
+    Returns:
+        function: maps one input row (list) to a list of BEDPE values
+    '''
+    chr1, pos1 = index['ref1'], index['break_pos1']
+    chr2, pos2 = index['ref2'], index['break_pos2']
+    fusion_id = index['#id']
+    # Gene columns are only written when INFUSION is given an annotation
+    gene1, gene2 = index.get('genes_1'), index.get('genes_2')
+    def map_core(row):
+        name = row[fusion_id]
+        if gene1 is not None and gene2 is not None and row[gene1] and row[gene2]:
+            name = row[gene1] + '-' + row[gene2]
+        break1 = int(row[pos1])
+        break2 = int(row[pos2])
+        return [row[chr1], break1, break1 + 1,
+                row[chr2], break2, break2 + 1,
+                name, 0, '.', '.']
+    return map_core
+
+
+def add_fields(bedpe_fields, input_fields):
+    '''Add fields from input to end of BEDPE format'''
+    to_add = []
+    specified_fields = ['ref1', 'break_pos1', 'ref2', 'break_pos2']
+    #add all but specified fields
+    to_add += [elem for elem in input_fields if elem not in specified_fields]
+    return bedpe_fields + to_add
+
+
+CONVERTER = bedpe_engine.Converter('infusion', compile_core,
+                                   extra_fields=lambda in_fields: add_fields([], in_fields),
+                                   signature=['#id', 'ref1', 'break_pos1',
+                                              'ref2', 'break_pos2'])
+
+
+def get_parser():
+    return bedpe_engine.get_parser()
+
+
+def main():
+    '''
+    Convert INFUSION output to BEDPE format.
+    '''
+    return bedpe_engine.main(CONVERTER)
+
+
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,69 @@
+'''
+Convert JAFFA output (jaffa_results.csv) to BEDPE format.
+
+Can be run from the commandline with:
+    python jaffa_to_bedpe.py -i <input_file> -o <output_file>
+
+If no <input_file> and/or <output_file> is specified, the file will read/write
+from/to STDIN/STDOUT, allowing for piping into and out of the program.
+'''
+
+import sys
+
+import bedpe_engine
+
+def compile_core(index):
+    '''
+    Compile the mapping from input columns to the core BEDPE fields
+
+    Args:
+        index (dict): {'heading': position} mapping for the input header
+    Returns:
+        function: maps one input row (list) to a list of BEDPE values
+    '''
+    chr1, pos1 = index['chrom1'], index['base1']
+    chr2, pos2 = index['chrom2'], index['base2']
+    genes = index['fusion genes']
+    # Older JAFFA releases have no strand columns
+    strand1, strand2 = index.get('strand1'), index.get('strand2')
+    def map_core(row):
+        base1 = int(row[pos1])
+        base2 = int(row[pos2])
+        return [row[chr1], base1, base1 + 1,
+                row[chr2], base2, base2 + 1,
+                row[genes].replace(':', '-', 1), 0,
+                row[strand1] if strand1 is not None else '.',
+                row[strand2] if strand2 is not None else '.']
+    return map_core
+
+
+def add_fields(bedpe_fields):
+    '''Add fields from input to end of BEDPE format'''
+    to_add = ['sample', 'fusion genes', 'gap (kb)', 'spanning pairs',
+              'spanning reads', 'inframe', 'aligns', 'rearrangement',
+              'contig', 'contig break', 'classification', 'known']
+    return bedpe_fields + to_add
+
+
+CONVERTER = bedpe_engine.Converter('jaffa', compile_core,
+                                   extra_fields=add_fields([]),
+                                   delimiter=',',
+                                   signature=['fusion genes', 'chrom1', 'base1',
+                                              'chrom2', 'base2'])
+
+
+def get_parser():
+    return bedpe_engine.get_parser()
+
+
+def main():
+    '''
+    Convert JAFFA output to BEDPE format.
+    '''
+    return bedpe_engine.main(CONVERTER)
+
+
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,248 @@
+'''
+Merge fusion calls from any number of BEDPE files into consensus events.
+
+This is the N-way version of analysis/data_table_merger.r: two calls belong
+to the same event when both of their ends overlap once one side is padded by
+slop, i.e. when the ends are less than slop bp apart. Calls are oriented so
+that the lower breakpoint comes first, grouped by chromosome pair and swept
+in order of their first breakpoint. Only clusters still within
+slop of the sweep position are compared, so the work grows with the number
+of calls rather than with the number of pairs of calls.
+
+Each output row is one event, spanning all of its calls, with the callers
+that support it:
+
+    chrom1 start1 end1 chrom2 start2 end2 name score strand1 strand2
+    callers num_callers num_calls names
+
+score is the number of supporting callers and name is the most common name
+among the calls.
+
+Can be run from the commandline with:
+    python fusebench.py merge [-slop <bp>] [-o <output_file>] [<caller>=]<bedpe_file> ...
+
+If no <caller> is given, it is taken from the file name, so that
+A34048.fusioncatcher.bedpe is labelled 'fusioncatcher'.
+'''
+
+import os
+from collections import Counter
+from itertools import groupby
+from operator import itemgetter
+
+import compressed_io
+import metrics
+import normalize
+import pair_overlap
+
+DEFAULT_SLOP = 10
+
+MERGE_FIELDS = normalize.BEDPE_FIELDS + ['callers', 'num_callers',
+                                         'num_calls', 'names']
+
+
+def caller_label(path):
+    '''Label a caller from a <sample>.<caller>.bedpe style file name'''
+    stem = os.path.basename(path)
+    for suffix in compressed_io.COMPRESSED_SUFFIXES:
+        if stem.endswith(suffix):
+            stem = stem[:-len(suffix)]
+    if stem.endswith('.bedpe'):
+        stem = stem[:-len('.bedpe')]
+    return stem.rsplit('.', 1)[-1]
+
+
+def parse_input(spec):
+    '''Split a [<caller>=]<path> argument into (caller, path)'''
+    caller, sep, path = spec.partition('=')
+    if not sep:
+        return caller_label(spec), spec
+    return caller, path
+
+
+def oriented_call(row, caller):
+    '''
+    Turn one BEDPE row into a call tuple, normalised as by normalize.py:
+    canonical chromosome names and the lower breakpoint first
+
+    Returns:
+        tuple: (chrom1, chrom2, start1, end1, start2, end2,
+                strand1, strand2, name, caller), or None for unplaced calls
+    '''
+    end1, end2 = pair_overlap.row_ends(row)
+    if end1[1] < 0 or end2[1] < 0:
+        return None
+    if not normalize.is_ordered(end1[0], end1[1], end2[0], end2[1]):
+        end1, end2 = end2, end1
+    name = row[6] if len(row) > 6 else '.'
+    return (end1[0], end2[0], end1[1], max(end1[2], end1[1] + 1),
+            end2[1], max(end2[2], end2[1] + 1), end1[3], end2[3], name, caller)
+
+
+def load_calls(inputs, stage=None):
+    '''
+    Read every call from a list of (caller, path) inputs
+
+    Args:
+        stage (metrics.StageMetrics): If given, counts the rows and bytes read
+    Returns:
+        tuple: (list of call tuples, number of unplaced calls skipped)
+    '''
+    calls = []
+    skipped = 0
+    for caller, path in inputs:
+        with compressed_io.open_input(path) as inf:
+            for row in pair_overlap.read_bedpe(inf):
+                call = oriented_call(row, caller)
+                if call is None:
+                    skipped += 1
+                else:
+                    calls.append(call)
+        if stage is not None:
+            stage.bytes_read += metrics.file_size(path)
+    if stage is not None:
+        stage.rows_in += len(calls) + skipped
+    return calls, skipped
+
+
+def cluster_calls(calls, slop=DEFAULT_SLOP):
+    '''
+    Cluster calls whose ends overlap within slop
+
+    Args:
+        calls (list): Call tuples from oriented_call
+        slop (int): Largest gap between overlapping ends
+    Returns:
+        generator: clusters as [start1, end1, start2, end2, calls], grouped
+            by chromosome pair and ordered by start1
+    '''
+    calls.sort(key=itemgetter(0, 1, 2, 4))
+    for _, group in groupby(calls, key=itemgetter(0, 1)):
+        done = []
+        active = []
+        for call in group:
+            start1, end1, start2, end2 = call[2], call[3], call[4], call[5]
+
+            # Clusters ending more than slop before this call can't grow
+            still_active = []
+            for cluster in active:
+                if cluster[1] + slop <= start1:
+                    done.append(cluster)
+                else:
+                    still_active.append(cluster)
+            active = still_active
+
+            # Every active cluster overlaps on the first end; test the second
+            joined = None
+            for cluster in list(active):
+                if start2 < cluster[3] + slop and cluster[2] < end2 + slop:
+                    if joined is None:
+                        joined = cluster
+                    else:
+                        joined[0] = min(joined[0], cluster[0])
+                        joined[1] = max(joined[1], cluster[1])
+                        joined[2] = min(joined[2], cluster[2])
+                        joined[3] = max(joined[3], cluster[3])
+                        joined[4].extend(cluster[4])
+                        active.remove(cluster)
+            if joined is None:
+                active.append([start1, end1, start2, end2, [call]])
+            else:
+                joined[1] = max(joined[1], end1)
+                joined[2] = min(joined[2], start2)
+                joined[3] = max(joined[3], end2)
+                joined[4].append(call)
+        done.extend(active)
+        done.sort(key=itemgetter(0, 2))
+        for cluster in done:
+            yield cluster
+
+
+def consensus(values):
+    '''Return the shared value, or '.' if the values disagree'''
+    values = set(values)
+    return values.pop() if len(values) == 1 else '.'
+
+
+def event_row(chrom1, chrom2, cluster):
+    '''Build the output row for one cluster'''
+    start1, end1, start2, end2, members = cluster
+    callers = sorted(set(call[9] for call in members))
+    names = Counter(call[8] for call in members)
+    return [chrom1, start1, end1, chrom2, start2, end2,
+            names.most_common(1)[0][0], len(callers),
+            consensus(call[6] for call in members),
+            consensus(call[7] for call in members),
+            ','.join(callers), len(callers), len(members),
+            ','.join(sorted(names))]
+
+
+def merge(inputs, outf, slop=DEFAULT_SLOP, stage=None):
+    '''
+    Merge BEDPE files into consensus events
+
+    Args:
+        inputs (list): (caller, path) for each BEDPE file
+        outf (file): Text stream receiving the merged events
+        slop (int): Largest gap between overlapping ends
+        stage (metrics.StageMetrics): If given, counts rows and times the
+            parse, cluster and write phases
+    Returns:
+        int: the number of events written
+    '''
+    if stage is None:
+        stage = metrics.StageMetrics('merge')
+    with stage.phase('parse'):
+        calls, _ = load_calls(inputs, stage)
+    outf.write('\t'.join(MERGE_FIELDS) + '\n')
+    with stage.phase('cluster'):
+        rows = list(events(calls, slop))
+    with stage.phase('write'):
+        for row in rows:
+            outf.write('\t'.join(row) + '\n')
+    stage.rows_out += len(rows)
+    return len(rows)
+
+
+def events(calls, slop=DEFAULT_SLOP):
+    '''
+    Cluster calls into events
+
+    Args:
+        calls (list): Call tuples from oriented_call; sorted in place
+        slop (int): Largest gap between overlapping ends
+    Yields:
+        list: one row of MERGE_FIELDS strings per event
+    '''
+    for cluster in cluster_calls(calls, slop):
+        first = cluster[4][0]
+        yield [str(value) for value in event_row(first[0], first[1], cluster)]
+
+
+def add_merge_parser(subparsers):
+    parser = subparsers.add_parser('merge',
+                                   help='Merge calls from several callers into events')
+    parser.add_argument('inputs', nargs='+', metavar='[<caller>=]<bedpe-file>',
+                        help='BEDPE files to merge')
+    parser.add_argument('-slop', dest='slop', type=int, default=DEFAULT_SLOP,
+                        help='Largest gap between matching ends (default {})'.format(DEFAULT_SLOP))
+    parser.add_argument('-o', dest='outf', metavar='<out-file>',
+                        help='Output destination (default STDOUT)')
+    metrics.add_metrics_arguments(parser)
+    parser.set_defaults(func=run_merge)
+    return parser
+
+
+def run_merge(args):
+    return metrics.run_instrumented(args, 'merge', lambda run: merge_main(args, run))
+
+
+def merge_main(args, run=None):
+    inputs = [parse_input(spec) for spec in args.inputs]
+    stage = run.stage('merge', inputs=len(inputs)) if run else None
+    with compressed_io.open_output(args.outf) as outf:
+        merge(inputs, outf, args.slop, stage)
+    if stage is not None:
+        stage.bytes_written = metrics.file_size(args.outf)
+        stage.finish()
+    return 0
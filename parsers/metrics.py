@@ -0,0 +1,223 @@
+'''
+Per-stage counters, phase timings and profiling for fusebench runs.
+
+A run is made of stages, e.g. one 'convert' per input file followed by a
+'merge'. Each stage counts rows in and out and bytes read and written, and
+splits its wall time into phases:
+
+    convert    parse (csv reading), map (column mapping), normalize,
+               resolve (--genes), filter (--where), sort and merge (--sort),
+               validate, write, cache
+    validate   parse, check, report
+    merge      parse, cluster, write
+    sort       sort, merge, write
+
+Timings are taken once per batch, not per row, so collecting them costs
+nothing measurable. --metrics writes the run as JSON:
+
+    {"command": "convert", "started": "2017-10-20T10:00:00", "seconds": 6.51,
+     "rows_in": 500000, "rows_out": 500000, "bytes_read": 80123456, ...,
+     "stages": [{"stage": "convert", "input": "...", "rows_in": 500000,
+                 "rows_per_s": 76804.9, "phases": {"parse": 1.62, ...}}, ...]}
+
+--profile writes cProfile statistics (python -m pstats <file>), and
+--sample-profile samples the stack of the main thread every few
+milliseconds and writes collapsed stacks ('frame;frame;frame count'), which
+flamegraph.pl and speedscope read. Sampling needs signal.setitimer, i.e. a
+Unix system.
+'''
+
+import json,os,sys,time
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+
+# Seconds between stack samples
+SAMPLE_INTERVAL = 0.005
+
+
+def file_size(path):
+    '''Return the size of the file at path, or 0 for STDIN/STDOUT'''
+    if not path:
+        return 0
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+class StageMetrics(object):
+    '''
+    Counters and phase timings of one stage
+
+    Args:
+        name (str): Stage name, e.g. 'convert'
+        **labels: Extra values written with the stage, e.g. input=<path>
+    '''
+
+    def __init__(self, name, **labels):
+        self.name = name
+        self.labels = labels
+        self.rows_in = 0
+        self.rows_out = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.phases = Counter()
+        self.started = time.perf_counter()
+        self.seconds = None
+
+    def add(self, phase, seconds):
+        '''Add seconds spent in phase'''
+        self.phases[phase] += seconds
+
+    @contextmanager
+    def phase(self, name):
+        '''Time the enclosed block as phase name'''
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] += time.perf_counter() - started
+
+    def finish(self):
+        '''Stop the stage clock'''
+        if self.seconds is None:
+            self.seconds = time.perf_counter() - self.started
+
+    def to_dict(self):
+        self.finish()
+        result = OrderedDict([('stage', self.name)])
+        result.update(sorted(self.labels.items()))
+        result.update([('rows_in', self.rows_in), ('rows_out', self.rows_out),
+                       ('bytes_read', self.bytes_read), ('bytes_written', self.bytes_written),
+                       ('seconds', round(self.seconds, 6)),
+                       ('rows_per_s', round(self.rows_in / self.seconds, 1)
+                        if self.seconds else None),
+                       ('phases', OrderedDict((phase, round(seconds, 6)) for phase, seconds
+                                              in sorted(self.phases.items())))])
+        return result
+
+
+class Metrics(object):
+    '''
+    Metrics of one run
+
+    Args:
+        command (str): Command that was run, e.g. 'convert'
+    '''
+
+    def __init__(self, command):
+        self.command = command
+        self.stages = []
+        self.started = time.time()
+        self.clock = time.perf_counter()
+
+    def stage(self, name, **labels):
+        '''Start and return a new StageMetrics'''
+        stage = StageMetrics(name, **labels)
+        self.stages.append(stage)
+        return stage
+
+    def to_dict(self):
+        stages = [stage.to_dict() for stage in self.stages]
+        result = OrderedDict([
+            ('command', self.command),
+            ('started', time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started))),
+            ('seconds', round(time.perf_counter() - self.clock, 6))])
+        for field in ('rows_in', 'rows_out', 'bytes_read', 'bytes_written'):
+            result[field] = sum(stage[field] for stage in stages)
+        result['stages'] = stages
+        return result
+
+    def write(self, path):
+        '''Write the run as JSON to path ('-' for STDERR)'''
+        text = json.dumps(self.to_dict(), indent=2) + '\n'
+        if path == '-':
+            sys.stderr.write(text)
+            return
+        with open(path, 'w') as outf:
+            outf.write(text)
+
+
+class SamplingProfiler(object):
+    '''
+    Statistical profiler sampling the main thread on a profiling timer
+
+    Args:
+        interval (float): Seconds of CPU time between samples
+    '''
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        import signal
+        if not hasattr(signal, 'setitimer'):
+            raise OSError('Sampling profiles need signal.setitimer (Unix only)')
+        self.signal = signal
+        self.interval = interval
+        self.stacks = Counter()
+
+    def sample(self, signum, frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append('{} ({}:{})'.format(code.co_name, os.path.basename(code.co_filename),
+                                             code.co_firstlineno))
+            frame = frame.f_back
+        self.stacks[';'.join(reversed(stack))] += 1
+
+    def start(self):
+        self.signal.signal(self.signal.SIGPROF, self.sample)
+        self.signal.setitimer(self.signal.ITIMER_PROF, self.interval, self.interval)
+
+    def stop(self):
+        self.signal.setitimer(self.signal.ITIMER_PROF, 0, 0)
+        self.signal.signal(self.signal.SIGPROF, self.signal.SIG_DFL)
+
+    def write(self, path):
+        '''Write the samples as collapsed stacks'''
+        with open(path, 'w') as outf:
+            for stack, count in self.stacks.most_common():
+                outf.write('{} {}\n'.format(stack, count))
+
+
+def add_metrics_arguments(parser):
+    parser.add_argument('--metrics', dest='metrics', metavar='<json-file>',
+                        help="Write rows, bytes and per-phase times as JSON ('-' for STDERR)")
+    parser.add_argument('--profile', dest='profile', metavar='<pstats-file>',
+                        help='Write cProfile statistics of the run')
+    parser.add_argument('--sample-profile', dest='sample_profile', metavar='<stacks-file>',
+                        help='Write sampled stacks of the run in collapsed-stack format')
+
+
+def run_instrumented(args, command, func):
+    '''
+    Run func(metrics) with the instrumentation requested on the command line
+
+    Args:
+        args (argparse.Namespace): Parsed add_metrics_arguments options
+        command (str): Command name recorded in the metrics
+        func (callable): Called with a Metrics, or None if no metrics were
+            asked for; returns the exit status
+    Returns:
+        the result of func
+    '''
+    metrics = Metrics(command) if getattr(args, 'metrics', None) else None
+    profile = getattr(args, 'profile', None)
+    sample_profile = getattr(args, 'sample_profile', None)
+    profiler = sampler = None
+    if profile:
+        import cProfile
+        profiler = cProfile.Profile()
+    if sample_profile:
+        sampler = SamplingProfiler()
+        sampler.start()
+    try:
+        if profiler is not None:
+            return profiler.runcall(func, metrics)
+        return func(metrics)
+    finally:
+        if sampler is not None:
+            sampler.stop()
+            sampler.write(sample_profile)
+        if profiler is not None:
+            profiler.dump_stats(profile)
+        if metrics is not None:
+            metrics.write(args.metrics)
@@ -0,0 +1,176 @@
+'''
+Canonical chromosome names and breakpoint order for BEDPE rows.
+
+Callers disagree on how to write a fusion: some prefix chromosomes with
+'chr' and some do not, and the two partners are reported in transcript order
+(5' gene first), so the same event appears as A--B from one caller and with
+its ends swapped from another. This stage makes the core fields agree:
+
+    chromosomes   1-22, X, Y and M/MT are 'chr' prefixed (chrM for both
+                  mitochondrial names); 'chrchr1', left by converters that
+                  prefix an already prefixed name, becomes 'chr1'. Other
+                  contigs are left as they are
+    pair order    only if asked for: the lower breakpoint first, by
+                  karyotype order of the chromosome (chr1 .. chr22, chrX,
+                  chrY, chrM, then any other contig by name) and then by
+                  start
+    strings       chromosome, name and strand values are interned, so the
+                  many repeats of each share one object
+
+Chromosome names and fusion keys are cached for speed; the caches are LRU
+bounded, so long-running processes (the daemon, dataflow) do not grow
+without limit on cohorts with many distinct contigs or fusion names.
+
+fusion_key gives the matching caller-independent key for fusion names, which
+callers write as BCR--ABL1, BCR-ABL1, BCR_ABL1 or BCR,ABL1, with the partners
+in either order and in any case.
+
+Only the first ten (core BEDPE) fields are touched; passthrough columns keep
+the caller's order. The name keeps the caller's partner order too, so an
+event reported as A--B stays A--B even if its ends are swapped. Swapping
+therefore loses which end is the 5' partner, and is off unless requested
+(--order-ends); the merge and the indexes order ends themselves, on their
+own copies of the calls.
+'''
+
+from functools import lru_cache
+
+BEDPE_FIELDS = ['chrom1', 'start1', 'end1', 'chrom2', 'start2',
+                'end2', 'name', 'score', 'strand1', 'strand2']
+
+UNPLACED = -1
+
+# Distinct chromosome names and fusion names remembered by each cache
+CACHE_SIZE = 1 << 16
+
+_KARYOTYPE = dict(('chr{}'.format(name), rank) for rank, name in
+                  enumerate([str(number) for number in range(1, 23)] + ['X', 'Y', 'M']))
+_CANONICAL = dict((name, name) for name in _KARYOTYPE)
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def canonical_chrom(chrom):
+    '''Return the canonical, interned name of a chromosome'''
+    name = chrom.strip()
+    while name[:3].lower() == 'chr':
+        name = name[3:]
+    name = name.upper()
+    if name == 'MT':
+        name = 'M'
+    return _CANONICAL.get('chr' + name, chrom)
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def chrom_key(chrom):
+    '''Sort key placing canonical chromosomes in karyotype order'''
+    return (_KARYOTYPE.get(chrom, len(_KARYOTYPE)), chrom)
+
+
+def to_int(value):
+    '''Parse a coordinate, mapping anything unparseable to -1'''
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return UNPLACED
+
+
+def is_ordered(chrom1, start1, chrom2, start2):
+    '''Return True if the first end of a pair already sorts first'''
+    if chrom1 == chrom2:
+        return start1 <= start2
+    return chrom_key(chrom1) < chrom_key(chrom2)
+
+
+# Separators between the partners of a fusion name, most specific first
+PAIR_SEPARATORS = ('--', '::', '_', ',', '/', '-')
+
+
+def gene_pair(name):
+    '''
+    Split a fusion name such as 'BCR--ABL1', 'BCR-ABL1' or 'BCR_ABL1' into
+    its two partner genes
+
+    Returns:
+        tuple: (gene1, gene2), or None if name does not split unambiguously
+    '''
+    name = name.strip()
+    for separator in PAIR_SEPARATORS:
+        if name.count(separator) == 1:
+            gene1, gene2 = name.split(separator)
+            if gene1 and gene2:
+                return gene1.strip(), gene2.strip()
+            return None
+        if separator in name and len(separator) > 1:
+            return None
+    return None
+
+
+def fusion_key(name, resolver=None):
+    '''
+    Return the order-independent key of a fusion name
+
+    Args:
+        name (str): Fusion name, e.g. 'KMT2A-MLLT3'
+        resolver (genes.GeneResolver): If given, partners are first resolved
+            to current symbols
+    Returns:
+        str: 'GENE1--GENE2' with the genes upper-cased and sorted, or the
+            upper-cased name if it does not split into two genes
+    '''
+    if resolver is not None:
+        name = resolver.name(name)
+    return _fusion_key(name)
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _fusion_key(name):
+    pair = gene_pair(name)
+    if pair is None:
+        return name.strip().upper()
+    # STAR-Fusion writes genes as SYMBOL^ENSG00000...
+    gene1, gene2 = sorted(gene.split('^', 1)[0].strip().upper() for gene in pair)
+    return gene1 + '--' + gene2
+
+
+class Normalizer(object):
+    '''
+    Normalise the core fields of BEDPE rows in place
+
+    Args:
+        order (bool): Put the lower breakpoint of each pair first. The name
+            and passthrough columns are not swapped with it, so the 5'/3'
+            orientation of swapped rows is lost
+    '''
+
+    def __init__(self, order=False):
+        self.order = order
+        self.strings = dict()
+        self.swapped = 0
+
+    def intern(self, value):
+        '''Return the shared copy of a string value'''
+        return self.strings.setdefault(value, value)
+
+    def __call__(self, row):
+        '''
+        Normalise one row (list) of at least ten BEDPE values and return it
+        '''
+        intern = self.strings.setdefault
+        chrom1 = canonical_chrom(str(row[0]))
+        chrom2 = canonical_chrom(str(row[3]))
+        row[0] = chrom1
+        row[3] = chrom2
+        row[6] = intern(row[6], row[6])
+        row[8] = intern(row[8], row[8])
+        row[9] = intern(row[9], row[9])
+        if self.order and not is_ordered(chrom1, to_int(row[1]), chrom2, to_int(row[4])):
+            row[0:6] = row[3:6] + row[0:3]
+            row[8], row[9] = row[9], row[8]
+            self.swapped += 1
+        return row
+
+    def normalize_rows(self, rows):
+        '''Normalise a batch of rows in place and return it'''
+        for row in rows:
+            self(row)
+        return rows
@@ -0,0 +1,282 @@
+'''
+Paired-interval overlap engine for BEDPE files.
+
+Replaces the bedtools pairtopair calls in merge_annotations.sh. The ends of
+every pair in the B file are held in sorted arrays per chromosome; each pair
+of the A file is then looked up once, which yields its own class and marks
+the B pairs it touches, so a single streaming pass over A classifies both
+files. Pairs are classified as
+
+    both     each end of the pair overlaps the matching end of one other pair
+             (in either orientation)
+    either   at least one end overlaps an end of another pair, but not both
+    neither  no end overlaps
+
+Coordinates are 0-based and half-open. Ends with negative coordinates are
+treated as unplaced and never overlap. Strands are enforced unless
+ignore_strand is set; a '.' strand matches any strand.
+
+Can be run from the commandline with:
+    python fusebench.py pairtopair -a <bedpe_a> -b <bedpe_b> [-type both]
+    python fusebench.py annotate <bedpe_a> <bedpe_b> [-o <output_file>]
+'''
+
+import os,sys
+from array import array
+from bisect import bisect_left, bisect_right
+
+import compressed_io
+import normalize
+
+BOTH = 'both'
+EITHER = 'either'
+NEITHER = 'neither'
+
+# Classes selected by each pairtopair -type, following bedtools
+TYPES = {'both': (BOTH,),
+         'either': (BOTH, EITHER),
+         'neither': (NEITHER,),
+         'notboth': (EITHER, NEITHER)}
+
+NUM_CORE_FIELDS = 10
+
+
+def read_bedpe(inf):
+    '''
+    Yield the rows of a BEDPE file as lists of fields
+
+    Comment lines, blank lines and a heading line are skipped, so both
+    fusebench output and headerless bedtools-style BEDPE can be read.
+    '''
+    for line in inf:
+        if not line.strip() or line.startswith('#'):
+            continue
+        row = line.rstrip('\r\n').split('\t')
+        if len(row) < 6:
+            continue
+        if row[1] == 'start1':
+            continue
+        yield row
+
+
+def row_ends(row):
+    '''
+    Split one BEDPE row into its two ends, with canonical chromosome names
+
+    Returns:
+        tuple: ((chrom1, start1, end1, strand1), (chrom2, start2, end2, strand2))
+    '''
+    strand1 = row[8] if len(row) > 9 else '.'
+    strand2 = row[9] if len(row) > 9 else '.'
+    to_int = normalize.to_int
+    return ((normalize.canonical_chrom(row[0]), to_int(row[1]), to_int(row[2]), strand1),
+            (normalize.canonical_chrom(row[3]), to_int(row[4]), to_int(row[5]), strand2))
+
+
+def strands_match(strand_a, strand_b):
+    '''Return True unless both strands are known and differ'''
+    return strand_a == strand_b or strand_a == '.' or strand_b == '.'
+
+
+class PairIndex(object):
+    '''
+    Sorted-array index over the ends of a set of BEDPE pairs.
+
+    Args:
+        pairs (list): Pairs as returned by row_ends
+        ignore_strand (bool): Match ends regardless of strand
+    '''
+
+    def __init__(self, pairs, ignore_strand=False):
+        self.ignore_strand = ignore_strand
+        self.size = len(pairs)
+        self.strands = []
+        by_chrom = dict()
+        for pair_id, ends in enumerate(pairs):
+            self.strands.append((ends[0][3], ends[1][3]))
+            for end, (chrom, start, stop, _) in enumerate(ends):
+                if start < 0 or stop < 0:
+                    continue
+                stop = max(stop, start + 1)
+                by_chrom.setdefault(chrom, []).append((start, stop, 2 * pair_id + end))
+
+        # chrom -> (starts, stops, keys, longest interval)
+        self.chroms = dict()
+        for chrom, intervals in by_chrom.items():
+            intervals.sort()
+            self.chroms[chrom] = (array('q', [iv[0] for iv in intervals]),
+                                  array('q', [iv[1] for iv in intervals]),
+                                  array('q', [iv[2] for iv in intervals]),
+                                  max(iv[1] - iv[0] for iv in intervals))
+
+    def query(self, chrom, start, stop, slop=0):
+        '''
+        Find indexed ends overlapping one interval
+
+        Args:
+            chrom (str): Chromosome of the query
+            start (int): 0-based start of the query
+            stop (int): End of the query
+            slop (int): Distance added to both sides of the query
+        Returns:
+            list: keys (2 * pair_id + end) of the overlapping ends
+        '''
+        if start < 0 or stop < 0 or chrom not in self.chroms:
+            return []
+        starts, stops, keys, longest = self.chroms[chrom]
+        stop = max(stop, start + 1) + slop
+        start = start - slop
+        first = bisect_right(starts, start - longest)
+        last = bisect_left(starts, stop)
+        return [keys[i] for i in range(first, last) if stops[i] > start]
+
+    def match(self, ends, slop=0):
+        '''
+        Classify one pair against the index
+
+        Args:
+            ends (tuple): Pair as returned by row_ends
+            slop (int): Distance added to both sides of each end
+        Returns:
+            tuple: (class, set of pair ids matching on both ends,
+                    set of pair ids with any end overlapping)
+        '''
+        hits = [set(), set()]
+        for end, (chrom, start, stop, strand) in enumerate(ends):
+            for key in self.query(chrom, start, stop, slop):
+                pair_id, other_end = divmod(key, 2)
+                if self.ignore_strand or strands_match(strand, self.strands[pair_id][other_end]):
+                    hits[end].add(key)
+        if not hits[0] and not hits[1]:
+            return NEITHER, set(), set()
+
+        # Same orientation (1-1, 2-2) or swapped (1-2, 2-1)
+        both = set()
+        for key in hits[0]:
+            pair_id, other_end = divmod(key, 2)
+            if 2 * pair_id + (1 - other_end) in hits[1]:
+                both.add(pair_id)
+        touched = set(key // 2 for key in hits[0] | hits[1])
+        return (BOTH if both else EITHER), both, touched
+
+
+def classify(a_rows, b_rows, slop=0, ignore_strand=False):
+    '''
+    Classify the pairs of two BEDPE files against each other
+
+    Args:
+        a_rows (iterable): Rows of the A file; streamed
+        b_rows (iterable): Rows of the B file; indexed in memory
+        slop (int): Distance added to both sides of each end
+        ignore_strand (bool): Match ends regardless of strand
+    Returns:
+        generator: ('a', row, class) for each row of A, in order, followed
+            by ('b', row, class) for each row of B, in order
+    '''
+    b_rows = list(b_rows)
+    index = PairIndex([row_ends(row) for row in b_rows], ignore_strand)
+    b_classes = [NEITHER] * len(b_rows)
+    for row in a_rows:
+        cls, both, touched = index.match(row_ends(row), slop)
+        for pair_id in touched:
+            if b_classes[pair_id] == NEITHER:
+                b_classes[pair_id] = EITHER
+        for pair_id in both:
+            b_classes[pair_id] = BOTH
+        yield 'a', row, cls
+    for row, cls in zip(b_rows, b_classes):
+        yield 'b', row, cls
+
+
+def pairtopair(a_rows, b_rows, overlap_type='both', slop=0, ignore_strand=False):
+    '''
+    Yield the rows of A whose class is selected by overlap_type
+
+    Args:
+        overlap_type (str): One of 'both', 'either', 'neither', 'notboth'
+    '''
+    wanted = TYPES[overlap_type]
+    b_rows = list(b_rows)
+    index = PairIndex([row_ends(row) for row in b_rows], ignore_strand)
+    for row in a_rows:
+        if index.match(row_ends(row), slop)[0] in wanted:
+            yield row
+
+
+def annotate(a_rows, b_rows, a_label, b_label, slop=0, ignore_strand=False):
+    '''
+    Merge two BEDPE files, labelling each pair with the file(s) it is in
+
+    Pairs found in both files are reported once, with respect to A, labelled
+    '<a_label>,<b_label>'. All other pairs of either file are reported with
+    the label of their own file. Only the ten core BEDPE fields are kept.
+
+    Returns:
+        generator: output rows (lists)
+    '''
+    both_label = '{},{}'.format(a_label, b_label)
+    for side, row, cls in classify(a_rows, b_rows, slop, ignore_strand):
+        if side == 'a':
+            yield row[:NUM_CORE_FIELDS] + [both_label if cls == BOTH else a_label]
+        elif cls != BOTH:
+            yield row[:NUM_CORE_FIELDS] + [b_label]
+
+
+def file_label(path):
+    '''Label a file by its path without extension, as merge_annotations.sh did'''
+    if compressed_io.is_compressed_name(path):
+        path = os.path.splitext(path)[0]
+    return os.path.splitext(path)[0]
+
+
+def write_rows(rows, outf):
+    '''Write rows as tab-separated lines'''
+    for row in rows:
+        outf.write('\t'.join(row) + '\n')
+
+
+def add_overlap_parsers(subparsers):
+    parser = subparsers.add_parser('pairtopair',
+                                   help='Report BEDPE pairs of A by overlap with B')
+    parser.add_argument('-a', dest='a', metavar='<bedpe-a>', required=True,
+                        help='BEDPE file reported on')
+    parser.add_argument('-b', dest='b', metavar='<bedpe-b>', required=True,
+                        help='BEDPE file compared against')
+    parser.add_argument('-type', dest='overlap_type', choices=sorted(TYPES),
+                        default='both', help='Overlap required (default both)')
+    parser.add_argument('-slop', dest='slop', type=int, default=0,
+                        help='Padding added to each end (default 0)')
+    parser.add_argument('-is', dest='ignore_strand', action='store_true',
+                        help='Ignore strands when matching ends')
+    parser.set_defaults(func=run_pairtopair)
+
+    parser = subparsers.add_parser('annotate',
+                                   help='Merge two BEDPE files, labelling each pair by source')
+    parser.add_argument('a', metavar='<bedpe-a>', help='First BEDPE file')
+    parser.add_argument('b', metavar='<bedpe-b>', help='Second BEDPE file')
+    parser.add_argument('-o', dest='outf', metavar='<out-file>',
+                        help='Output destination (default STDOUT)')
+    parser.add_argument('-slop', dest='slop', type=int, default=0,
+                        help='Padding added to each end (default 0)')
+    parser.add_argument('-is', dest='ignore_strand', action='store_true',
+                        help='Ignore strands when matching ends')
+    parser.set_defaults(func=run_annotate)
+    return parser
+
+
+def run_pairtopair(args):
+    with compressed_io.open_input(args.a) as a_inf, compressed_io.open_input(args.b) as b_inf:
+        rows = pairtopair(read_bedpe(a_inf), read_bedpe(b_inf),
+                          args.overlap_type, args.slop, args.ignore_strand)
+        write_rows(rows, sys.stdout)
+    return 0
+
+
+def run_annotate(args):
+    with compressed_io.open_input(args.a) as a_inf, compressed_io.open_input(args.b) as b_inf:
+        with compressed_io.open_output(args.outf) as outf:
+            rows = annotate(read_bedpe(a_inf), read_bedpe(b_inf),
+                            file_label(args.a), file_label(args.b),
+                            args.slop, args.ignore_strand)
+            write_rows(rows, outf)
+    return 0
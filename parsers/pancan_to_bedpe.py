@@ -8,49 +8,38 @@ If no <input_file> and/or <output_file> is specified, the file will read/write
 from/to STDIN/STDOUT, allowing for piping into and out of the program.
 '''
 
-import argparse,sys,csv,codecs
+import sys
 
-sys.stdin = codecs.getreader('utf8')(sys.stdin)
-sys.stdout = codecs.getwriter('utf8')(sys.stdout)
+import bedpe_engine
 
-def map_fields(input_row, headings):
+def strand_symbol(value):
+    '''Map a numeric strand (1/-1) to a BEDPE strand'''
+    strand = int(value)
+    return '-' if strand == -1 else '+' if strand == 1 else '.'
+
+
+def compile_core(index):
     '''
-    Map fields from the input row to bedpe_fields
+    Compile the mapping from input columns to the core BEDPE fields
 
     Args:
-        input_row (dict): {'heading': value} mapping for one row in input
-        headings (list): A list of all BEDPE headings to include
+        index (dict): {'heading': position} mapping for the input header
     Returns:
-        dict: the return value. A single BEDPE row
+        function: maps one input row (list) to a list of BEDPE values
     '''
-    out_row = dict()
-
-    out_row['chrom1'] = 'chr{num}'.format(num=input_row['A_chr'])
-    out_row['start1'] = input_row['gene_A_start'] # assuming 0-based
-    out_row['end1'] = int(input_row['gene_A_end'])
-
-    A_strand = int(input_row['A_strand'])
-    out_row['strand1'] = '-' if A_strand == -1 else '+' if A_strand == 1 else '.'
-
-    out_row['chrom2'] = 'chr{num}'.format(num=input_row['B_chr'])
-    out_row['start2'] = input_row['gene_B_start'] # assuming 0-based
-    out_row['end2'] = int(input_row['gene_B_end'])
-
-    B_strand = int(input_row['B_strand'])
-    out_row['strand2'] = '-' if B_strand == -1 else '+' if B_strand == 1 else '.'
+    chr1, start1, end1 = index['A_chr'], index['gene_A_start'], index['gene_A_end']
+    chr2, start2, end2 = index['B_chr'], index['gene_B_start'], index['gene_B_end']
+    strand1, strand2 = index['A_strand'], index['B_strand']
+    gene1, gene2 = index['Gene_A'], index['Gene_B']
+    score = index['centrality']
 
-    gene1 = input_row['Gene_A']
-    gene2 = input_row['Gene_B']
-    out_row['name'] = '{G1}-{G2}'.format(G1=gene1, G2=gene2)
-
-    out_row['score'] = input_row['centrality']
-
-    for heading in headings:
-        if (heading not in out_row) and (heading in input_row):
-            out_row[heading] = input_row[heading]
-        elif heading not in out_row:
-            out_row[heading] = '.'
-    return out_row
+    def map_core(row):
+        # assuming 0-based
+        return ['chr' + row[chr1], row[start1], int(row[end1]),
+                'chr' + row[chr2], row[start2], int(row[end2]),
+                row[gene1] + '-' + row[gene2], row[score],
+                strand_symbol(row[strand1]), strand_symbol(row[strand2])]
+    return map_core
 
 
 def add_fields(bedpe_fields):
@@ -61,45 +50,23 @@ def add_fields(bedpe_fields):
     return bedpe_fields + to_add
 
 
+CONVERTER = bedpe_engine.Converter('pancan', compile_core,
+                                   extra_fields=add_fields([]),
+                                   signature=['Gene_A', 'Gene_B', 'A_chr', 'B_chr'])
+
+
 def get_parser():
-    parser = argparse.ArgumentParser()
-    parser.add_argument('-i', dest='inf', metavar='<in-file>',
-                        help='File to parse (default STDIN)')
-    parser.add_argument('-o', dest='outf', metavar='<out-file>',
-                        help='Output BEDPE destination (default STDOUT)')
-    return parser
+    return bedpe_engine.get_parser()
 
 
 def main():
     '''
     Convert PanCan Database file to BEDPE format.
     '''
-    # Get args
-    parser = get_parser()
-    args = parser.parse_args()
-    with open(args.inf, 'rU') if args.inf else sys.stdin as inf:
-        with open(args.outf, 'wb') if args.outf else sys.stdout as outf:
-            #
-            # Organize I/O
-            #
-
-            # Input file is tab delimited plus heading
-            reader = csv.DictReader(inf, delimiter='\t')
-
-            # Output is always BEDPE
-            init_fieldnames = ['chrom1', 'start1', 'end1', 'chrom2', 'start2',
-                                'end2', 'name', 'score', 'strand1', 'strand2']
-            fieldnames = add_fields(init_fieldnames)
-            writer = csv.DictWriter(outf, fieldnames=fieldnames,
-                                    lineterminator='\n', delimiter='\t')
-            writer.writeheader()
-            for in_row in reader:
-                out_row = map_fields(in_row, fieldnames)
-                writer.writerow(out_row)
-    return 0
+    return bedpe_engine.main(CONVERTER)
 
 
 
 
 if __name__ == '__main__':
-    main()
+    sys.exit(main())
@@ -0,0 +1,71 @@
+'''
+Convert PAVfinder output (events.bedpe) to BEDPE format.
+
+PAVfinder already writes BEDPE, but with a '#chrom1' heading; the core
+columns are read by heading and everything after them is passed through.
+
+Can be run from the commandline with:
+    python pavfinder_to_bedpe.py -i <input_file> -o <output_file>
+
+If no <input_file> and/or <output_file> is specified, the file will read/write
+from/to STDIN/STDOUT, allowing for piping into and out of the program.
+'''
+
+import sys
+
+import bedpe_engine
+
+CORE_HEADINGS = ['#chrom1', 'start1', 'end1', 'chrom2', 'start2', 'end2',
+                 'name', 'score', 'strand1', 'strand2']
+
+def compile_core(index):
+    '''
+    Compile the mapping from input columns to the core BEDPE fields
+
+    Args:
+        index (dict): {'heading': position} mapping for the input header
+    Returns:
+        function: maps one input row (list) to a list of BEDPE values
+    '''
+    chr1, start1, end1 = index['#chrom1'], index['start1'], index['end1']
+    chr2, start2, end2 = index['chrom2'], index['start2'], index['end2']
+    name = index['name']
+    # Older events files stop at the name
+    score = index.get('score')
+    strand1, strand2 = index.get('strand1'), index.get('strand2')
+    def map_core(row):
+        return [row[chr1], int(row[start1]), int(row[end1]),
+                row[chr2], int(row[start2]), int(row[end2]),
+                row[name], row[score] if score is not None else 0,
+                row[strand1] if strand1 is not None else '.',
+                row[strand2] if strand2 is not None else '.']
+    return map_core
+
+
+def add_fields(bedpe_fields, input_fields):
+    '''Add fields from input to end of BEDPE format'''
+    to_add = [elem for elem in input_fields if elem not in CORE_HEADINGS]
+    return bedpe_fields + to_add
+
+
+CONVERTER = bedpe_engine.Converter('pavfinder', compile_core,
+                                   extra_fields=lambda in_fields: add_fields([], in_fields),
+                                   signature=['#chrom1', 'start1', 'end1',
+                                              'chrom2', 'start2', 'end2', 'name'])
+
+
+def get_parser():
+    return bedpe_engine.get_parser()
+
+
+def main():
+    '''
+    Convert PAVfinder output to BEDPE format.
+    '''
+    return bedpe_engine.main(CONVERTER)
+
+
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,336 @@
+'''
+Incremental, content-addressed runner for the conversion pipeline.
+
+Replaces the per-sample rules of pipeline/Makefile. The runner scans a
+<caller>/<sample>/<file> tree (see batch_convert.py) and builds a DAG with,
+for every sample,
+
+    convert    one per recognised caller output -> <sample>.<caller>.bedpe and
+                                                    <sample>.<caller>.bedpe.validated
+    merge      all converted files of the sample -> <sample>.merged.tsv
+
+Converted rows are validated as they are written, so a BEDPE file is never
+read back just to check it.
+
+deFuse and PAVfinder outputs are registered formats like the others, so
+no stage starts an R interpreter or copies a file just to fix its heading.
+
+Each node has a key: the SHA-256 of its stage, the source of the code it
+runs (its stage's module and every parsers module that imports, directly or
+not), its parameters and the content hashes of its inputs. Keys of finished
+nodes are kept in <output_dir>/.fusebench-cache.json with the hash, size and
+mtime of every file involved, saved as each node finishes, so an
+interrupted run keeps the work it completed. A node is skipped when its key
+and output are unchanged, so touching an input or re-copying a cohort does
+not redo any work, and editing a converter only redoes the nodes that use
+it. Independent nodes run concurrently on a process pool.
+
+Can be run from the commandline with:
+    python fusebench.py pipeline -d <output_dir> [-j <workers>] [-n] [--force] <input_dir>
+'''
+
+import ast,hashlib,json,os,sys,time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from functools import lru_cache
+
+import batch_convert
+import bedpe_engine
+import breakpoint_index
+import compressed_io
+import merge_calls
+import registry
+import validate_bedpe
+
+CACHE_FILE = '.fusebench-cache.json'
+PARSERS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+SUMMARY_FIELDS = ['node', 'status', 'seconds', 'error']
+
+
+class Node(object):
+    '''One unit of work in the DAG'''
+
+    def __init__(self, name, stage, inputs, output, params=(), deps=(), version_files=(),
+                 reports=()):
+        self.name = name
+        self.stage = stage
+        self.inputs = list(inputs)
+        self.output = output
+        # Files written beside output in the same pass
+        self.reports = list(reports)
+        self.params = list(params)
+        self.deps = list(deps)
+        self.version_files = list(version_files)
+
+
+def module_file(name):
+    return os.path.join(PARSERS_DIR, name + '.py')
+
+
+@lru_cache(maxsize=None)
+def local_imports(name):
+    '''Return the parsers modules that module name imports'''
+    with open(module_file(name)) as inf:
+        tree = ast.parse(inf.read(), module_file(name))
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names.update(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            names.add(node.module)
+    return frozenset(name for name in names if os.path.isfile(module_file(name)))
+
+
+def code_files(modules, exclude=()):
+    '''
+    Return the source files of modules and of every parsers module they
+    import, directly or not, leaving out (and not following) exclude
+    '''
+    seen = set()
+    stack = list(modules)
+    while stack:
+        name = stack.pop()
+        if name in seen or name in exclude:
+            continue
+        seen.add(name)
+        stack.extend(local_imports(name))
+    return sorted(module_file(name) for name in seen)
+
+
+def converter_modules():
+    '''Return the names of the modules defining registered converters'''
+    return frozenset(registry.get_converter(fmt).compile_core.__module__
+                     for fmt in registry.format_names())
+
+
+def output_stem(path):
+    '''Name nodes after their BEDPE output, e.g. A34048.ericscript'''
+    return os.path.basename(path)[:-len('.bedpe')]
+
+
+def find_converts(root, outdir):
+    '''
+    Find the caller outputs of the registered formats
+
+    Returns:
+        list: (sample, caller, convert Node)
+    '''
+    found = []
+    jobs = batch_convert.assign_outputs(batch_convert.find_jobs(root), outdir)
+    converters = converter_modules()
+    for job in jobs:
+        module = registry.get_converter(job.fmt).compile_core.__module__
+        # The registry imports every converter, but a node only runs its own
+        version_files = sorted(set(code_files(['registry'], converters)) |
+                               set(code_files([module])))
+        node = Node(output_stem(job.outf_path) + '.convert', 'convert',
+                    [job.inf_path], job.outf_path, params=[job.fmt],
+                    version_files=version_files,
+                    reports=[bedpe_engine.report_path(job.outf_path)])
+        found.append((job.sample, job.caller, node))
+    return found
+
+
+def build_dag(root, outdir):
+    '''
+    Build the nodes for every sample below root
+
+    Returns:
+        list: Nodes in an order where dependencies come first
+    '''
+    nodes = []
+    by_sample = dict()
+    for sample, caller, convert in find_converts(root, outdir):
+        by_sample.setdefault(sample, []).append((caller, convert))
+        nodes.append(convert)
+    for sample in sorted(by_sample):
+        members = sorted(by_sample[sample], key=lambda member: member[1].output)
+        nodes.append(Node(sample + '.merge', 'merge',
+                          [convert.output for _, convert in members],
+                          os.path.join(outdir, sample + '.merged.tsv'),
+                          params=[caller for caller, _ in members],
+                          deps=[convert.name for _, convert in members],
+                          version_files=code_files(['merge_calls'])))
+    return nodes
+
+
+def run_stage(node):
+    '''Run one node in a worker process; raises on failure'''
+    if node.stage == 'convert':
+        registry.convert_file(node.inputs[0], node.output, node.params[0],
+                              validate_bedpe.Validator())
+    elif node.stage == 'merge':
+        with compressed_io.atomic_open(node.output) as outf:
+            merge_calls.merge(list(zip(node.params, node.inputs)), outf)
+    else:
+        raise ValueError('Unknown stage: {}'.format(node.stage))
+
+
+class Cache(object):
+    '''
+    Keys of finished nodes and hashes of the files they used
+
+    Args:
+        path (str): JSON file the cache is kept in
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        try:
+            with open(path, 'r') as inf:
+                data = json.load(inf)
+        except (IOError, OSError, ValueError):
+            data = dict()
+        self.files = data.get('files', dict())
+        self.keys = data.get('keys', dict())
+
+    def file_hash(self, path):
+        '''Return the SHA-256 of a file, re-reading it only if it changed'''
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        entry = self.files.get(path)
+        if entry is not None and entry[:2] == [stat.st_size, stat.st_mtime_ns]:
+            return entry[2]
+        digest = breakpoint_index.file_sha256(path)
+        self.files[path] = [stat.st_size, stat.st_mtime_ns, digest]
+        return digest
+
+    def is_current(self, node, key):
+        '''Return True if node's outputs were made with key and are unchanged'''
+        for output in [node.output] + node.reports:
+            path = os.path.abspath(output)
+            entry = self.files.get(path)
+            if self.keys.get(path) != key or entry is None:
+                return False
+            try:
+                stat = os.stat(path)
+            except OSError:
+                return False
+            if entry[:2] != [stat.st_size, stat.st_mtime_ns]:
+                return False
+        return True
+
+    def record(self, node, key):
+        for output in [node.output] + node.reports:
+            self.file_hash(output)
+            self.keys[os.path.abspath(output)] = key
+
+    def save(self):
+        with compressed_io.atomic_open(self.path) as outf:
+            json.dump({'files': self.files, 'keys': self.keys}, outf, sort_keys=True)
+
+
+def node_key(node, cache):
+    '''Return the content key of a node whose inputs all exist'''
+    parts = [node.stage, node.params,
+             [cache.file_hash(path) for path in node.version_files],
+             [cache.file_hash(path) for path in node.inputs]]
+    return hashlib.sha256(json.dumps(parts).encode('utf8')).hexdigest()
+
+
+def run_dag(nodes, cache, workers=None, force=False, dry_run=False):
+    '''
+    Run the nodes whose keys changed, as soon as their dependencies finish
+
+    Args:
+        nodes (list): Nodes, dependencies first
+        cache (Cache): Keys of earlier runs; updated as nodes finish
+        workers (int): Pool size (default: one per CPU)
+        force (bool): Run every node
+        dry_run (bool): Report what would run without running it
+    Yields:
+        dict: one summary row per node, as it finishes
+    '''
+    status = dict()
+    waiting = list(nodes)
+    running = dict()
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        while waiting or running:
+            still_waiting = []
+            for node in waiting:
+                dep_status = [status.get(dep) for dep in node.deps]
+                if any(state is None for state in dep_status):
+                    still_waiting.append(node)
+                    continue
+                if any(state in ('failed', 'skipped') for state in dep_status):
+                    status[node.name] = 'skipped'
+                    yield {'node': node.name, 'status': 'skipped', 'seconds': '0.000',
+                           'error': 'dependency failed'}
+                    continue
+                if dry_run and any(state == 'would run' for state in dep_status):
+                    status[node.name] = 'would run'
+                    yield {'node': node.name, 'status': 'would run', 'seconds': '0.000',
+                           'error': ''}
+                    continue
+                key = node_key(node, cache)
+                if not force and cache.is_current(node, key):
+                    status[node.name] = 'cached'
+                    yield {'node': node.name, 'status': 'cached', 'seconds': '0.000',
+                           'error': ''}
+                elif dry_run:
+                    status[node.name] = 'would run'
+                    yield {'node': node.name, 'status': 'would run', 'seconds': '0.000',
+                           'error': ''}
+                else:
+                    future = executor.submit(run_stage, node)
+                    running[future] = (node, key, time.time())
+            waiting = still_waiting
+            if not running:
+                if waiting:
+                    raise ValueError('Unresolvable dependencies: {}'.format(
+                        ', '.join(node.name for node in waiting)))
+                break
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                node, key, started = running.pop(future)
+                row = {'node': node.name, 'status': 'ran', 'error': '',
+                       'seconds': '{:.3f}'.format(time.time() - started)}
+                try:
+                    future.result()
+                    cache.record(node, key)
+                    # Saved per node, so an interrupted run keeps what it finished
+                    cache.save()
+                except Exception as err:
+                    row['status'] = 'failed'
+                    row['error'] = '{}: {}'.format(type(err).__name__, err)
+                status[node.name] = row['status']
+                yield row
+
+
+def add_pipeline_parser(subparsers):
+    parser = subparsers.add_parser('pipeline',
+                                   help='Convert, validate and merge a cohort incrementally')
+    parser.add_argument('root', metavar='<in-dir>',
+                        help='Directory of per-caller, per-sample outputs')
+    parser.add_argument('-d', dest='outdir', metavar='<out-dir>', required=True,
+                        help='Directory receiving the results and the run cache')
+    parser.add_argument('-j', dest='workers', metavar='<workers>', type=int,
+                        help='Number of worker processes (default: one per CPU)')
+    parser.add_argument('-n', dest='dry_run', action='store_true',
+                        help='Only report which nodes would run')
+    parser.add_argument('--force', action='store_true',
+                        help='Run every node, ignoring the cache')
+    parser.set_defaults(func=run_pipeline)
+    return parser
+
+
+def run_pipeline(args):
+    if not os.path.isdir(args.outdir):
+        os.makedirs(args.outdir)
+    nodes = build_dag(args.root, args.outdir)
+    cache = Cache(os.path.join(args.outdir, CACHE_FILE))
+    counts = dict()
+    sys.stdout.write('\t'.join(SUMMARY_FIELDS) + '\n')
+    try:
+        for row in run_dag(nodes, cache, args.workers, args.force, args.dry_run):
+            counts[row['status']] = counts.get(row['status'], 0) + 1
+            sys.stdout.write('\t'.join(row[field] for field in SUMMARY_FIELDS) + '\n')
+            sys.stdout.flush()
+    finally:
+        if not args.dry_run:
+            cache.save()
+    sys.stderr.write('fusebench pipeline: {}\n'.format(', '.join(
+        '{} {}'.format(count, state) for state, count in sorted(counts.items())) or 'nothing to do'))
+    return 1 if counts.get('failed') or counts.get('skipped') else 0
@@ -0,0 +1,164 @@
+'''
+Side file for input rows a converter cannot map.
+
+Without a quarantine, one malformed row (a breakpoint without a position,
+a short line, text in a numeric column) stops the whole conversion. With
+one, each such row is written to the quarantine with its line number and a
+reason, and conversion goes on with the next row:
+
+    #line  reason     detail                                  fields...
+    1042   bad_value  not enough values to unpack (expected 3, got 2)  BCR--ABL1  ...
+
+Reasons:
+
+    short_row      the row has fewer fields than the header
+    bad_value      a value could not be parsed, e.g. a position that is
+                   not an integer or a breakpoint missing its strand
+    missing_field  a column the mapping needs is absent
+    map_error      any other failure of the column mapping
+
+The fields of the row follow the reason and detail, tab separated, so the
+rows can be cut out, fixed and converted again. The file ends with a count
+per reason.
+
+Rows are mapped a batch at a time as before; only a batch that raises is
+mapped again row by row, so clean input runs at full speed.
+
+An error budget bounds how much can be quarantined: a number of rows, or a
+percentage of the rows read (e.g. '0.5%'). Past it, conversion stops with
+ErrorBudgetExceeded: no output file is left behind, but the quarantine file
+is kept, ending with the counts so far.
+'''
+
+from collections import Counter
+
+SHORT_ROW = 'short_row'
+BAD_VALUE = 'bad_value'
+MISSING_FIELD = 'missing_field'
+MAP_ERROR = 'map_error'
+
+# Rows read before a percentage budget is enforced, so that a bad row early
+# in a file is not judged against a handful of rows
+MIN_ROWS_FOR_FRACTION = 1000
+
+
+class ErrorBudgetExceeded(ValueError):
+    '''Raised when more rows are quarantined than the error budget allows'''
+
+
+def parse_budget(value):
+    '''
+    Parse an error budget
+
+    Args:
+        value (str): A number of rows, e.g. '100', or a percentage of the
+            rows read, e.g. '0.5%'
+    Returns:
+        tuple: (max rows or None, max fraction or None)
+    '''
+    value = value.strip()
+    if value.endswith('%'):
+        fraction = float(value[:-1]) / 100
+        if not 0 <= fraction <= 1:
+            raise ValueError('Error budget must be between 0% and 100%: {}'.format(value))
+        return None, fraction
+    rows = int(value)
+    if rows < 0:
+        raise ValueError('Error budget must not be negative: {}'.format(value))
+    return rows, None
+
+
+def reason(err, row, width):
+    '''Classify why a row of an input with width fields failed to map'''
+    if len(row) < width:
+        return SHORT_ROW
+    if isinstance(err, ValueError):
+        return BAD_VALUE
+    if isinstance(err, (IndexError, KeyError)):
+        return MISSING_FIELD
+    return MAP_ERROR
+
+
+class Quarantine(object):
+    '''
+    Collects rows that failed to map
+
+    Rows are only counted until a stream is attached to write them to.
+
+    Args:
+        max_rows (int): Largest number of rows to quarantine (default: no
+            limit)
+        max_fraction (float): Largest fraction of the rows read to
+            quarantine (default: no limit)
+    '''
+
+    def __init__(self, max_rows=None, max_fraction=None):
+        self.outf = None
+        self.max_rows = max_rows
+        self.max_fraction = max_fraction
+        self.counts = Counter()
+        self.rows_read = 0
+
+    def attach(self, outf):
+        '''Write quarantined rows to text stream outf from now on'''
+        self.outf = outf
+        outf.write('#line\treason\tdetail\tfields\n')
+
+    def __len__(self):
+        return sum(self.counts.values())
+
+    def add(self, number, row, err, width):
+        '''Quarantine input row (list) read from line number'''
+        why = reason(err, row, width)
+        self.counts[why] += 1
+        if self.outf is not None:
+            detail = ' '.join(str(err).split()) or type(err).__name__
+            self.outf.write('\t'.join([str(number), why, detail] + row) + '\n')
+        if self.max_rows is not None and len(self) > self.max_rows:
+            raise ErrorBudgetExceeded(
+                'More than {} rows quarantined, the last at line {}'.format(self.max_rows, number))
+
+    def map_rows(self, transform, rows, first_number, width):
+        '''
+        Map a batch of input rows, quarantining those transform rejects
+
+        Args:
+            transform (callable): Row mapping from Converter.compile
+            rows (list): Input rows; empty rows are skipped
+            first_number (int): Line number of the first row
+            width (int): Number of fields in the input header
+        Returns:
+            list: the mapped rows
+        '''
+        self.rows_read += len(rows)
+        try:
+            out_rows = [transform(row) for row in rows if row]
+        except Exception:
+            out_rows = []
+            for number, row in enumerate(rows, first_number):
+                if not row:
+                    continue
+                try:
+                    out_rows.append(transform(row))
+                except Exception as err:
+                    self.add(number, row, err, width)
+        self.check_fraction()
+        return out_rows
+
+    def check_fraction(self, final=False):
+        '''Raise ErrorBudgetExceeded if too large a share of rows failed'''
+        if self.max_fraction is None or not self.counts:
+            return
+        if not final and self.rows_read < MIN_ROWS_FOR_FRACTION:
+            return
+        if len(self) > self.max_fraction * self.rows_read:
+            raise ErrorBudgetExceeded('{} of {} rows quarantined, over {:g}%'.format(
+                len(self), self.rows_read, self.max_fraction * 100))
+
+    def write_summary(self):
+        '''Write the per-reason counts'''
+        if self.outf is None:
+            return
+        self.outf.write('#quarantined: {}\n'.format(len(self)))
+        for why, count in sorted(self.counts.items()):
+            self.outf.write('#{}: {}\n'.format(why, count))
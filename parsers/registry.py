@@ -0,0 +1,177 @@
+'''
+Registry of the input formats fusebench can convert to BEDPE.
+
+Every *_to_bedpe.py converter exposes a bedpe_engine.Converter as CONVERTER;
+this module collects them by name and detects the format of an input file by
+sniffing its header line.
+'''
+
+import itertools,sys
+
+import bedpe_engine
+import compressed_io
+import metrics
+import chimerDB_to_bedpe
+import civic_to_bedpe
+import defuse_to_bedpe
+import ericscript_to_bedpe
+import fusioncatcher_to_bedpe
+import fusionmap_to_bedpe
+import infusion_to_bedpe
+import jaffa_to_bedpe
+import pancan_to_bedpe
+import pavfinder_to_bedpe
+import soapfuse_to_bedpe
+import star_fusion_to_bedpe
+
+CONVERTERS = dict()
+
+
+def register(converter):
+    '''
+    Add a converter to the registry
+
+    Args:
+        converter (bedpe_engine.Converter): Format description to add
+    Returns:
+        bedpe_engine.Converter: the registered converter
+    '''
+    if converter.name in CONVERTERS:
+        raise ValueError('Format already registered: {}'.format(converter.name))
+    CONVERTERS[converter.name] = converter
+    return converter
+
+
+def get_converter(name):
+    '''Return the registered converter called name'''
+    try:
+        return CONVERTERS[name]
+    except KeyError:
+        raise ValueError('Unknown format: {}'.format(name))
+
+
+def format_names():
+    '''Return the names of all registered formats'''
+    return sorted(CONVERTERS)
+
+
+def detect(header_line):
+    '''
+    Find the format whose header matches header_line
+
+    Args:
+        header_line (str): First line of an input file
+    Returns:
+        bedpe_engine.Converter: the matching converter, or None
+    '''
+    for converter in CONVERTERS.values():
+        if converter.matches(header_line):
+            return converter
+    return None
+
+
+def sniff(inf):
+    '''
+    Detect the format of an open input stream without losing its header
+
+    Args:
+        inf (file): Text stream positioned at the input header
+    Returns:
+        tuple: (converter or None, iterable of all lines of inf)
+    '''
+    header_line = inf.readline()
+    return detect(header_line), itertools.chain([header_line], inf)
+
+
+def resolve(inf, fmt=None):
+    '''
+    Pick the converter for an open input stream
+
+    Args:
+        inf (file): Text stream positioned at the input header
+        fmt (str): Registered format name, or None to sniff the header
+    Returns:
+        tuple: (converter, iterable of all lines of inf)
+    '''
+    if fmt:
+        return get_converter(fmt), inf
+    converter, lines = sniff(inf)
+    if converter is None:
+        raise ValueError('Could not detect input format from header')
+    return converter, lines
+
+
+def sniff_file(path):
+    '''Return the converter matching the header of the file at path, or None'''
+    with compressed_io.open_input(path, newline='') as inf:
+        return detect(inf.readline())
+
+
+def convert_file(inf_path, outf_path, fmt=None, validator=None, normalized=True, stage=None,
+                 quarantine=None, resolver=None, where=None, sorter=None, ordered=False):
+    '''
+    Convert one file to BEDPE, detecting its format if none is given
+
+    Args:
+        inf_path (str): Input file, or None for STDIN
+        outf_path (str): Output file, or None for STDOUT
+        fmt (str): Registered format name, or None to sniff the header
+        validator (validate_bedpe.Validator): If given, rows are validated as
+            they are written and the report goes to <outf_path>.validated
+            (STDERR for STDOUT)
+        normalized (bool): Canonicalise chromosomes (see normalize.py)
+        stage (metrics.StageMetrics): If given, records rows, bytes and
+            phase times of the conversion
+        quarantine (quarantine.Quarantine): If given, rows that cannot be
+            converted go to <outf_path>.quarantine (STDERR for STDOUT)
+            instead of stopping the conversion
+        resolver (genes.GeneResolver): If given, rewrites names as current
+            gene symbols
+        where (row_filter.RowFilter): If given, rows it rejects are not
+            written
+        sorter (external_sort.ExternalSorter): If given, rows are written
+            sorted by chrom1, chrom2, start1 and start2
+        ordered (bool): With normalized, also put the lower breakpoint
+            first, losing the caller's 5'/3' order of the ends
+    Returns:
+        int: the number of rows written
+    '''
+    with compressed_io.open_input(inf_path, newline='') as inf:
+        converter, lines = resolve(inf, fmt)
+        if stage is not None:
+            stage.labels['format'] = converter.name
+        if not outf_path:
+            with bedpe_engine.open_quarantine(quarantine, None) as rejected:
+                return bedpe_engine.convert(converter, lines, sys.stdout,
+                                            validator=validator, report=sys.stderr,
+                                            normalized=normalized, stage=stage,
+                                            quarantine=rejected, resolver=resolver,
+                                            where=where, sorter=sorter, ordered=ordered)
+        with compressed_io.atomic_open(outf_path) as outf:
+            with bedpe_engine.open_quarantine(quarantine, outf_path) as rejected:
+                if validator is None:
+                    count = bedpe_engine.convert(converter, lines, outf, normalized=normalized,
+                                                 stage=stage, quarantine=rejected,
+                                                 resolver=resolver, where=where,
+                                                 sorter=sorter, ordered=ordered)
+                else:
+                    report_path = bedpe_engine.report_path(outf_path)
+                    with compressed_io.atomic_open(report_path) as report:
+                        count = bedpe_engine.convert(converter, lines, outf,
+                                                     validator=validator, report=report,
+                                                     normalized=normalized, stage=stage,
+                                                     quarantine=rejected, resolver=resolver,
+                                                     where=where, sorter=sorter,
+                                                     ordered=ordered)
+    if stage is not None:
+        stage.bytes_read = metrics.file_size(inf_path)
+        stage.bytes_written = metrics.file_size(outf_path)
+        stage.finish()
+    return count
+
+
+for module in (star_fusion_to_bedpe, fusioncatcher_to_bedpe,
+               ericscript_to_bedpe, soapfuse_to_bedpe, fusionmap_to_bedpe,
+               jaffa_to_bedpe, infusion_to_bedpe, defuse_to_bedpe, pavfinder_to_bedpe,
+               pancan_to_bedpe, civic_to_bedpe, chimerDB_to_bedpe):
+    register(module.CONVERTER)
@@ -0,0 +1,400 @@
+'''
+Row filter expressions (--where) applied while converting.
+
+Instead of writing every call and filtering on evidence columns afterwards,
+a --where expression is compiled once per input header into a predicate
+over the output rows, and rows it rejects are never written:
+
+    --where 'JunctionReadCount >= 3 and J_FFPM > 0.1'
+    --where 'Spanning_pairs + Spanning_unique_reads >= 5'
+    --where 'chrom1 != chrom2 or start2 - end1 > 100000'
+    --where "name ~ '^KMT2A-' and `spanning reads` >= 2"
+
+Strings are quoted with ' or ". Inside them, only the quote and a
+backslash are escaped (\\' and \\\\); other backslashes are kept, so regex
+escapes are written as they are: name ~ '^\\d+'.
+
+Columns are the output headings: the BEDPE core fields and the passthrough
+columns of the format. Names with other characters than letters, digits,
+'_' and '.' are written in backquotes. Operators:
+
+    comparison   ==  !=  <  <=  >  >=  (= is ==)
+    arithmetic   +  -  *  /
+    membership   <column> in (<value>, ...), <column> not in (...)
+    regex        <column> ~ '<pattern>'  (re.search)
+    logic        and  or  not  ( )
+
+Comparisons are typed when the expression is compiled. Against a number,
+or in arithmetic, a column is read as a number; against a string or a
+regex, as text. Two columns are compared as numbers by < <= > >= and as
+text by == and !=. A value that is not a number ('NA', '.', '') never
+satisfies a numeric comparison, so rows missing the evidence are dropped.
+That holds under not as well: not ... is only true for rows where every
+column it reads as a number is one, so not JunctionReadCount > 3 drops
+rows without a count too.
+
+An expression naming a column the input does not have fails when the
+converter reads the header, not row by row.
+'''
+
+import re
+
+KEYWORDS = frozenset(['and', 'or', 'not', 'in'])
+
+COMPARISONS = {'==': '==', '=': '==', '!=': '!=', '<': '<', '<=': '<=', '>': '>', '>=': '>='}
+
+TOKEN = re.compile(r'''
+    \s*(?:
+      (?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)
+    | (?P<string>'(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*")
+    | (?P<quoted>`[^`]+`)
+    | (?P<name>[A-Za-z_][A-Za-z0-9_.]*)
+    | (?P<op>==|!=|<=|>=|=|<|>|\+|-|\*|/|~|\(|\)|,)
+    )''', re.VERBOSE)
+
+NAN = float('nan')
+
+
+class FilterError(ValueError):
+    '''Raised for an expression that does not parse or does not fit the input'''
+
+
+def tokenize(expression):
+    '''Split an expression into (kind, value) tokens'''
+    tokens = []
+    position = 0
+    expression = expression.rstrip()
+    while position < len(expression):
+        match = TOKEN.match(expression, position)
+        if match is None or match.end() == position:
+            raise FilterError('Unexpected {!r} at position {} of: {}'.format(
+                expression[position:position + 10].strip(), position, expression))
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == 'number':
+            value = float(value) if any(c in value for c in '.eE') else int(value)
+        elif kind == 'string':
+            # Only \' (or \") and \\ are escapes; '\d+' reaches a regex as it is
+            value = re.sub(r'\\([\\' + value[0] + '])', r'\1', value[1:-1])
+        elif kind == 'quoted':
+            kind, value = 'name', value[1:-1]
+        elif kind == 'name' and value.lower() in KEYWORDS:
+            kind, value = 'keyword', value.lower()
+        tokens.append((kind, value))
+        position = match.end()
+    tokens.append(('end', None))
+    return tokens
+
+
+class Parser(object):
+    '''
+    Recursive-descent parser building a tuple tree:
+
+        ('or'|'and', left, right), ('not', operand),
+        ('compare', op, left, right), ('in', operand, values, negated),
+        ('match', operand, pattern), ('arith', op, left, right), ('neg', operand),
+        ('column', name), ('number', value), ('string', value)
+    '''
+
+    def __init__(self, expression):
+        self.expression = expression
+        self.tokens = tokenize(expression)
+        self.position = 0
+
+    def peek(self):
+        return self.tokens[self.position]
+
+    def take(self, kind=None, value=None):
+        token = self.tokens[self.position]
+        if (kind is not None and token[0] != kind) or (value is not None and token[1] != value):
+            expected = repr(value) if value is not None else kind
+            found = 'the end' if token[0] == 'end' else repr(token[1])
+            raise FilterError('Expected {} but found {} in: {}'.format(
+                expected, found, self.expression))
+        self.position += 1
+        return token
+
+    def accept(self, kind, value=None):
+        token = self.peek()
+        if token[0] == kind and (value is None or token[1] == value):
+            self.position += 1
+            return True
+        return False
+
+    def parse(self):
+        tree = self.parse_or()
+        self.take('end')
+        return tree
+
+    def parse_or(self):
+        tree = self.parse_and()
+        while self.accept('keyword', 'or'):
+            tree = ('or', tree, self.parse_and())
+        return tree
+
+    def parse_and(self):
+        tree = self.parse_not()
+        while self.accept('keyword', 'and'):
+            tree = ('and', tree, self.parse_not())
+        return tree
+
+    def parse_not(self):
+        if self.accept('keyword', 'not'):
+            return ('not', self.parse_not())
+        return self.parse_comparison()
+
+    def parse_comparison(self):
+        left = self.parse_sum()
+        kind, value = self.peek()
+        if kind == 'op' and value in COMPARISONS:
+            self.position += 1
+            return ('compare', COMPARISONS[value], left, self.parse_sum())
+        if kind == 'op' and value == '~':
+            self.position += 1
+            pattern = self.take('string')[1]
+            try:
+                re.compile(pattern)
+            except re.error as err:
+                raise FilterError('Bad pattern {!r}: {}'.format(pattern, err))
+            return ('match', left, pattern)
+        negated = False
+        if kind == 'keyword' and value == 'not' and self.tokens[self.position + 1] == \
+                ('keyword', 'in'):
+            self.position += 1
+            negated = True
+        if self.accept('keyword', 'in'):
+            self.take('op', '(')
+            values = [self.parse_literal()]
+            while self.accept('op', ','):
+                values.append(self.parse_literal())
+            self.take('op', ')')
+            return ('in', left, values, negated)
+        return left
+
+    def parse_literal(self):
+        negative = self.accept('op', '-')
+        kind, value = self.peek()
+        if kind == 'number':
+            self.position += 1
+            return -value if negative else value
+        if kind == 'string' and not negative:
+            self.position += 1
+            return value
+        return self.take('number')[1]
+
+    def parse_sum(self):
+        tree = self.parse_term()
+        while self.peek() in (('op', '+'), ('op', '-')):
+            tree = ('arith', self.take()[1], tree, self.parse_term())
+        return tree
+
+    def parse_term(self):
+        tree = self.parse_unary()
+        while self.peek() in (('op', '*'), ('op', '/')):
+            tree = ('arith', self.take()[1], tree, self.parse_unary())
+        return tree
+
+    def parse_unary(self):
+        if self.accept('op', '-'):
+            return ('neg', self.parse_unary())
+        kind, value = self.peek()
+        if kind in ('number', 'string'):
+            self.position += 1
+            return (kind, value)
+        if kind == 'name':
+            self.position += 1
+            return ('column', value)
+        if self.accept('op', '('):
+            tree = self.parse_or()
+            self.take('op', ')')
+            return tree
+        return self.take('name')
+
+
+def to_number(value):
+    '''Read a field as a number, NaN if it is not one'''
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return NAN
+
+
+def not_equal(a, b):
+    '''Numeric !=, false if either side is not a number'''
+    return a != b and a == a and b == b
+
+
+def divide(a, b):
+    return a / b if b else NAN
+
+
+def known(*values):
+    '''True if every value reads as a number'''
+    for value in values:
+        number = to_number(value)
+        if number != number:
+            return False
+    return True
+
+
+class Compiler(object):
+    '''Generate the Python source of a predicate for one set of output headings'''
+
+    def __init__(self, fields=None):
+        # Without fields, any column is accepted, to check types only
+        self.index = None
+        if fields is not None:
+            self.index = dict()
+            for position, field in enumerate(fields):
+                self.index.setdefault(field, position)
+        self.namespace = {'_num': to_number, '_ne': not_equal, '_div': divide,
+                          '_known': known, '_nan': NAN}
+        # Sources of the columns read as numbers in the condition being compiled
+        self.numeric = []
+
+    def constant(self, value):
+        name = '_c{}'.format(len(self.namespace))
+        self.namespace[name] = value
+        return name
+
+    def column(self, name):
+        if self.index is None:
+            return 'row[0]'
+        if name not in self.index:
+            raise FilterError('No column {!r}; columns are: {}'.format(
+                name, ', '.join(sorted(self.index))))
+        return 'row[{}]'.format(self.index[name])
+
+    def number(self, node):
+        '''Source of node as a float'''
+        kind = node[0]
+        if kind == 'number':
+            return repr(float(node[1]))
+        if kind == 'column':
+            source = self.column(node[1])
+            self.numeric.append(source)
+            return '_num({})'.format(source)
+        if kind == 'neg':
+            return '(-{})'.format(self.number(node[1]))
+        if kind == 'arith':
+            left, right = self.number(node[2]), self.number(node[3])
+            if node[1] == '/':
+                return '_div({}, {})'.format(left, right)
+            return '({} {} {})'.format(left, node[1], right)
+        raise FilterError('Expected a number or column, not {}'.format(describe(node)))
+
+    def text(self, node):
+        '''Source of node as a string'''
+        if node[0] == 'string':
+            return self.constant(node[1])
+        if node[0] == 'column':
+            return 'str({})'.format(self.column(node[1]))
+        raise FilterError('Expected a string or column, not {}'.format(describe(node)))
+
+    def condition(self, node):
+        '''Source of node as a bool'''
+        kind = node[0]
+        if kind in ('and', 'or'):
+            return '({} {} {})'.format(self.condition(node[1]), kind, self.condition(node[2]))
+        if kind == 'not':
+            outer, self.numeric = self.numeric, []
+            operand = self.condition(node[1])
+            reads = sorted(set(self.numeric))
+            self.numeric = outer + self.numeric
+            if not reads:
+                return '(not {})'.format(operand)
+            # A missing number makes the operand false, which must not make it true
+            return '(_known({}) and not {})'.format(', '.join(reads), operand)
+        if kind == 'compare':
+            _, op, left, right = node
+            if numeric_comparison(op, left, right):
+                left, right = self.number(left), self.number(right)
+                if op == '!=':
+                    return '_ne({}, {})'.format(left, right)
+                return '({} {} {})'.format(left, op, right)
+            if op not in ('==', '!='):
+                raise FilterError('Strings can only be compared with == and !=')
+            return '({} {} {})'.format(self.text(left), op, self.text(right))
+        if kind == 'in':
+            _, operand, values, negated = node
+            if all(not isinstance(value, str) for value in values):
+                source = '({} in {})'.format(self.number(operand), self.constant(
+                    frozenset(float(value) for value in values)))
+            else:
+                source = '({} in {})'.format(self.text(operand), self.constant(
+                    frozenset(str(value) for value in values)))
+            return '(not {})'.format(source) if negated else source
+        if kind == 'match':
+            pattern = self.constant(re.compile(node[2]).search)
+            return '({}({}) is not None)'.format(pattern, self.text(node[1]))
+        raise FilterError('Expected a condition, not {}'.format(describe(node)))
+
+    def compile(self, tree):
+        source = 'def _where(row):\n    return {}\n'.format(self.condition(tree))
+        exec(compile(source, '<where>', 'exec'), self.namespace)
+        return self.namespace['_where']
+
+
+def numeric_comparison(op, left, right):
+    '''Decide how a comparison is typed (see the module docstring)'''
+    kinds = set([left[0], right[0]])
+    if 'string' in kinds:
+        return False
+    if kinds & set(['number', 'arith', 'neg']):
+        return True
+    return op not in ('==', '!=')
+
+
+def describe(node):
+    if node[0] in ('number', 'string', 'column'):
+        return repr(node[1])
+    return 'a {} expression'.format(node[0])
+
+
+class RowFilter(object):
+    '''
+    A parsed --where expression
+
+    Parsing happens once, when the filter is made; compile turns it into a
+    predicate for the headings of one input.
+
+    Args:
+        expression (str): Filter expression (see the module docstring)
+    Raises:
+        FilterError: if the expression does not parse
+    '''
+
+    def __init__(self, expression):
+        self.expression = expression
+        self.tree = Parser(expression).parse()
+        # Catch type errors before any input is read
+        Compiler().condition(self.tree)
+
+    def columns(self):
+        '''Return the column names the expression uses'''
+        names = []
+        stack = [self.tree]
+        while stack:
+            node = stack.pop()
+            if node[0] == 'column':
+                names.append(node[1])
+            else:
+                stack.extend(child for child in node[1:] if isinstance(child, tuple))
+        return sorted(set(names))
+
+    def compile(self, fields):
+        '''
+        Compile the predicate for rows with the given headings
+
+        Args:
+            fields (list): Output headings, e.g. from Converter.output_fields
+        Returns:
+            function: maps one row (list) to True to keep it
+        Raises:
+            FilterError: if the expression names a column not in fields or
+                compares values of the wrong type
+        '''
+        return Compiler(fields).compile(self.tree)
+
+    def __repr__(self):
+        return 'RowFilter({!r})'.format(self.expression)
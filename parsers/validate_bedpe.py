@@ -1,15 +1,210 @@
-
 '''
-Convert Validate BEDPE format.
+Validate BEDPE format.
 
 Can be run from the commandline with:
-    python validate_bedpe.py -i <input_file>
+    python validate_bedpe.py -i <input_file> [--max-errors <n>] [--ordered]
+
+If no <input_file> is specified, the file will be read from STDIN. The report
+lists every violation with its line number and error class, followed by a
+count per error class, and is written to STDOUT. The exit status is 1 if any
+violation was found.
 
-If no <input_file> and/or <output_file> is specified, the file will read/write
-from/to STDIN/STDOUT, allowing for piping into and out of the program.
+Rows are checked a block at a time. The columns of a block are cut out of its
+text as strided slices, each column is tested with a single pattern match or
+set lookup and converted to an integer array in one go, and rows are only
+looked at individually once a column is known to contain a violation.
 '''
 
-import argparse,sys,csv
+import argparse,csv,itertools,re,sys,time
+from array import array
+from collections import Counter
+from itertools import islice
+from operator import gt, itemgetter
+
+import compressed_io
+import metrics
+import normalize
+
+REQUIRED_FIELDS = ['chrom1', 'start1', 'end1', 'chrom2', 'start2', 'end2']
+POSITION_FIELDS = ['start1', 'end1', 'start2', 'end2']
+STRAND_FIELDS = ['strand1', 'strand2']
+BEDPE_POSITIONS = dict((name, pos) for pos, name in enumerate(
+    ['chrom1', 'start1', 'end1', 'chrom2', 'start2', 'end2',
+     'name', 'score', 'strand1', 'strand2']))
+
+VALID_STRANDS = frozenset(['+', '-', '.'])
+CHROM_RE = re.compile(r'\S+\Z')
+INT_RE = re.compile(r'[+-]?\d+\Z')
+INT_BLOCK_RE = re.compile(r'(?:[+-]?\d+\n)*\Z')
+
+# Number of rows checked at a time
+BLOCK_SIZE = 65536
+
+# Error classes, in report order
+MISSING_COLUMNS = 'missing_columns'
+NOT_INTEGER = 'not_integer'
+BELOW_MINUS_ONE = 'position_below_-1'
+START_AFTER_END = 'start_after_end'
+BAD_CHROM = 'bad_chrom'
+BAD_STRAND = 'bad_strand'
+PAIR_ORDER = 'pair_order'
+
+
+def column_positions(header_fields):
+    '''
+    Find the BEDPE columns in a header
+
+    Args:
+        header_fields (list): Headings of the file, or None for a file without
+            a header, which uses the standard BEDPE column order
+    Returns:
+        dict: {'heading': position} for the BEDPE columns present
+    Raises:
+        ValueError: if a required column is missing
+    '''
+    if header_fields is None:
+        return dict(BEDPE_POSITIONS)
+    positions = dict()
+    for pos, heading in enumerate(header_fields):
+        heading = heading.lstrip('#')
+        if heading in BEDPE_POSITIONS and heading not in positions:
+            positions[heading] = pos
+    missing = [name for name in REQUIRED_FIELDS if name not in positions]
+    if missing:
+        raise ValueError('All required keys are not present: {}'.format(', '.join(missing)))
+    return positions
+
+
+def checked_fields(positions):
+    '''Return the headings checked for a file with these column positions'''
+    return REQUIRED_FIELDS + [name for name in STRAND_FIELDS if name in positions]
+
+
+def parse_positions(values):
+    '''
+    Parse a column of positions
+
+    Returns:
+        tuple: (array of integers with -1 for unparseable values,
+                indices of the unparseable values)
+    '''
+    if INT_BLOCK_RE.match('\n'.join(values) + '\n'):
+        return array('q', map(int, values)), []
+    bad = [i for i, value in enumerate(values) if not INT_RE.match(value)]
+    parsed = array('q', [-1]) * len(values)
+    skip = set(bad)
+    for i, value in enumerate(values):
+        if i not in skip:
+            parsed[i] = int(value)
+    return parsed, bad
+
+
+def validate_block(rows, lines, positions, check_order=False):
+    '''
+    Check a block of rows against the BEDPE rules
+
+    Args:
+        rows (list): Fields of each row, as strings
+        lines (sequence): Line number of each row
+        positions (dict): {'heading': position} from column_positions
+        check_order (bool): Also require the lower breakpoint first,
+            in the order used by normalize.py
+    Returns:
+        list: (line number, error class, detail) for every violation, in
+            line order
+    '''
+    errors = []
+    names = checked_fields(positions)
+    width = max(positions[name] for name in names) + 1
+    if not rows:
+        return errors
+    if min(map(len, rows)) < width:
+        kept_rows, kept_lines = [], []
+        for line, fields in zip(lines, rows):
+            if len(fields) < width:
+                errors.append((line, MISSING_COLUMNS,
+                               'expected {} fields, found {}'.format(width, len(fields))))
+            else:
+                kept_rows.append(fields)
+                kept_lines.append(line)
+        rows, lines = kept_rows, kept_lines
+        if not rows:
+            return errors
+    get = itemgetter(*[positions[name] for name in names])
+    columns = dict(zip(names, zip(*map(get, rows))))
+    errors.extend(validate_columns(columns, lines, check_order))
+    errors.sort(key=itemgetter(0))
+    return errors
+
+
+def validate_columns(columns, lines, check_order=False):
+    '''
+    Check columns of a block against the BEDPE rules
+
+    Args:
+        columns (dict): {'heading': sequence of strings} for the required
+            columns and any strand columns
+        lines (sequence): Line number of each row
+        check_order (bool): Also require the lower breakpoint first,
+            in the order used by normalize.py
+    Returns:
+        list: (line number, error class, detail) for every violation, in
+            line order
+    '''
+    errors = []
+
+    # Positions must be integers no smaller than -1
+    parsed = dict()
+    unparsed = set()
+    for name in POSITION_FIELDS:
+        values, bad = parse_positions(columns[name])
+        parsed[name] = values
+        for i in bad:
+            errors.append((lines[i], NOT_INTEGER, '{}={!r}'.format(name, columns[name][i])))
+        unparsed.update(bad)
+        if values and min(values) < -1:
+            for i, value in enumerate(values):
+                if value < -1:
+                    errors.append((lines[i], BELOW_MINUS_ONE, '{}={}'.format(name, value)))
+
+    # Each end must not start after it ends
+    for start, end in (('start1', 'end1'), ('start2', 'end2')):
+        starts, ends = parsed[start], parsed[end]
+        if any(map(gt, starts, ends)):
+            for i, (s, e) in enumerate(zip(starts, ends)):
+                if s > e and i not in unparsed:
+                    errors.append((lines[i], START_AFTER_END,
+                                   '{}={} > {}={}'.format(start, s, end, e)))
+
+    # Chromosome and strand vocabularies
+    for name in ('chrom1', 'chrom2'):
+        bad_values = set(value for value in set(columns[name]) if not CHROM_RE.match(value))
+        if bad_values:
+            for i, value in enumerate(columns[name]):
+                if value in bad_values:
+                    errors.append((lines[i], BAD_CHROM, '{}={!r}'.format(name, value)))
+    for name in STRAND_FIELDS:
+        if name not in columns:
+            continue
+        bad_values = set(columns[name]) - VALID_STRANDS
+        if bad_values:
+            for i, value in enumerate(columns[name]):
+                if value in bad_values:
+                    errors.append((lines[i], BAD_STRAND, '{}={!r}'.format(name, value)))
+
+    if check_order:
+        chroms1, chroms2 = columns['chrom1'], columns['chrom2']
+        starts1, starts2 = parsed['start1'], parsed['start2']
+        for i in range(len(lines)):
+            if i not in unparsed and not normalize.is_ordered(chroms1[i], starts1[i],
+                                                              chroms2[i], starts2[i]):
+                errors.append((lines[i], PAIR_ORDER,
+                               '{}:{} after {}:{}'.format(chroms1[i], starts1[i],
+                                                         chroms2[i], starts2[i])))
+
+    errors.sort(key=itemgetter(0))
+    return errors
+
 
 def validate_row(input_row):
     '''
@@ -20,36 +215,263 @@ def validate_row(input_row):
     Returns:
         bool: the return value. true if a valid row false otherwise
     '''
-
-    #only read required columns
+    # csv.DictReader keys the extra fields of a long row by None
+    headings = [heading for heading in input_row if heading is not None]
     try:
-        ch1 = input_row['chrom1']
-        start1 = input_row['start1']
-        end1 = input_row['end1']
-        ch2 = input_row['chrom2']
-        start2 = input_row['start2']
-        end2 = input_row['end2']
-    except:
-        print("All required keys are not present")
+        positions = column_positions(headings)
+    except ValueError:
         return False
+    fields = [input_row[heading] for heading in headings]
+    # and fills the missing fields of a short row with None, which makes
+    # the row a missing_columns violation
+    if None in fields:
+        fields = fields[:fields.index(None)]
+    return not validate_block([fields], [0], positions)
 
 
-    if((not start1.lstrip('-+').isdigit()) or (not end1.lstrip('-+').isdigit()) or (not start2.lstrip('-+').isdigit()) or (not end2.lstrip('-+').isdigit())):
-        print("positions are not digits start1:{}, end1:{}, start2:{}, end2:{}".format(start1,end1, start2, end2))
-        return False
-    elif((int(start1) < -1) or (int(end1) < -1) or (int(start2) < -1) or (int(end2) < -1)):
-        print("positions are < -1")
-        return False
+class Validator(object):
+    '''
+    Accumulates the results of validating one file block by block.
+
+    Args:
+        positions (dict): {'heading': position} from column_positions; may
+            be set later with set_header
+        max_errors (int): Stop after this many violations (default: no limit)
+        check_order (bool): Also require the lower breakpoint first,
+            in the order used by normalize.py
+    '''
+
+    def __init__(self, positions=None, max_errors=None, check_order=False):
+        self.positions = positions
+        self.max_errors = max_errors
+        self.check_order = check_order
+        self.rows = 0
+        self.counts = Counter()
+        self.stopped = False
+
+    def set_header(self, header_fields):
+        '''Take the column positions from a header (see column_positions)'''
+        self.positions = column_positions(header_fields)
+
+    def check_values(self, rows, number):
+        '''
+        Validate rows of output values as they will be written
+
+        Args:
+            rows (list): Rows of values of any type, e.g. from a converter
+            number (int): Line number the first row will be written at
+        Returns:
+            list: the violations found, truncated at max_errors
+        '''
+        if self.stopped or not rows:
+            return []
+        lines = range(number, number + len(rows))
+        names = checked_fields(self.positions)
+        if min(map(len, rows)) <= max(self.positions[name] for name in names):
+            return self.check([list(map(str, row)) for row in rows], lines)
+        get = itemgetter(*[self.positions[name] for name in names])
+        columns = dict((name, list(map(str, values)))
+                       for name, values in zip(names, zip(*map(get, rows))))
+        self.rows += len(rows)
+        return self.limit(validate_columns(columns, lines, self.check_order))
+
+    def check(self, rows, lines):
+        '''
+        Validate one block of rows, numbered by lines
+
+        Returns:
+            list: the violations found, truncated at max_errors
+        '''
+        self.rows += len(rows)
+        return self.limit(validate_block(rows, lines, self.positions, self.check_order))
+
+    def check_lines(self, block, number):
+        '''
+        Validate one block of raw lines, the first of which is line number
+
+        Returns:
+            list: the violations found, truncated at max_errors
+        '''
+        columns = split_columns(block, self.positions)
+        if columns is None:
+            rows, lines = split_rows(block, number)
+            return self.check(rows, lines)
+        self.rows += len(block)
+        lines = range(number, number + len(block))
+        return self.limit(validate_columns(columns, lines, self.check_order))
+
+    def limit(self, errors):
+        '''Count errors, truncating them at max_errors'''
+        if self.max_errors is not None:
+            room = self.max_errors - sum(self.counts.values())
+            # Only stop once an error is actually dropped
+            if len(errors) > room:
+                errors = errors[:room]
+                self.stopped = True
+        self.counts.update(error for _, error, _ in errors)
+        return errors
+
+    def is_valid(self):
+        return not self.counts
+
+    def write_summary(self, outf):
+        '''Write the per-class counts and verdict'''
+        outf.write('#lines: {}\n'.format(self.rows))
+        outf.write('#errors: {}\n'.format(sum(self.counts.values())))
+        for error, count in sorted(self.counts.items()):
+            outf.write('#{}: {}\n'.format(error, count))
+        if self.stopped:
+            outf.write('#stopped after {} errors\n'.format(self.max_errors))
+        outf.write('Valid BEDPE file\n' if self.is_valid() else 'Invalid BEDPE file\n')
+
+
+def write_report_header(outf):
+    outf.write('line\terror\tdetail\n')
+
+
+def write_errors(errors, outf):
+    for line, error, detail in errors:
+        outf.write('{}\t{}\t{}\n'.format(line, error, detail))
+
+
+def read_header(inf):
+    '''
+    Read up to and including the header of a BEDPE stream
+
+    Returns:
+        tuple: (header fields or None, lines consumed, first data line or None)
+    '''
+    number = 0
+    for line in inf:
+        number += 1
+        if not line.strip():
+            continue
+        fields = line.rstrip('\r\n').split('\t')
+        if line.startswith('#'):
+            if len(fields) > 1 and fields[1] == 'start1':
+                return fields, number, None
+            continue
+        if len(fields) > 1 and INT_RE.match(fields[1]):
+            return None, number - 1, line
+        return fields, number, None
+    return None, number, None
+
+
+def split_columns(block, positions):
+    '''
+    Cut the BEDPE columns out of a block of lines without splitting rows
+
+    This only applies when every line has the same number of fields and
+    there are no comment or blank lines; the columns are then strided slices
+    of the block's fields.
+
+    Returns:
+        dict: {'heading': list of strings}, or None if the block is irregular
+    '''
+    tabs = set(map(str.count, block, itertools.repeat('\t')))
+    if len(tabs) != 1:
+        return None
+    text = ''.join(block)
+    if text.startswith('#') or '\n#' in text or '\n\n' in text or '\r' in text:
+        return None
+    width = tabs.pop() + 1
+    names = checked_fields(positions)
+    if max(positions[name] for name in names) >= width:
+        return None
+    fields = text.rstrip('\n').replace('\n', '\t').split('\t')
+    if len(fields) != width * len(block):
+        return None
+    return dict((name, fields[positions[name]::width]) for name in names)
+
+
+def split_rows(block, number):
+    '''
+    Split a block of lines into rows, dropping comment and blank lines
+
+    Returns:
+        tuple: (list of row fields, list of their line numbers)
+    '''
+    rows, lines = [], []
+    for i, fields in enumerate(csv.reader(block, delimiter='\t', quoting=csv.QUOTE_NONE)):
+        if fields and not block[i].startswith('#'):
+            rows.append(fields)
+            lines.append(number + i)
+    return rows, lines
+
+
+def iter_blocks(inf, first_number, size=None):
+    '''
+    Read a BEDPE stream a block of lines at a time
+
+    Args:
+        inf (iterable): Lines following the header
+        first_number (int): Line number of the first line of inf
+    Yields:
+        tuple: (list of lines, line number of the first of them)
+    '''
+    size = size or BLOCK_SIZE
+    number = first_number
+    while True:
+        block = list(islice(inf, size))
+        if not block:
+            return
+        yield block, number
+        number += len(block)
 
-    return True
 
+def validate_stream(inf, outf, max_errors=None, check_order=False, stage=None):
+    '''
+    Validate a BEDPE stream, writing each violation as it is found
 
+    Args:
+        stage (metrics.StageMetrics): If given, counts rows and times the
+            parse, check and report phases
+    Returns:
+        Validator: the accumulated results, or None if the header is unusable
+    '''
+    header, consumed, first_line = read_header(inf)
+    write_report_header(outf)
+    try:
+        positions = column_positions(header)
+    except ValueError as err:
+        write_errors([(consumed, MISSING_COLUMNS, str(err))], outf)
+        return None
+    if first_line is not None:
+        inf = itertools.chain([first_line], inf)
+    validator = Validator(positions, max_errors, check_order)
+    clock = time.perf_counter
+    blocks = iter_blocks(inf, consumed + 1)
+    while True:
+        started = clock()
+        block, number = next(blocks, (None, None))
+        if block is None:
+            break
+        parsed = clock()
+        errors = validator.check_lines(block, number)
+        checked = clock()
+        write_errors(errors, outf)
+        if stage is not None:
+            stage.rows_in += len(block)
+            stage.add('parse', parsed - started)
+            stage.add('check', checked - parsed)
+            stage.add('report', clock() - checked)
+        if validator.stopped:
+            break
+    validator.write_summary(outf)
+    if stage is not None:
+        stage.rows_out = validator.rows
+    return validator
 
 
 def get_parser():
     parser = argparse.ArgumentParser()
     parser.add_argument('-i', dest='inf', metavar='<in-file>',
                         help='File to parse (default STDIN)')
+    parser.add_argument('--max-errors', dest='max_errors', type=int, metavar='<n>',
+                        help='Stop after <n> violations (default: report all)')
+    parser.add_argument('--ordered', dest='check_order', action='store_true',
+                        help='Require the lower breakpoint first (see normalize.py)')
+    metrics.add_metrics_arguments(parser)
     return parser
 
 
@@ -60,25 +482,20 @@ def main():
     # Get args
     parser = get_parser()
     args = parser.parse_args()
-    with open(args.inf, 'r') if args.inf else sys.stdin as inf:
-        reader = csv.DictReader(filter(lambda row: row[0] != '#', inf), delimiter='\t')
-
-        # Output is always BEDPE
-
-        line = 0
+    return metrics.run_instrumented(args, 'validate', lambda run: validate_main(args, run))
 
-        for in_row in reader:
-            if(not validate_row(in_row)):
-                print("not a valid line, breaks at line {}\n{}".format(line,in_row))
-                break
-            line += 1
 
-    print("#lines: {}".format(line))
-    print("Valid BEDPE file")
-    return 0
+def validate_main(args, run=None):
+    stage = run.stage('validate', input=args.inf or '-') if run else None
+    with compressed_io.open_input(args.inf) as inf:
+        validator = validate_stream(inf, sys.stdout, args.max_errors, args.check_order, stage)
+    if stage is not None:
+        stage.bytes_read = metrics.file_size(args.inf)
+        stage.finish()
+    return 0 if validator is not None and validator.is_valid() else 1
 
 
 
 
 if __name__ == '__main__':
-    main()
+    sys.exit(main())